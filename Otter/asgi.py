@@ -0,0 +1,23 @@
+"""
+ASGI config for Otter project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+The I/O-bound endpoints are served by async views (see ``Otter.asgi_urls``),
+push status event streams by ``api.sse``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Otter.settings")
+os.environ.setdefault("OTTER_URLCONF", "Otter.asgi_urls")
+
+django_application = get_asgi_application()
+
+from api.sse import PushStatusEventsMiddleware  # noqa: E402
+
+application = PushStatusEventsMiddleware(django_application)
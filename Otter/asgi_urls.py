@@ -0,0 +1,10 @@
+"""Otter ASGI URL Configuration
+
+Same routes as `Otter.urls`, with the I/O-bound endpoints served by async views.
+"""
+from django.urls import include, path
+from .urls import urlpatterns as wsgi_urlpatterns
+
+urlpatterns = [
+    path('', include('api.async_routers')),
+] + wsgi_urlpatterns
@@ -0,0 +1,55 @@
+"""
+DATABASES of every OTTER_DB_PROFILE:
+  sqlite   - local file, WAL mode and tuned pragmas (see SQLITE_PRAGMAS)
+  postgres - server database, usually behind a connection pooler such as PgBouncer
+"""
+import os
+from django.core.exceptions import ImproperlyConfigured
+
+
+def _sqlite(environ, base_dir):
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': environ.get('OTTER_DB_NAME', os.path.join(base_dir, 'db.sqlite3')),
+        'CONN_MAX_AGE': int(environ.get('OTTER_DB_CONN_MAX_AGE', 600)),
+        'OPTIONS': {
+            # Seconds a query waits on a locked database, the only busy timeout: not set again as a pragma
+            'timeout': float(environ.get('OTTER_DB_TIMEOUT', 5)),
+        },
+    }
+
+
+def _postgres(environ, base_dir):
+    return {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': environ.get('OTTER_DB_NAME', 'otter'),
+        'USER': environ.get('OTTER_DB_USER', 'otter'),
+        'PASSWORD': environ.get('OTTER_DB_PASSWORD', ''),
+        'HOST': environ.get('OTTER_DB_HOST', 'localhost'),
+        'PORT': environ.get('OTTER_DB_PORT', '6432'),
+        'CONN_MAX_AGE': int(environ.get('OTTER_DB_CONN_MAX_AGE', 60)),
+        # Transaction pooling cannot keep server-side cursors open between transactions
+        'DISABLE_SERVER_SIDE_CURSORS': environ.get('OTTER_DB_TRANSACTION_POOLING', '1') == '1',
+    }
+
+
+DB_PROFILES = {
+    'sqlite': _sqlite,
+    'postgres': _postgres,
+}
+
+
+def get_databases(profile, environ, base_dir):
+    """
+    DATABASES setting of a storage profile
+    :param profile: sqlite/postgres
+    :param environ: Environment with the OTTER_DB_* variables
+    :param base_dir: Project directory, home of the SQLite file
+    :return: DATABASES dict
+    :raise ImproperlyConfigured: Unknown profile
+    """
+    if profile not in DB_PROFILES:
+        raise ImproperlyConfigured('Unknown OTTER_DB_PROFILE {!r}, expected one of: {}'.format(
+            profile, ', '.join(sorted(DB_PROFILES)),
+        ))
+    return {'default': DB_PROFILES[profile](environ, base_dir)}
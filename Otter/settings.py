@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.0/ref/settings/
 """
 
 import os
+from .databases import get_databases
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -50,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,7 +61,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'Otter.urls'
+ROOT_URLCONF = os.environ.get('OTTER_URLCONF', 'Otter.urls')
 
 TEMPLATES = [
     {
@@ -80,14 +82,29 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'Otter.wsgi.application'
 
+ASGI_APPLICATION = 'Otter.asgi.application'
+
 
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
+# OTTER_DB_PROFILE selects the storage profile, sqlite or postgres (see `Otter.databases`)
+
+DB_PROFILE = os.environ.get('OTTER_DB_PROFILE', 'sqlite')
+DATABASES = get_databases(DB_PROFILE, os.environ, BASE_DIR)
+
+# Applied to every new SQLite connection (see `api.signals`), the busy timeout is the sqlite profile's `timeout` option
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+}
 
-DATABASES = {
+
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -137,3 +154,99 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 FCM_DJANGO_SETTINGS = {
     'FCM_SERVER_KEY': 'AAAAnIhw2xo:APA91bF6bOvJfUygydBXkJP9DSGPaptGbs3P0g9FwbUxi3oY90OuaIZHb8KD8MsGCKTS8lh1_wey5h2SperW7t6Jp4_RV3HQk3isfMkk881N1FEsPSwwUpF-HWfP91kRMUUjJhRQ16rA',
 }
+
+# OTP batch generation
+OTP_BULK_MAX_ITEMS = 10000
+OTP_BULK_BATCH_SIZE = 500
+
+# OTP verification engine
+OTP_ENGINE_CACHE_SIZE = 10000
+OTP_TOTP_VALID_WINDOW = 0
+OTP_HOTP_LOOK_AHEAD = 10
+# Retries of a HOTP counter query while SQLite reports a locked table, the backoff doubles every retry
+OTP_HOTP_LOCK_RETRIES = 5
+OTP_HOTP_LOCK_BACKOFF = 0.005
+
+# Pre-generated base32 secrets, refilled from os.urandom in batches
+OTP_ENTROPY_POOL_SIZE = 4096
+OTP_ENTROPY_LOW_WATER = 1024
+
+# Cold start of a worker up to its first request (in seconds), see `manage.py profile_imports`
+WORKER_STARTUP_BUDGET = 2.0
+
+# PyOTP cache of the verify path: a per-process LRU of OTP_CACHE_MAX_SIZE objects, like the replay guard
+# and the challenge store. Other workers see saves only after OTP_CACHE_TTL.
+# 'api.cache.SharedPyOTPCache' shares it through the OTP_CACHE_ALIAS cache instead, which then stores
+# secrets and must be a dedicated, size-bounded backend (memcached/redis) trusted like the database.
+OTP_CACHE = 'api.cache.PyOTPCache'
+OTP_CACHE_ALIAS = 'default'
+OTP_CACHE_MAX_SIZE = 10000
+OTP_CACHE_TTL = 300
+
+# Bearer token of the Prometheus scraper on metrics/, staff sessions are always allowed
+METRICS_TOKEN = os.environ.get('OTTER_METRICS_TOKEN')
+
+# QR rendering of provisioning URIs
+QR_RENDER_WORKERS = 2
+QR_RENDER_MAX_PENDING = 16
+QR_RENDER_TIMEOUT = 10
+
+# Push dispatch queue, FCM_PUSH_TRANSPORT = 'api.push.LocalTransport' fakes Firebase
+FCM_PUSH_TRANSPORT = 'api.push.FCMTransport'
+FCM_PUSH_WORKERS = 2
+FCM_PUSH_QUEUE_SIZE = 10000
+FCM_PUSH_BATCH_SIZE = 500
+FCM_PUSH_RESULTS_SIZE = 1000
+
+# verify_push callback delivery
+PUSH_CALLBACK_URL = os.environ.get('PUSH_CALLBACK_URL', 'http://161.246.5.9')
+PUSH_CALLBACK_TIMEOUT = 5
+PUSH_CALLBACK_RETRIES = 3
+PUSH_CALLBACK_BACKOFF = 0.5
+PUSH_CALLBACK_POOL_SIZE = 10
+PUSH_CALLBACK_WORKERS = 2
+PUSH_CALLBACK_QUEUE_SIZE = 1000
+
+# Pending push approvals, long-polled on push-status/ and streamed on push-status/.../events/ (ASGI).
+# 'api.challenges.CacheChallengeStore' shares them between workers through OTP_CHALLENGE_CACHE
+OTP_CHALLENGE_STORE = 'api.challenges.LocalChallengeStore'
+OTP_CHALLENGE_TTL = 120
+OTP_CHALLENGE_RESULT_TTL = 60
+OTP_CHALLENGE_MAX_SIZE = 100000
+OTP_CHALLENGE_MAX_WAIT = 25
+OTP_CHALLENGE_KEEPALIVE = 15
+OTP_CHALLENGE_POLL_INTERVAL = 0.5
+OTP_CHALLENGE_CACHE = 'default'
+
+# Retention of PyOTP rows (in seconds after creation, None keeps forever), see `manage.py purge_expired_otps`
+OTP_RETENTION = {
+    'totp': 24 * 60 * 60,
+    'hotp': 30 * 24 * 60 * 60,
+}
+OTP_RETENTION_CHUNK_SIZE = 1000
+OTP_RETENTION_KEEP_ENROLLED = True
+
+# Rows per query of the audit export, see `manage.py export_otps` and export/pyotp/
+OTP_EXPORT_CHUNK_SIZE = 2000
+
+# Records per transaction of `manage.py import_otps`
+OTP_IMPORT_CHUNK_SIZE = 1000
+
+# TOTP replay protection, 'api.replay.CacheReplayGuard' shares it between workers through OTP_REPLAY_CACHE
+OTP_REPLAY_GUARD = 'api.replay.LocalReplayGuard'
+OTP_REPLAY_GUARD_MAX_SIZE = 100000
+OTP_REPLAY_CACHE = 'default'
+
+# Brute-force throttling of the verify endpoints, token buckets per client IP and per PyOTP uuid
+OTP_THROTTLE_RATES = {
+    'ip': '120/min',
+    'uuid': '10/min',
+}
+OTP_THROTTLE_SHARDS = 64
+OTP_THROTTLE_MAX_KEYS = 100000
+
+# The throttles key on the client IP: X-Forwarded-For is only trusted for this many proxies in front of Otter,
+# with 0 it is ignored and REMOTE_ADDR is used
+REST_FRAMEWORK = {
+    'NUM_PROXIES': int(os.environ.get('OTTER_NUM_PROXIES', 0)),
+}
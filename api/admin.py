@@ -1,18 +1,113 @@
+import uuid
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.models import Group
 from . import models
 
+BEFORE_VAR = 'before'
+AFTER_VAR = 'after'
 
-class PyOTPAdmin(admin.ModelAdmin):
+
+class KeysetChangeList(ChangeList):
+    """
+    Change list paginated on the primary key instead of OFFSET, and without COUNT(*).
+    `?before=<pk>` shows the rows older than pk, `?after=<pk>` the rows newer than pk.
+    """
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(BEFORE_VAR, None)
+        lookup_params.pop(AFTER_VAR, None)
+        return lookup_params
+
+    def _get_cursor(self, request, name):
+        value = request.GET.get(name)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise IncorrectLookupParameters('Invalid cursor {}={}'.format(name, value))
+
+    def get_results(self, request):
+        before = self._get_cursor(request, BEFORE_VAR)
+        after = self._get_cursor(request, AFTER_VAR)
+        size = self.list_per_page
+        queryset = self.queryset.order_by('-pk')
+
+        if after is not None:
+            rows = list(queryset.filter(pk__gt=after).reverse()[:size + 1])
+            self.has_previous = len(rows) > size
+            self.has_next = True
+            result_list = rows[:size][::-1]
+        else:
+            if before is not None:
+                queryset = queryset.filter(pk__lt=before)
+            rows = list(queryset[:size + 1])
+            self.has_previous = before is not None
+            self.has_next = len(rows) > size
+            result_list = rows[:size]
+
+        self.result_list = result_list
+        self.result_count = len(result_list)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = self.has_previous or self.has_next
+        self.paginator = None
+
+    @property
+    def previous_query_string(self):
+        if not self.result_list:
+            return self.get_query_string(remove=[BEFORE_VAR, AFTER_VAR])
+        return self.get_query_string({AFTER_VAR: self.result_list[0].pk}, remove=[BEFORE_VAR])
+
+    @property
+    def next_query_string(self):
+        return self.get_query_string({BEFORE_VAR: self.result_list[-1].pk}, remove=[AFTER_VAR])
+
+
+class KeysetPaginationMixin(object):
+    """
+    ModelAdmin mixin for very large tables: keyset pagination, no result counts,
+    and a fixed newest-first order the pagination relies on
     """
+    change_list_template = 'admin/keyset_change_list.html'
+    show_full_result_count = False
+    sortable_by = ()
 
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+
+class PyOTPAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    """
+    PyOTP admin, every query is an indexed range scan whatever the table size
     """
     list_display = ('id', 'uuid', 'user', 'secret', 'created_at',)
     list_display_links = ('uuid',)
-    search_fields = ('uuid', 'secret',)
+    list_filter = (('created_at', admin.DateFieldListFilter),)
+    list_select_related = ('user',)
+    search_fields = ('uuid', 'user__username',)
     list_per_page = 20
     ordering = ('-id',)
 
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Exact uuid, or username prefix as an index range instead of LIKE '%...%'
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        try:
+            return queryset.filter(uuid=uuid.UUID(search_term)), False
+        except ValueError:
+            pass
+        return queryset.filter(
+            user__username__gte=search_term, user__username__lt=search_term + '\U0010ffff',
+        ), False
+
 
 admin.site.register(models.PyOTP, PyOTPAdmin)
 admin.site.unregister(Group)
@@ -0,0 +1,16 @@
+from django.urls import path, re_path
+from . import async_views
+from .routers import REFER_REGEX, UUID_REGEX
+
+urlpatterns = [
+    re_path(r'^verify-otp/(?P<otp_type>(hotp|totp))/(?P<uuid>{uuid})/$'
+            .format(uuid=UUID_REGEX), async_views.verify_otp, name='verify-otp'),
+    re_path(r'^register-push/(?P<uuid>{uuid})/$'.format(uuid=UUID_REGEX), async_views.register_push, name='register-push'),
+    re_path(r'^send-push/(?P<uuid>{uuid})/$'.format(uuid=UUID_REGEX), async_views.send_push, name='send-push'),
+    path('verify-push/', async_views.verify_push, name='verify-push'),
+    path('mobile-push/', async_views.mobile_push, name='mobile-push'),
+    re_path(r'^push-status/(?P<uuid>{uuid})/(?P<refer>{refer})/$'.format(uuid=UUID_REGEX, refer=REFER_REGEX),
+            async_views.push_status, name='push-status'),
+    # Shadows the WSGI export, see `async_views.export_otps`
+    path('export/pyotp/', async_views.export_otps, name='export-otps'),
+]
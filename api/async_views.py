@@ -0,0 +1,224 @@
+"""
+Async versions of the I/O-bound endpoints, served by the ASGI deployment (see `Otter.asgi`).
+Responses and errors match the DRF views; DB access runs through `sync_to_async`.
+"""
+import json
+from types import SimpleNamespace
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.views import exception_handler
+from . import serializers, throttling
+from .cache import get_cache
+from .callbacks import get_callback_dispatcher
+from .models import PyOTP
+
+_renderer = JSONRenderer()
+
+
+def _response(data=None, status_code=status.HTTP_200_OK, headers=None):
+    response = HttpResponse(_renderer.render(data), status=status_code, content_type=_renderer.media_type)
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return response
+
+
+def _exception_response(exc):
+    """
+    Render an APIException the way DRF's exception handler does
+    """
+    response = exception_handler(exc, {})
+    headers = {name: response[name] for name in ('WWW-Authenticate', 'Retry-After') if response.has_header(name)}
+    return _response(response.data, response.status_code, headers)
+
+
+def _check_method(request, method='POST'):
+    if request.method != method:
+        raise exceptions.MethodNotAllowed(request.method)
+
+
+def _check_throttles(request, throttle_classes, kwargs=None):
+    view = SimpleNamespace(kwargs=kwargs or {})
+    waits = []
+    for throttle_class in throttle_classes:
+        throttle = throttle_class()
+        if not throttle.allow_request(request, view):
+            waits.append(throttle.wait())
+    if waits:
+        durations = [wait for wait in waits if wait is not None]
+        raise exceptions.Throttled(max(durations, default=None))
+
+
+def _parse(request):
+    """
+    Request data, parsed like DRF's JSON/form parsers
+    """
+    if request.content_type == 'application/json':
+        if not request.body:
+            return {}
+        try:
+            return json.loads(request.body.decode(request.encoding or 'utf-8'))
+        except ValueError as exc:
+            raise exceptions.ParseError('JSON parse error - %s' % str(exc))
+    return request.POST
+
+
+def _validate(serializer_class, request):
+    serializer = serializer_class(data=_parse(request))
+    serializer.is_valid(raise_exception=True)
+    return serializer
+
+
+def _get_pyotp(uuid):
+    """
+    PyOTP object through the cache, the shared cache is network I/O: run it with `sync_to_async`
+    """
+    cache = get_cache()
+    obj = cache.get(uuid)
+    if obj is None:
+        obj = PyOTP.objects.filter(uuid=uuid).first()
+        if obj is None:
+            raise exceptions.NotFound()
+        cache.set(obj.uuid, obj)
+    return obj
+
+
+async def verify_otp(request, otp_type, uuid):
+    """
+    Async OTP Verification view
+    :return: 200 OK/400 Bad Request
+    """
+    try:
+        _check_method(request)
+        _check_throttles(request, (throttling.VerifyIPThrottle, throttling.VerifyUUIDThrottle), {'uuid': uuid})
+        obj = await sync_to_async(_get_pyotp)(uuid)
+        otp = serializers.VerifyOTPSerializer.parse_otp(_parse(request))
+    except exceptions.APIException as exc:
+        return _exception_response(exc)
+
+    # HOTP moves the counter in the DB, TOTP records the time step in the replay guard (possibly a shared cache)
+    valid_otp = await sync_to_async(serializers.VerifyOTPSerializer().verify_otp)(otp, obj, otp_type)
+    if not valid_otp:
+        return _response(status_code=status.HTTP_400_BAD_REQUEST)
+    return _response()
+
+
+async def register_push(request, uuid):
+    """
+    Async register push view
+    """
+    try:
+        _check_method(request)
+        serializer = _validate(serializers.FCMRegisterSerializer, request)
+        result = await sync_to_async(serializer.register_push)(serializer.data.get('username'), uuid)
+    except exceptions.APIException as exc:
+        return _exception_response(exc)
+    except Http404:
+        return _exception_response(exceptions.NotFound())
+    if not result:
+        return _response(status_code=status.HTTP_400_BAD_REQUEST)
+    return _response()
+
+
+async def send_push(request, uuid):
+    """
+    Async send push view, the push itself is queued
+    :return: Refer code
+    """
+    try:
+        _check_method(request)
+        serializer = _validate(serializers.FCMSendSerializer, request)
+    except exceptions.APIException as exc:
+        return _exception_response(exc)
+    result = await sync_to_async(serializer.send_push)(uuid)
+    if result is None:
+        return _response(status_code=status.HTTP_400_BAD_REQUEST)
+    return _response(result)
+
+
+async def verify_push(request):
+    """
+    Async verify push view, the callback is delivered with the async HTTP client
+    """
+    try:
+        _check_method(request)
+        _check_throttles(request, (throttling.VerifyIPThrottle,))
+        serializer = _validate(serializers.FCMVerifySerializer, request)
+    except exceptions.APIException as exc:
+        return _exception_response(exc)
+    data = serializer.data
+    result = await sync_to_async(serializer.verify_push)(data.get('username'), data.get('refer_code'), data.get('accept'))
+    callback(result)
+    if not result:
+        return _response(status_code=status.HTTP_400_BAD_REQUEST)
+    return _response()
+
+
+async def mobile_push(request):
+    """
+    Async mobile push view
+    """
+    try:
+        _check_method(request)
+        serializer = _validate(serializers.FCMMobileSerializer, request)
+        result = await sync_to_async(serializer.mobilelink)(
+            serializer.data.get('username'), serializer.data.get('registration_id'),
+        )
+    except exceptions.APIException as exc:
+        return _exception_response(exc)
+    except Http404:
+        return _exception_response(exceptions.NotFound())
+    if not result:
+        return _response(status_code=status.HTTP_400_BAD_REQUEST)
+    return _response()
+
+
+async def push_status(request, uuid, refer):
+    """
+    Async long-poll of a push answer, waiting costs a Future instead of a thread
+    :return: pending/approved/denied/expired
+    """
+    try:
+        _check_method(request, 'GET')
+        serializer = serializers.FCMStatusSerializer(data=request.GET)
+        serializer.is_valid(raise_exception=True)
+    except exceptions.APIException as exc:
+        return _exception_response(exc)
+    result = await serializer.push_status_async(uuid, refer)
+    if result is None:
+        return _response(status_code=status.HTTP_404_NOT_FOUND)
+    return _response({'status': result})
+
+
+async def export_otps(request):
+    """
+    The export streams ORM queries from a sync iterator, which Django 3.2 runs on the event loop:
+    it is only served by the WSGI deployment, or `manage.py export_otps`
+    :return: 404 Not Found
+    """
+    return _exception_response(exceptions.NotFound(
+        'The export is not served by the ASGI deployment, use the WSGI deployment or manage.py export_otps.',
+    ))
+
+
+def callback(result):
+    """
+    Deliver the verification result on the event loop, without waiting for it
+    :param result: Verification result
+    """
+    dispatcher = get_callback_dispatcher()
+    if not dispatcher.url:
+        return
+    if result is False:
+        dispatcher.submit_async({'http_code': 400})
+    else:
+        dispatcher.submit_async({'http_code': 200})
+
+
+# Same CSRF policy as the DRF views these mirror: they are csrf exempt, and DRF only enforces CSRF
+# for session-authenticated requests. These views never read `request.user` or the session, the username
+# travels in the body, so a cross-site request carries no authority a direct request would not have.
+# Django's decorator would hide the coroutine, hence the attribute.
+for view in (verify_otp, register_push, send_push, verify_push, mobile_push, push_status):
+    view.csrf_exempt = True
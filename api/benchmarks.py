@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from django.db import connection as default_connection
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile
+    :param values: Sorted list of numbers
+    :param percent: Percentile (0-100)
+    :return: Percentile value
+    """
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(round(percent / 100.0 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(latencies, elapsed=None):
+    """
+    Summarize latencies (in seconds)
+    :param latencies: List of latencies
+    :param elapsed: Wall time of the whole run, used for throughput
+    :return: Stats dict, latencies in microseconds
+    """
+    latencies = sorted(latencies)
+    count = len(latencies)
+    if elapsed is None:
+        elapsed = sum(latencies)
+    return {
+        'count': count,
+        'throughput': count / elapsed if elapsed else 0.0,
+        'mean_us': sum(latencies) / count * 1e6 if count else 0.0,
+        'p50_us': percentile(latencies, 50) * 1e6,
+        'p90_us': percentile(latencies, 90) * 1e6,
+        'p99_us': percentile(latencies, 99) * 1e6,
+        'max_us': latencies[-1] * 1e6 if count else 0.0,
+    }
+
+
+def measure(func, iterations, warmup=0):
+    """
+    Run `func` repeatedly and time every call
+    :param func: Callable without arguments
+    :param iterations: Timed calls
+    :param warmup: Untimed calls before measuring
+    :return: Stats dict
+    """
+    for _ in range(warmup):
+        func()
+    latencies = []
+    clock = time.perf_counter
+    start = clock()
+    for _ in range(iterations):
+        begin = clock()
+        func()
+        latencies.append(clock() - begin)
+    return summarize(latencies, clock() - start)
+
+
+def format_stats(name, stats):
+    """
+    One line human readable stats
+    :param name: Benchmark name
+    :param stats: Stats dict
+    :return: String
+    """
+    return '{:<32} {:>9} ops {:>12.1f} ops/s  p50 {:>9.1f}us  p90 {:>9.1f}us  p99 {:>9.1f}us'.format(
+        name, stats['count'], stats['throughput'], stats['p50_us'], stats['p90_us'], stats['p99_us'])
+
+
+@contextmanager
+def test_database(connection=None):
+    """
+    Create, migrate and finally destroy a test database, like the test runner does,
+    so benchmarks never write to (or alter the schema of) the configured database.
+    SQLite gets a temporary file instead of the in-memory default, so threads share it
+    and it runs with the same pragmas as a real database.
+    :param connection: Database connection (defaults to the default alias)
+    """
+    connection = connection or default_connection
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    directory = None
+    if connection.vendor == 'sqlite':
+        directory = tempfile.mkdtemp(prefix='otter-bench-')
+        test_settings['NAME'] = os.path.join(directory, 'db.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = old_test_name
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
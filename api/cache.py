@@ -0,0 +1,270 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class PyOTPCache(object):
+    """
+    Per-process, size-bounded LRU cache of PyOTP objects keyed by uuid, with TTL eviction.
+    Entries are invalidated by the PyOTP post_save/post_delete signals (see `api.signals`),
+    in this process only: other workers keep serving a deleted or rotated object for up to `ttl`,
+    so it only fits single-process deployments.
+    """
+    def __init__(self, max_size=10000, ttl=300):
+        """
+        :param max_size: Maximum number of cached objects
+        :param ttl: Time to live of an entry (in seconds)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_size=getattr(settings, 'OTP_CACHE_MAX_SIZE', 10000),
+            ttl=getattr(settings, 'OTP_CACHE_TTL', 300),
+        )
+
+    def get(self, uuid):
+        """
+        Get a cached PyOTP object
+        :param uuid: PyOTP UUID
+        :return: Copy of the PyOTP object or None
+        """
+        now = time.monotonic()
+        with self._lock:
+            obj = self._lookup(str(uuid), now)
+        return None if obj is None else copy.copy(obj)
+
+    def get_many(self, uuids):
+        """
+        Get many cached PyOTP objects under one lock
+        :param uuids: PyOTP UUIDs
+        :return: Dict of UUID string to a copy of the PyOTP object, misses are left out
+        """
+        now = time.monotonic()
+        objs = {}
+        with self._lock:
+            for uuid in uuids:
+                key = str(uuid)
+                obj = self._lookup(key, now)
+                if obj is not None:
+                    objs[key] = obj
+        return {key: copy.copy(obj) for key, obj in objs.items()}
+
+    def _lookup(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < now:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, uuid, obj):
+        """
+        Cache a PyOTP object
+        :param uuid: PyOTP UUID
+        :param obj: PyOTP model object
+        """
+        self.set_many({uuid: obj})
+
+    def set_many(self, objs):
+        """
+        Cache many PyOTP objects
+        :param objs: Dict of PyOTP UUID to PyOTP model object
+        """
+        expires = time.monotonic() + self.ttl
+        entries = [(str(uuid), (expires, copy.copy(obj))) for uuid, obj in objs.items()]
+        with self._lock:
+            for key, entry in entries:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *uuids):
+        """
+        Drop cached PyOTP objects
+        :param uuids: PyOTP UUIDs
+        """
+        with self._lock:
+            for uuid in uuids:
+                self._entries.pop(str(uuid), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Cache counters
+        :return: Dict of size, hits and misses
+        """
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class SharedPyOTPCache(object):
+    """
+    PyOTP cache shared by every worker through Django's cache framework, opt-in through OTP_CACHE.
+    Entries hold whole PyOTP rows, secrets included, and are bounded by the backend alone:
+    use a dedicated alias, not the default LocMemCache.
+    Every uuid has a generation, bumped by `invalidate`. Entries remember the generation read
+    before the DB load they come from, so a copy loaded before a concurrent save or delete
+    is never served once that save or delete invalidated it.
+    """
+    key_prefix = 'pyotp'
+    # Misses of a thread waiting for their `set`, misses of unknown uuids never get one
+    max_loading = 10000
+
+    def __init__(self, cache_alias='default', ttl=300):
+        """
+        :param cache_alias: Django cache alias
+        :param ttl: Time to live of an entry (in seconds)
+        """
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            cache_alias=getattr(settings, 'OTP_CACHE_ALIAS', 'default'),
+            ttl=getattr(settings, 'OTP_CACHE_TTL', 300),
+        )
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.cache_alias]
+
+    def _keys(self, uuid):
+        return '{}:{}'.format(self.key_prefix, uuid), '{}-gen:{}'.format(self.key_prefix, uuid)
+
+    def _loading(self):
+        loading = getattr(self._local, 'loading', None)
+        if loading is None:
+            loading = self._local.loading = {}
+        return loading
+
+    def get(self, uuid):
+        """
+        Get a cached PyOTP object, one cache round trip
+        :param uuid: PyOTP UUID
+        :return: PyOTP object or None
+        """
+        return self.get_many([uuid]).get(str(uuid))
+
+    def get_many(self, uuids):
+        """
+        Get many cached PyOTP objects, one cache round trip whatever their number
+        :param uuids: PyOTP UUIDs
+        :return: Dict of UUID string to PyOTP object, misses are left out
+        """
+        keys = {str(uuid): self._keys(uuid) for uuid in uuids}
+        values = self.cache.get_many([key for pair in keys.values() for key in pair])
+        objs, generations = {}, {}
+        for uuid, (key, gen_key) in keys.items():
+            generation = values.get(gen_key, 0)
+            entry = values.get(key)
+            if entry is None or entry[0] != generation:
+                generations[uuid] = generation
+            else:
+                objs[uuid] = entry[1]
+        self._count(len(objs), len(generations))
+        if generations:
+            # The caller loads the objects next, `set_many` stores them under these generations
+            loading = self._loading()
+            if len(loading) + len(generations) > self.max_loading:
+                loading.clear()
+            loading.update(generations)
+        return objs
+
+    def set(self, uuid, obj):
+        """
+        Cache a PyOTP object loaded after a `get` miss of this thread
+        :param uuid: PyOTP UUID
+        :param obj: PyOTP model object
+        """
+        self.set_many({uuid: obj})
+
+    def set_many(self, objs):
+        """
+        Cache PyOTP objects loaded after `get`/`get_many` misses of this thread, one cache round trip
+        :param objs: Dict of PyOTP UUID to PyOTP model object
+        """
+        loading = self._loading()
+        entries = {}
+        for uuid, obj in objs.items():
+            generation = loading.pop(str(uuid), None)
+            if generation is not None:
+                entries[self._keys(uuid)[0]] = (generation, obj)
+        if entries:
+            self.cache.set_many(entries, timeout=self.ttl)
+
+    def _count(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def invalidate(self, *uuids):
+        """
+        Drop cached PyOTP objects in every worker
+        :param uuids: PyOTP UUIDs
+        """
+        cache = self.cache
+        for uuid in uuids:
+            key, gen_key = self._keys(uuid)
+            try:
+                cache.incr(gen_key)
+            except ValueError:
+                # No generation yet, the gen key outlives every entry loaded before it
+                if not cache.add(gen_key, 1, timeout=2 * self.ttl):
+                    cache.incr(gen_key)
+            cache.delete(key)
+
+    def clear(self):
+        """
+        Clear the whole cache alias, meant for tests
+        """
+        self.cache.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Cache counters of this process, the size of a shared cache is unknown
+        :return: Dict of size, hits and misses
+        """
+        with self._lock:
+            return {'size': None, 'hits': self.hits, 'misses': self.misses}
+
+
+_cache = None
+
+
+def get_cache():
+    """
+    Per-process PyOTP cache
+    :return: PyOTPCache/SharedPyOTPCache
+    """
+    global _cache
+    if _cache is None:
+        _cache = import_string(getattr(settings, 'OTP_CACHE', 'api.cache.PyOTPCache')).from_settings()
+    return _cache
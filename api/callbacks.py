@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import threading
+import time
+from django.conf import settings
+from .dispatch import BackgroundDispatcher
+from .metrics import timer
+
+logger = logging.getLogger(__name__)
+
+
+class CallbackDispatcher(BackgroundDispatcher):
+    """
+    Deliver push verification results to the relying party in the background.
+    Uses one pooled keep-alive HTTP session, retries with exponential backoff.
+    """
+    name = 'callback'
+
+    def __init__(self, url, timeout=5, retries=3, backoff=0.5, pool_size=10, **kwargs):
+        """
+        :param url: Callback endpoint
+        :param timeout: Timeout of one POST (in seconds)
+        :param retries: Retries after the first failed POST
+        :param backoff: First retry delay, doubled on every retry (in seconds)
+        :param pool_size: Maximum keep-alive connections
+        """
+        super().__init__(**kwargs)
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.delivered = 0
+        self.failed = 0
+        self.retried = 0
+        self.latency_count = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self._session = None
+        self._async_client = None
+        self._async_tasks = set()
+        self._metrics_lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+        return self._session
+
+    def handle(self, batch):
+        for data in batch:
+            self.deliver(data)
+
+    def deliver(self, data):
+        """
+        POST one callback, retrying on connection errors and 5xx responses
+        :param data: Form data
+        :return: True if delivered
+        """
+        import requests
+
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+                with self._metrics_lock:
+                    self.retried += 1
+
+            start = time.perf_counter()
+            try:
+                with timer('callback'):
+                    response = self.session.post(self.url, data=data, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = str(e)
+            else:
+                if response.status_code < 500:
+                    self._record(True, time.perf_counter() - start)
+                    return True
+                error = 'HTTP {}'.format(response.status_code)
+            logger.warning('Callback to %s failed (attempt %d): %s', self.url, attempt + 1, error)
+
+        self._record(False, None)
+        return False
+
+    def _get_async_client(self):
+        import httpx
+
+        loop = asyncio.get_event_loop()
+        if self._async_client is None or self._async_client[0] is not loop:
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            self._async_client = (loop, httpx.AsyncClient(limits=limits, timeout=self.timeout))
+        return self._async_client[1]
+
+    async def deliver_async(self, data):
+        """
+        POST one callback with the async HTTP client, same retries as `deliver`
+        :param data: Form data
+        :return: True if delivered
+        """
+        import httpx
+
+        client = self._get_async_client()
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(delay)
+                delay *= 2
+                with self._metrics_lock:
+                    self.retried += 1
+
+            start = time.perf_counter()
+            try:
+                response = await client.post(self.url, data=data)
+            except httpx.HTTPError as e:
+                error = str(e)
+            else:
+                if response.status_code < 500:
+                    self._record(True, time.perf_counter() - start)
+                    return True
+                error = 'HTTP {}'.format(response.status_code)
+            logger.warning('Callback to %s failed (attempt %d): %s', self.url, attempt + 1, error)
+
+        self._record(False, None)
+        return False
+
+    def submit_async(self, data):
+        """
+        Schedule a callback on the running event loop
+        :param data: Form data
+        """
+        task = asyncio.ensure_future(self.deliver_async(data))
+        self._async_tasks.add(task)
+        task.add_done_callback(self._async_tasks.discard)
+
+    def _record(self, delivered, latency):
+        with self._metrics_lock:
+            if delivered:
+                self.delivered += 1
+                self.latency_count += 1
+                self.latency_sum += latency
+                self.latency_max = max(self.latency_max, latency)
+            else:
+                self.failed += 1
+
+    def metrics(self):
+        """
+        Delivery metrics
+        :return: Dict of queue depth, counters and latency (in seconds)
+        """
+        with self._metrics_lock:
+            return {
+                'queue_depth': self.queue_depth + len(self._async_tasks),
+                'delivered': self.delivered,
+                'failed': self.failed,
+                'retried': self.retried,
+                'dropped': self.dropped,
+                'latency_avg': self.latency_sum / self.latency_count if self.latency_count else 0.0,
+                'latency_max': self.latency_max,
+            }
+
+
+_dispatcher = None
+
+
+def get_callback_dispatcher():
+    """
+    Per-process callback dispatcher
+    :return: CallbackDispatcher
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = CallbackDispatcher(
+            getattr(settings, 'PUSH_CALLBACK_URL', None),
+            timeout=getattr(settings, 'PUSH_CALLBACK_TIMEOUT', 5),
+            retries=getattr(settings, 'PUSH_CALLBACK_RETRIES', 3),
+            backoff=getattr(settings, 'PUSH_CALLBACK_BACKOFF', 0.5),
+            pool_size=getattr(settings, 'PUSH_CALLBACK_POOL_SIZE', 10),
+            workers=getattr(settings, 'PUSH_CALLBACK_WORKERS', 2),
+            queue_size=getattr(settings, 'PUSH_CALLBACK_QUEUE_SIZE', 1000),
+        )
+    return _dispatcher
@@ -0,0 +1,288 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+PENDING = 'pending'
+APPROVED = 'approved'
+DENIED = 'denied'
+EXPIRED = 'expired'
+
+
+class Challenge(object):
+    """
+    Push approval waiting for the user's answer
+    """
+    __slots__ = ('uuid', 'refer', 'status', 'expires', 'forget_at', 'waiters')
+
+    def __init__(self, uuid, refer, expires, forget_at):
+        self.uuid = str(uuid)
+        self.refer = refer
+        self.status = PENDING
+        self.expires = expires
+        self.forget_at = forget_at
+        self.waiters = []
+
+    def current_status(self, now):
+        if self.status == PENDING and self.expires <= now:
+            return EXPIRED
+        return self.status
+
+
+def _wake(waiter, status):
+    if isinstance(waiter, threading.Event):
+        waiter.set()
+    else:
+        loop, future = waiter
+        loop.call_soon_threadsafe(_set_result, future, status)
+
+
+def _set_result(future, status):
+    if not future.done():
+        future.set_result(status)
+
+
+class LocalChallengeStore(object):
+    """
+    Per-process store of pending push approvals keyed by refer code.
+    Waiters are woken by `resolve` itself, a blocked thread waits on an Event and
+    a coroutine on a Future, so nothing polls while the phone has not answered.
+    """
+    def __init__(self, ttl=120, result_ttl=60, max_size=100000):
+        """
+        :param ttl: Time the user has to answer (in seconds)
+        :param result_ttl: Time an answer stays readable (in seconds)
+        :param max_size: Maximum number of remembered challenges
+        """
+        self.ttl = ttl
+        self.result_ttl = result_ttl
+        self.max_size = max_size
+        self._challenges = {}
+        self._order = deque()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            ttl=getattr(settings, 'OTP_CHALLENGE_TTL', 120),
+            result_ttl=getattr(settings, 'OTP_CHALLENGE_RESULT_TTL', 60),
+            max_size=getattr(settings, 'OTP_CHALLENGE_MAX_SIZE', 100000),
+        )
+
+    def _evict(self, now):
+        while self._order:
+            forget_at, refer = self._order[0]
+            if forget_at > now and len(self._challenges) <= self.max_size:
+                break
+            self._order.popleft()
+            challenge = self._challenges.get(refer)
+            if challenge is not None and challenge.forget_at == forget_at:
+                del self._challenges[refer]
+
+    def _get(self, uuid, refer):
+        challenge = self._challenges.get(refer)
+        if challenge is None or challenge.uuid != str(uuid):
+            return None
+        return challenge
+
+    def register(self, uuid, refer):
+        """
+        Open a challenge
+        :param uuid: PyOTP UUID
+        :param refer: Refer code sent to the phone
+        :return: True, False when the refer code is already pending
+        """
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            challenge = self._challenges.get(refer)
+            if challenge is not None and challenge.current_status(now) == PENDING:
+                return False
+            challenge = Challenge(uuid, refer, now + self.ttl, now + self.ttl + self.result_ttl)
+            self._challenges[refer] = challenge
+            self._order.append((challenge.forget_at, refer))
+        return True
+
+    def resolve(self, uuid, refer, approved):
+        """
+        Record the user's answer and wake every waiter
+        :param uuid: PyOTP UUID
+        :param refer: Refer code
+        :param approved: Accept/Deny
+        :return: True, False when there is no pending challenge
+        """
+        now = time.time()
+        with self._lock:
+            challenge = self._get(uuid, refer)
+            if challenge is None or challenge.current_status(now) != PENDING:
+                return False
+            challenge.status = APPROVED if approved else DENIED
+            challenge.expires = now
+            waiters, challenge.waiters = challenge.waiters, []
+        for waiter in waiters:
+            _wake(waiter, challenge.status)
+        return True
+
+    def status(self, uuid, refer):
+        """
+        :param uuid: PyOTP UUID
+        :param refer: Refer code
+        :return: pending/approved/denied/expired, None for an unknown challenge
+        """
+        challenge = self._get(uuid, refer)
+        if challenge is None:
+            return None
+        return challenge.current_status(time.time())
+
+    def _add_waiter(self, uuid, refer, waiter):
+        """
+        :return: (status, seconds until expiry), the waiter is only added while pending
+        """
+        now = time.time()
+        with self._lock:
+            challenge = self._get(uuid, refer)
+            if challenge is None:
+                return None, 0
+            status = challenge.current_status(now)
+            if status == PENDING:
+                challenge.waiters.append(waiter)
+            return status, challenge.expires - now
+
+    def _remove_waiter(self, uuid, refer, waiter):
+        with self._lock:
+            challenge = self._get(uuid, refer)
+            if challenge is not None and waiter in challenge.waiters:
+                challenge.waiters.remove(waiter)
+
+    def wait(self, uuid, refer, timeout):
+        """
+        Block until the challenge is answered, expires or `timeout` passes
+        :param uuid: PyOTP UUID
+        :param refer: Refer code
+        :param timeout: Maximum wait (in seconds)
+        :return: Challenge status, None for an unknown challenge
+        """
+        event = threading.Event()
+        status, remaining = self._add_waiter(uuid, refer, event)
+        if status != PENDING:
+            return status
+        if not event.wait(min(timeout, remaining)):
+            self._remove_waiter(uuid, refer, event)
+        return self.status(uuid, refer)
+
+    async def wait_async(self, uuid, refer, timeout):
+        """
+        Coroutine version of `wait`, the event loop is never blocked
+        """
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        status, remaining = self._add_waiter(uuid, refer, waiter)
+        if status != PENDING:
+            return status
+        try:
+            return await asyncio.wait_for(waiter[1], min(timeout, remaining))
+        except asyncio.TimeoutError:
+            return self.status(uuid, refer)
+        finally:
+            self._remove_waiter(uuid, refer, waiter)
+
+
+class CacheChallengeStore(object):
+    """
+    Challenge store shared by every worker through Django's cache framework.
+    Waiters re-read one cache key every `poll_interval`, the database is never polled.
+    """
+    key_prefix = 'otp-challenge'
+
+    def __init__(self, ttl=120, result_ttl=60, poll_interval=0.5, cache_alias='default'):
+        """
+        :param ttl: Time the user has to answer (in seconds)
+        :param result_ttl: Time an answer stays readable (in seconds)
+        :param poll_interval: Time between two reads of a waiter (in seconds)
+        :param cache_alias: Django cache alias
+        """
+        self.ttl = ttl
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self.cache_alias = cache_alias
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            ttl=getattr(settings, 'OTP_CHALLENGE_TTL', 120),
+            result_ttl=getattr(settings, 'OTP_CHALLENGE_RESULT_TTL', 60),
+            poll_interval=getattr(settings, 'OTP_CHALLENGE_POLL_INTERVAL', 0.5),
+            cache_alias=getattr(settings, 'OTP_CHALLENGE_CACHE', 'default'),
+        )
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.cache_alias]
+
+    def _key(self, refer):
+        return '{}:{}'.format(self.key_prefix, refer)
+
+    def _get(self, uuid, refer):
+        challenge = self.cache.get(self._key(refer))
+        if challenge is None or challenge['uuid'] != str(uuid):
+            return None
+        return challenge
+
+    def register(self, uuid, refer):
+        challenge = {'uuid': str(uuid), 'status': PENDING, 'expires': time.time() + self.ttl}
+        return self.cache.add(self._key(refer), challenge, timeout=self.ttl + self.result_ttl)
+
+    def resolve(self, uuid, refer, approved):
+        challenge = self._get(uuid, refer)
+        now = time.time()
+        if challenge is None or challenge['status'] != PENDING or challenge['expires'] <= now:
+            return False
+        challenge.update(status=APPROVED if approved else DENIED, expires=now)
+        self.cache.set(self._key(refer), challenge, timeout=self.result_ttl)
+        return True
+
+    def status(self, uuid, refer):
+        challenge = self._get(uuid, refer)
+        if challenge is None:
+            return None
+        if challenge['status'] == PENDING and challenge['expires'] <= time.time():
+            return EXPIRED
+        return challenge['status']
+
+    def wait(self, uuid, refer, timeout):
+        deadline = time.time() + timeout
+        status = self.status(uuid, refer)
+        while status == PENDING and time.time() < deadline:
+            time.sleep(min(self.poll_interval, max(0, deadline - time.time())))
+            status = self.status(uuid, refer)
+        return status
+
+    async def wait_async(self, uuid, refer, timeout):
+        """
+        Coroutine version of `wait`, every cache read runs in a worker thread
+        """
+        status_async = sync_to_async(self.status, thread_sensitive=False)
+        deadline = time.time() + timeout
+        status = await status_async(uuid, refer)
+        while status == PENDING and time.time() < deadline:
+            await asyncio.sleep(min(self.poll_interval, max(0, deadline - time.time())))
+            status = await status_async(uuid, refer)
+        return status
+
+
+_store = None
+
+
+def get_challenge_store():
+    """
+    Per-process challenge store
+    :return: LocalChallengeStore/CacheChallengeStore
+    """
+    global _store
+    if _store is None:
+        _store = import_string(getattr(settings, 'OTP_CHALLENGE_STORE', 'api.challenges.LocalChallengeStore')).from_settings()
+    return _store
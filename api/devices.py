@@ -0,0 +1,68 @@
+from collections import namedtuple
+from django.db import transaction
+from django.db.models import Count, Max
+from .utils import chunked
+
+DeviceRow = namedtuple('DeviceRow', ['username', 'registration_id', 'type', 'name'])
+
+# Unique index backing the (user, registration_id) upsert, created by migration 0003
+DEVICE_UNIQUE_INDEX = 'fcm_device_user_registration_uniq'
+
+
+def dedupe_devices(model, chunk_size=1000, dry_run=False):
+    """
+    Keep the newest FCMDevice of every (user, registration_id) pair and delete the others
+    :param model: FCMDevice model (the historical one inside migrations)
+    :param chunk_size: Number of duplicated pairs handled per transaction
+    :param dry_run: Only count
+    :return: Number of deleted (or deletable) rows
+    """
+    duplicates = (
+        model.objects.filter(user__isnull=False)
+        .values('user_id', 'registration_id')
+        .annotate(keep=Max('id'), total=Count('id'))
+        .filter(total__gt=1)
+        .order_by()
+    )
+    deleted = 0
+    for chunk in chunked(duplicates.iterator(), chunk_size):
+        if dry_run:
+            deleted += sum(pair['total'] - 1 for pair in chunk)
+            continue
+        with transaction.atomic():
+            for pair in chunk:
+                count, _ = model.objects.filter(
+                    user_id=pair['user_id'], registration_id=pair['registration_id'],
+                ).exclude(id=pair['keep']).delete()
+                deleted += count
+    return deleted
+
+
+def import_devices(model, user_model, rows, batch_size=1000):
+    """
+    Register devices in batches, one user lookup and one INSERT per batch.
+    Pairs already registered are skipped through the unique index.
+    :param model: FCMDevice model
+    :param user_model: User model
+    :param rows: Iterable of DeviceRow
+    :param batch_size: Number of rows per batch
+    :return: (number of rows read, number of rows with an unknown username)
+    """
+    read = unknown = 0
+    for batch in chunked(rows, batch_size):
+        read += len(batch)
+        user_ids = dict(user_model.objects.filter(
+            username__in={row.username for row in batch},
+        ).values_list('username', 'id'))
+        devices = []
+        for row in batch:
+            user_id = user_ids.get(row.username)
+            if user_id is None:
+                unknown += 1
+                continue
+            devices.append(model(
+                user_id=user_id, registration_id=row.registration_id, type=row.type or '', name=row.name or None,
+            ))
+        with transaction.atomic():
+            model.objects.bulk_create(devices, batch_size=batch_size, ignore_conflicts=True)
+    return read, unknown
@@ -0,0 +1,100 @@
+import abc
+import logging
+import queue
+import threading
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundDispatcher(metaclass=abc.ABCMeta):
+    """
+    In-process queue drained in batches by a pool of daemon worker threads.
+    Subclasses implement `handle(batch)`.
+    """
+    name = 'dispatcher'
+
+    def __init__(self, workers=2, queue_size=10000, batch_size=100):
+        """
+        :param workers: Number of worker threads, 0 handles every item inline
+        :param queue_size: Maximum number of queued items
+        :param batch_size: Maximum number of items handled at once
+        """
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        if len(self._threads) >= self.workers:
+            return
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._run,
+                    name='{}-{}'.format(self.name, len(self._threads)),
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, item):
+        """
+        Queue an item, handled inline only when there are no workers.
+        A full queue drops the item: handling it inline would block the request on the slow I/O
+        the queue exists to move off it.
+        :param item: Item to handle
+        :return: True, False when the item was dropped
+        """
+        if not self.workers:
+            self._handle([item])
+            return True
+        self._start()
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logger.error('%s queue is full, dropped %r', self.name, item)
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._handle(batch)
+            finally:
+                close_old_connections()
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _handle(self, batch):
+        try:
+            self.handle(batch)
+        except Exception:
+            logger.exception('%s failed to handle %d item(s)', self.name, len(batch))
+
+    @abc.abstractmethod
+    def handle(self, batch):
+        """
+        Handle a batch of items
+        :param batch: List of items
+        """
+
+    def join(self):
+        """
+        Block until every queued item is handled
+        """
+        self.queue.join()
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
@@ -0,0 +1,192 @@
+import base64
+import datetime
+import hashlib
+import hmac
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from django.conf import settings
+from .metrics import timer
+
+
+class OTPEngine(object):
+    """
+    HOTP/TOTP engine with per-secret precomputed HMAC state.
+
+    The decoded key and the keyed HMAC object (inner/outer pads already absorbed)
+    are cached per secret in a bounded LRU, so every OTP only costs a `copy()` and
+    one 8-byte update. Results are identical to pyotp.
+    """
+    def __init__(self, max_size=10000, digits=6, digest=hashlib.sha1):
+        """
+        :param max_size: Maximum number of cached secrets
+        :param digits: Number of OTP digits
+        :param digest: HMAC digest
+        """
+        self.max_size = max_size
+        self.digits = digits
+        self.digest = digest
+        self._modulo = 10 ** digits
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def byte_secret(secret):
+        """
+        Decode a base32 secret the same way pyotp does
+        :param secret: Base32 secret
+        :return: Key bytes
+        """
+        missing_padding = len(secret) % 8
+        if missing_padding != 0:
+            secret += '=' * (8 - missing_padding)
+        return base64.b32decode(secret, casefold=True)
+
+    def _get_state(self, secret):
+        """
+        Get (or build) the keyed HMAC object of a secret
+        :param secret: Base32 secret
+        :return: Keyed HMAC object, never updated in place
+        """
+        with self._lock:
+            state = self._states.get(secret)
+            if state is not None:
+                self._states.move_to_end(secret)
+                return state
+
+        state = hmac.new(self.byte_secret(secret), digestmod=self.digest)
+        with self._lock:
+            self._states[secret] = state
+            if len(self._states) > self.max_size:
+                self._states.popitem(last=False)
+        return state
+
+    def _truncate(self, hmac_hash):
+        """
+        RFC 4226 dynamic truncation
+        :param hmac_hash: HMAC digest bytes
+        :return: OTP string
+        """
+        offset = hmac_hash[-1] & 0xf
+        code = ((hmac_hash[offset] & 0x7f) << 24 |
+                (hmac_hash[offset + 1] & 0xff) << 16 |
+                (hmac_hash[offset + 2] & 0xff) << 8 |
+                (hmac_hash[offset + 3] & 0xff))
+        return str(code % self._modulo).rjust(self.digits, '0')
+
+    def generate_many(self, secret, counters):
+        """
+        Generate OTPs of many counters for one secret
+        :param secret: Base32 secret
+        :param counters: HMAC counter values
+        :return: List of OTP strings
+        """
+        with timer('hmac'):
+            state = self._get_state(secret)
+            codes = []
+            for counter in counters:
+                if counter < 0:
+                    raise ValueError('input must be positive integer')
+                hasher = state.copy()
+                hasher.update(counter.to_bytes(8, 'big'))
+                codes.append(self._truncate(hasher.digest()))
+        return codes
+
+    def generate(self, secret, counter):
+        """
+        Generate one OTP
+        :param secret: Base32 secret
+        :param counter: HMAC counter value
+        :return: OTP string
+        """
+        return self.generate_many(secret, (counter,))[0]
+
+    @staticmethod
+    def _normalize(otp):
+        return unicodedata.normalize('NFKC', str(otp)).encode('utf-8')
+
+    def _match(self, otp, secret, counters):
+        """
+        Compare an OTP against every counter without short-circuiting
+        :param otp: OTP to verify
+        :param secret: Base32 secret
+        :param counters: Candidate counters
+        :return: First matching counter or None
+        """
+        otp = self._normalize(otp)
+        matched = None
+        for counter, code in zip(counters, self.generate_many(secret, counters)):
+            if hmac.compare_digest(otp, code.encode('utf-8')) and matched is None:
+                matched = counter
+        return matched
+
+    def hotp_verify(self, otp, secret, counter):
+        """
+        Verify a HOTP at one counter, same as `pyotp.HOTP.verify`
+        :param otp: OTP to verify
+        :param secret: Base32 secret
+        :param counter: HOTP counter
+        :return: True/False
+        """
+        return self._match(otp, secret, [counter]) is not None
+
+    def hotp_match(self, otp, secret, counter, look_ahead=0):
+        """
+        Search a HOTP from `counter` up to `counter + look_ahead` in one pass
+        :param otp: OTP to verify
+        :param secret: Base32 secret
+        :param counter: Current HOTP counter
+        :param look_ahead: Accepted counters after the current one
+        :return: Matching counter or None
+        """
+        return self._match(otp, secret, list(range(counter, counter + look_ahead + 1)))
+
+    @staticmethod
+    def timecode(interval, for_time=None):
+        """
+        TOTP time step, same as `pyotp.TOTP.timecode`
+        :param interval: TOTP interval
+        :param for_time: Unix timestamp or datetime (defaults to now)
+        :return: Time step
+        """
+        if for_time is None:
+            for_time = time.time()
+        elif isinstance(for_time, datetime.datetime):
+            for_time = time.mktime(for_time.timetuple())
+        return int(int(for_time) / interval)
+
+    def totp_match(self, otp, secret, interval, for_time=None, valid_window=0):
+        """
+        Verify a TOTP over the whole drift window in one pass
+        :param otp: OTP to verify
+        :param secret: Base32 secret
+        :param interval: TOTP interval
+        :param for_time: Unix timestamp or datetime (defaults to now)
+        :param valid_window: Accepted time steps before and after the current one
+        :return: Matching time step or None
+        """
+        step = self.timecode(interval, for_time)
+        counters = list(range(step - valid_window, step + valid_window + 1))
+        return self._match(otp, secret, counters)
+
+    def totp_verify(self, otp, secret, interval, for_time=None, valid_window=0):
+        """
+        Verify a TOTP, same as `pyotp.TOTP.verify`
+        :return: True/False
+        """
+        return self.totp_match(otp, secret, interval, for_time, valid_window) is not None
+
+
+_engine = None
+
+
+def get_engine():
+    """
+    Per-process OTP engine
+    :return: OTPEngine
+    """
+    global _engine
+    if _engine is None:
+        _engine = OTPEngine(max_size=getattr(settings, 'OTP_ENGINE_CACHE_SIZE', 10000))
+    return _engine
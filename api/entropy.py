@@ -0,0 +1,116 @@
+import base64
+import os
+import threading
+from collections import deque
+from django.conf import settings
+
+
+class SecretPool(object):
+    """
+    Buffer of random base32 strings drawn from the OS CSPRNG in bulk.
+    `get` is an O(1) pop, refills run on a background thread once the buffer drops below `low_water`.
+    """
+    def __init__(self, length=16, size=4096, low_water=1024):
+        """
+        :param length: Length of every base32 string
+        :param size: Number of strings generated per refill
+        :param low_water: Buffer size that triggers a background refill
+        """
+        self.length = length
+        self.size = size
+        self.low_water = low_water
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._refilling = False
+
+    @classmethod
+    def from_settings(cls, length):
+        return cls(
+            length=length,
+            size=getattr(settings, 'OTP_ENTROPY_POOL_SIZE', 4096),
+            low_water=getattr(settings, 'OTP_ENTROPY_LOW_WATER', 1024),
+        )
+
+    def _generate(self, count):
+        """
+        Draw `count` base32 strings from a single os.urandom call
+        :param count: Number of strings
+        :return: List of base32 strings
+        """
+        chars = count * self.length
+        # 5 bytes encode to 8 base32 chars without padding, every char carries 5 random bits
+        blob = base64.b32encode(os.urandom((chars + 7) // 8 * 5)).decode('ascii')
+        return [blob[i:i + self.length] for i in range(0, chars, self.length)]
+
+    def refill(self):
+        """
+        Top the buffer up with a new batch
+        """
+        try:
+            self._buffer.extend(self._generate(self.size))
+        finally:
+            self._refilling = False
+
+    def _refill_in_background(self):
+        with self._lock:
+            if self._refilling:
+                return
+            self._refilling = True
+        threading.Thread(target=self.refill, name='entropy-refill', daemon=True).start()
+
+    def get(self):
+        """
+        Take a base32 string out of the pool
+        :return: Random base32 string
+        """
+        try:
+            secret = self._buffer.popleft()
+        except IndexError:
+            # Empty buffer, pay for a batch inline rather than wait for the refill thread
+            secrets = self._generate(self.size)
+            secret = secrets.pop()
+            self._buffer.extend(secrets)
+        if len(self._buffer) < self.low_water:
+            self._refill_in_background()
+        return secret
+
+    def clear(self):
+        self._buffer.clear()
+        self._refilling = False
+
+    def __len__(self):
+        return len(self._buffer)
+
+
+_pools = {}
+
+
+def _clear_pools():
+    # A forked worker must never hand out secrets already buffered by its parent
+    for pool in list(_pools.values()):
+        pool.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_clear_pools)
+
+
+def get_pool(length=16):
+    """
+    Per-process secret pool for a string length
+    :param length: Length of the base32 strings
+    :return: SecretPool
+    """
+    pool = _pools.get(length)
+    if pool is None:
+        pool = _pools.setdefault(length, SecretPool.from_settings(length))
+    return pool
+
+
+def random_base32(length=16):
+    """
+    Drop-in replacement for `pyotp.random_base32` backed by the secret pool
+    :param length: Length of the base32 string
+    :return: Random base32 string
+    """
+    return get_pool(length).get()
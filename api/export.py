@@ -0,0 +1,111 @@
+import csv
+import json
+from django.conf import settings
+from django.db.models import Q
+from .models import PyOTP
+
+EXPORT_FIELDS = ('uuid', 'user', 'type', 'created_at', 'issuer_name')
+# Orders `iter_records` can walk, each backed by an index
+KEYSETS = (('id',), ('created_at', 'id'))
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def export_queryset(since=None, until=None, issuer=None):
+    """
+    PyOTP rows to export, ordered on the keyset `iter_records` walks.
+    An issuer walks the (issuer_name, id) index in id order, a date range alone walks the
+    created_at index in (created_at, id) order, so sparse ranges never scan the whole table.
+    A date range combined with an issuer is filtered on top of the issuer walk.
+    :param since: Only rows created at or after this datetime
+    :param until: Only rows created before this datetime
+    :param issuer: Only rows of this issuer name
+    :return: Ordered PyOTP QuerySet
+    """
+    queryset = PyOTP.objects.all()
+    if since is not None:
+        queryset = queryset.filter(created_at__gte=since)
+    if until is not None:
+        queryset = queryset.filter(created_at__lt=until)
+    if issuer is not None:
+        return queryset.filter(issuer_name=issuer).order_by('id')
+    if since is not None or until is not None:
+        return queryset.order_by('created_at', 'id')
+    return queryset.order_by('id')
+
+
+def _after(keyset, row):
+    """
+    Filter of the rows following `row` in keyset order
+    """
+    if keyset == ('id',):
+        return Q(id__gt=row['id'])
+    return Q(created_at__gt=row['created_at']) | Q(created_at=row['created_at'], id__gt=row['id'])
+
+
+def iter_records(queryset, chunk_size=None):
+    """
+    Walk the queryset on its keyset, `id` or `(created_at, id)`, one `WHERE key > last LIMIT chunk_size`
+    query per chunk, so memory stays constant and no query ever scans past its chunk
+    :param queryset: PyOTP QuerySet, see `export_queryset`
+    :param chunk_size: Rows per query
+    :return: Generator of export dicts
+    """
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'OTP_EXPORT_CHUNK_SIZE', 2000)
+    keyset = tuple(queryset.query.order_by) if queryset.ordered and queryset.query.order_by else ('id',)
+    if keyset not in KEYSETS:
+        raise ValueError('Cannot walk an export ordered by {}'.format(keyset))
+    rows = queryset.order_by(*keyset).values(
+        'id', 'uuid', 'user__username', 'interval', 'created_at', 'issuer_name',
+    )
+    last = None
+    while True:
+        count = 0
+        chunk = rows if last is None else rows.filter(_after(keyset, last))
+        for last in chunk[:chunk_size].iterator(chunk_size):
+            count += 1
+            yield {
+                'uuid': str(last['uuid']),
+                'user': last['user__username'],
+                'type': 'hotp' if last['interval'] is None else 'totp',
+                'created_at': last['created_at'].isoformat(),
+                'issuer_name': last['issuer_name'],
+            }
+        if count < chunk_size:
+            return
+
+
+def render_ndjson(records):
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+
+class _Echo(object):
+    def write(self, value):
+        return value
+
+
+def render_csv(records):
+    writer = csv.DictWriter(_Echo(), fieldnames=EXPORT_FIELDS)
+    yield writer.writeheader()
+    for record in records:
+        yield writer.writerow(record)
+
+
+RENDERERS = {
+    'ndjson': render_ndjson,
+    'csv': render_csv,
+}
+
+
+def render(records, fmt):
+    """
+    Encode export records
+    :param records: Iterable of export dicts
+    :param fmt: ndjson/csv
+    :return: Generator of text chunks
+    """
+    return RENDERERS[fmt](records)
@@ -0,0 +1,277 @@
+import base64
+import binascii
+import csv
+import json
+import os
+import time
+import uuid
+from collections import namedtuple
+from urllib.parse import parse_qs, unquote, urlparse
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from .models import PyOTP
+from .utils import chunked
+
+ImportReport = namedtuple('ImportReport', ['read', 'written', 'skipped', 'rejected', 'seconds'])
+Rejected = namedtuple('Rejected', ['index', 'error', 'record'])
+
+IMPORT_FORMATS = ('csv', 'ndjson', 'otpauth')
+
+# What the engine computes, anything else would verify with different codes
+SUPPORTED_DIGITS = '6'
+SUPPORTED_ALGORITHM = 'SHA1'
+
+
+def read_csv(file):
+    """
+    :param file: CSV file with a header row
+    :return: Generator of record dicts
+    """
+    for record in csv.DictReader(file):
+        yield {key.strip(): value for key, value in record.items() if key and value not in (None, '')}
+
+
+def read_ndjson(file):
+    """
+    :param file: One JSON object per line
+    :return: Generator of record dicts, invalid lines become {'error': ...}
+    """
+    for line in file:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            record = {'error': 'Invalid JSON: {}'.format(e)}
+        if not isinstance(record, dict):
+            record = {'error': 'Expected a JSON object'}
+        yield record
+
+
+def parse_otpauth(uri):
+    """
+    Split an otpauth:// key URI into a record dict
+    :param uri: otpauth://(hotp|totp)/[issuer:]name?secret=...
+    :return: Record dict
+    """
+    parsed = urlparse(uri.strip())
+    if parsed.scheme != 'otpauth':
+        return {'error': 'Not an otpauth:// URI'}
+    record = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+    record['type'] = parsed.netloc
+    label = unquote(parsed.path.lstrip('/'))
+    if ':' in label:
+        issuer, label = label.split(':', 1)
+        record.setdefault('issuer', issuer.strip())
+    record['name'] = label.strip()
+    return record
+
+
+def read_otpauth(file):
+    """
+    :param file: One otpauth:// URI per line
+    :return: Generator of record dicts
+    """
+    for line in file:
+        if line.strip():
+            yield parse_otpauth(line)
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+    'otpauth': read_otpauth,
+}
+
+
+def _int(record, *keys, default=None):
+    for key in keys:
+        value = record.get(key)
+        if value not in (None, ''):
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                raise ValueError('{} must be an integer'.format(key))
+    return default
+
+
+def _text(record, key, max_length, *aliases):
+    for name in (key,) + aliases:
+        value = record.get(name)
+        if value not in (None, ''):
+            value = str(value).strip()
+            if len(value) > max_length:
+                raise ValueError('{} is longer than {} characters'.format(name, max_length))
+            return value
+    return None
+
+
+def validate(record):
+    """
+    Turn a record into PyOTP fields
+    :param record: Record dict (secret, type, counter/count, period/interval, name, issuer, username)
+    :return: PyOTP fields dict, plus `username`
+    :raise ValueError: Invalid record
+    """
+    if 'error' in record:
+        raise ValueError(record['error'])
+
+    secret = ''.join(str(record.get('secret') or '').split()).upper().rstrip('=')
+    if not secret:
+        raise ValueError('secret is required')
+    if len(secret) > PyOTP._meta.get_field('secret').max_length:
+        raise ValueError('secret is too long')
+    try:
+        base64.b32decode(secret + '=' * (-len(secret) % 8))
+    except (binascii.Error, ValueError):
+        raise ValueError('secret is not base32')
+
+    if str(record.get('digits', SUPPORTED_DIGITS)) != SUPPORTED_DIGITS:
+        raise ValueError('only {} digit codes are supported'.format(SUPPORTED_DIGITS))
+    if str(record.get('algorithm', SUPPORTED_ALGORITHM)).upper() != SUPPORTED_ALGORITHM:
+        raise ValueError('only {} is supported'.format(SUPPORTED_ALGORITHM))
+
+    fields = {
+        'secret': secret,
+        'count': None,
+        'interval': None,
+        'initial_count': None,
+        'name': _text(record, 'name', 255, 'account'),
+        'issuer_name': _text(record, 'issuer_name', 255, 'issuer'),
+        'username': _text(record, 'username', 150, 'user'),
+    }
+    otp_type = str(record.get('type', 'totp')).lower()
+    if otp_type == 'hotp':
+        count = _int(record, 'counter', 'count')
+        if count is None or count < 0:
+            raise ValueError('hotp needs a counter >= 0')
+        fields['count'] = fields['initial_count'] = count
+    elif otp_type == 'totp':
+        interval = _int(record, 'period', 'interval', default=30)
+        if interval <= 0:
+            raise ValueError('period must be positive')
+        fields['interval'] = interval
+    else:
+        raise ValueError('type must be hotp or totp')
+    return fields
+
+
+class Checkpoint(object):
+    """
+    Import position saved after every committed chunk.
+    `run_id` seeds the uuid of every record, so a chunk replayed after a crash
+    finds its rows already imported (`skipped`) instead of inserting duplicates.
+    """
+    def __init__(self, path, run_id=None, position=0, written=0, rejected=0, skipped=0):
+        self.path = path
+        self.run_id = run_id or str(uuid.uuid4())
+        self.position = position
+        self.written = written
+        self.rejected = rejected
+        self.skipped = skipped
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as file:
+            state = json.load(file)
+        return cls(
+            path, state['run_id'], state['position'], state['written'], state['rejected'], state.get('skipped', 0),
+        )
+
+    def save(self):
+        state = {
+            'run_id': self.run_id,
+            'position': self.position,
+            'written': self.written,
+            'rejected': self.rejected,
+            'skipped': self.skipped,
+        }
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def record_uuid(self, index):
+        return uuid.uuid5(uuid.UUID(self.run_id), str(index))
+
+
+class OTPImporter(object):
+    """
+    Stream records into PyOTP with one bulk INSERT transaction per chunk
+    """
+    def __init__(self, checkpoint, chunk_size=None, on_chunk=None, on_reject=None):
+        """
+        :param checkpoint: Checkpoint, records before `checkpoint.position` are skipped
+        :param chunk_size: Records per transaction
+        :param on_chunk: Called with an ImportReport after every chunk
+        :param on_reject: Called with every Rejected record
+        """
+        self.checkpoint = checkpoint
+        self.chunk_size = chunk_size or getattr(settings, 'OTP_IMPORT_CHUNK_SIZE', 1000)
+        self.on_chunk = on_chunk
+        self.on_reject = on_reject
+
+    def _write(self, chunk):
+        """
+        Insert the valid records of a chunk, rows of a replayed chunk are skipped
+        :return: (inserted, skipped, rejected)
+        """
+        rows, rejected = [], 0
+        usernames = {fields['username'] for _, fields, error in chunk if error is None and fields['username']}
+        user_ids = {}
+        if usernames:
+            user_ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+
+        for index, fields, error in chunk:
+            if error is None and fields['username'] and fields['username'] not in user_ids:
+                error = 'unknown username {}'.format(fields['username'])
+            if error is not None:
+                rejected += 1
+                if self.on_reject is not None:
+                    self.on_reject(Rejected(index, error, fields))
+                continue
+            username = fields.pop('username')
+            rows.append(PyOTP(uuid=self.checkpoint.record_uuid(index), user_id=user_ids.get(username), **fields))
+
+        with transaction.atomic():
+            existing = set(PyOTP.objects.filter(uuid__in=[row.uuid for row in rows]).values_list('uuid', flat=True))
+            new_rows = [row for row in rows if row.uuid not in existing]
+            PyOTP.objects.bulk_create(new_rows, batch_size=self.chunk_size, ignore_conflicts=True)
+        return len(new_rows), len(rows) - len(new_rows), rejected
+
+    def run(self, records):
+        """
+        Import records, saving the checkpoint after every committed chunk
+        :param records: Iterable of record dicts
+        :return: ImportReport of this run
+        """
+        start = time.perf_counter()
+        skip = self.checkpoint.position
+        read = written = skipped = rejected = 0
+
+        def validated():
+            for index, record in enumerate(records):
+                if index < skip:
+                    continue
+                try:
+                    yield index, validate(record), None
+                except ValueError as e:
+                    yield index, record, str(e)
+
+        for chunk in chunked(validated(), self.chunk_size):
+            chunk_written, chunk_skipped, chunk_rejected = self._write(chunk)
+            read += len(chunk)
+            written += chunk_written
+            skipped += chunk_skipped
+            rejected += chunk_rejected
+            self.checkpoint.position = chunk[-1][0] + 1
+            self.checkpoint.written += chunk_written
+            self.checkpoint.skipped += chunk_skipped
+            self.checkpoint.rejected += chunk_rejected
+            self.checkpoint.save()
+            if self.on_chunk is not None:
+                self.on_chunk(ImportReport(read, written, skipped, rejected, time.perf_counter() - start))
+        return ImportReport(read, written, skipped, rejected, time.perf_counter() - start)
@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+from collections import namedtuple
+from django.conf import settings
+
+ImportTiming = namedtuple('ImportTiming', ['module', 'self_us', 'cumulative_us', 'depth'])
+
+# What a fresh worker runs before serving its first request
+STARTUP_CODE = '''
+import time
+start = time.perf_counter()
+from {wsgi_module} import application
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(time.perf_counter() - start)
+'''
+
+
+def parse_importtime(output):
+    """
+    Parse the stderr of `python -X importtime`
+    :param output: stderr text
+    :return: List of ImportTiming, in import order
+    """
+    timings = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        module = name.strip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        timings.append(ImportTiming(module, int(self_us), int(cumulative_us), depth))
+    return timings
+
+
+def profile_startup(wsgi_module=None, env=None):
+    """
+    Start a worker in a fresh interpreter and time its imports
+    :param wsgi_module: Module exposing the WSGI application, defaults to WSGI_APPLICATION's module
+    :param env: Extra environment variables
+    :return: (startup time in seconds, list of ImportTiming, set of imported modules)
+    """
+    if wsgi_module is None:
+        wsgi_module = settings.WSGI_APPLICATION.rsplit('.', 1)[0]
+    child_env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'Otter.settings'))
+    child_env.update(env or {})
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_CODE.format(wsgi_module=wsgi_module)],
+        cwd=settings.BASE_DIR,
+        env=child_env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = parse_importtime(result.stderr)
+    return float(result.stdout.strip().splitlines()[-1]), timings, {timing.module for timing in timings}
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, close_old_connections, connection, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from Otter.databases import DB_PROFILES, get_databases
+from api.benchmarks import summarize, test_database
+
+
+class Command(BaseCommand):
+    help = (
+        'Concurrent generate/verify load against every storage profile (see Otter.databases), '
+        'each on a throwaway test database, and compare the throughput. '
+        'Profiles whose server cannot be reached are reported and skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profiles', nargs='+', default=sorted(DB_PROFILES), help='Storage profiles to compare.',
+        )
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of load per profile.')
+        parser.add_argument('--verify-ratio', type=int, default=4, help='Verifications per generation.')
+
+    def handle(self, *args, **options):
+        unknown = set(options['profiles']) - set(DB_PROFILES)
+        if unknown:
+            raise CommandError('Unknown profiles: {}'.format(', '.join(sorted(unknown))))
+
+        for profile in options['profiles']:
+            try:
+                with self._profile(profile), test_database():
+                    elapsed, latencies, errors = self._load(
+                        options['threads'], options['duration'], options['verify_ratio'],
+                    )
+                    vendor = connection.vendor
+            except (ImproperlyConfigured, DatabaseError) as e:
+                self.stderr.write('profile={} skipped: {}'.format(profile, e))
+                continue
+
+            self.stdout.write('profile={} vendor={} threads={} errors={}'.format(
+                profile, vendor, options['threads'], len(errors),
+            ))
+            for name, values in latencies.items():
+                stats = summarize(values, elapsed)
+                self.stdout.write('{:<10} {:>8} req {:>10.1f} req/s  p50 {:>8.2f}ms  p99 {:>8.2f}ms'.format(
+                    name, stats['count'], stats['throughput'], stats['p50_us'] / 1000, stats['p99_us'] / 1000,
+                ))
+
+    @contextmanager
+    def _profile(self, profile):
+        """
+        Point the default alias at a storage profile, threads opened in the block connect to it
+        """
+        old_settings = connections.databases[DEFAULT_DB_ALIAS]
+        self._drop_connection()
+        connections.databases[DEFAULT_DB_ALIAS] = get_databases(profile, os.environ, settings.BASE_DIR)[DEFAULT_DB_ALIAS]
+        try:
+            yield
+        finally:
+            self._drop_connection()
+            connections.databases[DEFAULT_DB_ALIAS] = old_settings
+
+    def _drop_connection(self):
+        """
+        Close and forget this thread's default connection, without opening one that does not exist
+        """
+        connections.close_all()
+        try:
+            del connections[DEFAULT_DB_ALIAS]
+        except AttributeError:
+            pass
+
+    def _load(self, threads, duration, verify_ratio):
+        """
+        :return: (elapsed seconds, latencies per operation, error status codes)
+        """
+        latencies = {'generate': [], 'verify': []}
+        errors = []
+        deadline = time.perf_counter() + duration
+        lock = threading.Lock()
+
+        def worker():
+            client = Client()
+            local = {'generate': [], 'verify': []}
+            try:
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    response = client.post(reverse('generate-totp'), {'timeout': 30})
+                    local['generate'].append(time.perf_counter() - start)
+                    if response.status_code != 201:
+                        errors.append(response.status_code)
+                        continue
+                    url = reverse('verify-otp', kwargs={'otp_type': 'totp', 'uuid': response.data['otp_uuid']})
+                    for _ in range(verify_ratio):
+                        start = time.perf_counter()
+                        client.post(url, {'otp': response.data['otp']})
+                        local['verify'].append(time.perf_counter() - start)
+            finally:
+                close_old_connections()
+                connection.close()
+                with lock:
+                    for name, values in local.items():
+                        latencies[name].extend(values)
+
+        with override_settings(ALLOWED_HOSTS=['testserver'], OTP_THROTTLE_RATES={}):
+            start = time.perf_counter()
+            workers = [threading.Thread(target=worker) for _ in range(threads)]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        return elapsed, latencies, errors
@@ -0,0 +1,259 @@
+import json
+import platform
+import socket
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.db import close_old_connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from fcm_django.models import FCMDevice
+from api import callbacks, push
+from api.benchmarks import summarize, test_database
+from api.challenges import get_challenge_store
+from api.models import PyOTP
+
+BASELINE_VERSION = 1
+METRICS_TOKEN = 'bench-endpoints'
+
+Scenario = namedtuple('Scenario', ('method', 'path', 'data', 'expected', 'headers'))
+
+
+def post(path, data, expected):
+    return Scenario('POST', path, data, expected, {})
+
+
+def get(path, params, expected, headers=None):
+    return Scenario('GET', path, params, expected, headers or {})
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test every route of api/routers.py against an in-process server with a fake FCM transport, '
+        'report latency percentiles and throughput, and save/compare JSON baselines. '
+        'Runs on a throwaway test database, nothing is left in the configured one. '
+        'There is no remote mode: the overrides (no throttling, fake FCM, no callback) only apply in process.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per route.')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--warmup', type=int, default=20, help='Untimed requests per route.')
+        parser.add_argument('--routes', nargs='*', help='Only these route names.')
+        parser.add_argument('--output', help='Write the results as a JSON baseline.')
+        parser.add_argument('--compare', help='Compare with a JSON baseline.')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Regression threshold on p50/p99/throughput (in percent) for --compare.')
+
+    def handle(self, *args, **options):
+        overrides = {
+            'ALLOWED_HOSTS': ['*'],
+            'OTP_THROTTLE_RATES': {},
+            'FCM_PUSH_TRANSPORT': 'api.push.LocalTransport',
+            'PUSH_CALLBACK_URL': None,
+            'METRICS_TOKEN': METRICS_TOKEN,
+        }
+        with override_settings(**overrides), test_database():
+            push._dispatcher = callbacks._dispatcher = None
+            try:
+                fixtures = self._fixtures()
+                scenarios = self._scenarios(fixtures)
+                if options['routes']:
+                    unknown = set(options['routes']) - set(scenarios)
+                    if unknown:
+                        raise CommandError('Unknown routes: {}'.format(', '.join(sorted(unknown))))
+                    scenarios = {name: scenarios[name] for name in options['routes']}
+                results = self._run(scenarios, options['requests'], options['concurrency'], options['warmup'])
+            finally:
+                push._dispatcher = callbacks._dispatcher = None
+
+        report = {
+            'version': BASELINE_VERSION,
+            'meta': self._meta(options),
+            'results': results,
+        }
+        for name, stats in results.items():
+            self.stdout.write('{:<30} {:>7.1f} req/s  p50 {:>8.2f}ms  p90 {:>8.2f}ms  p99 {:>8.2f}ms  errors {}'.format(
+                name, stats['throughput'], stats['p50_us'] / 1000, stats['p90_us'] / 1000,
+                stats['p99_us'] / 1000, stats['errors'],
+            ))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        if options['compare']:
+            self._compare(report, options['compare'], options['threshold'])
+
+    def _fixtures(self):
+        user, _ = User.objects.get_or_create(username='bench-endpoints')
+        if not FCMDevice.objects.filter(user=user).exists():
+            FCMDevice.objects.create(user=user, registration_id='bench-endpoints-device')
+        # mobile-push registers devices, keep them away from the send-push user
+        mobile_user, _ = User.objects.get_or_create(username='bench-endpoints-mobile')
+        totp = PyOTP.objects.create(secret='JBSWY3DPEHPK3PXP', interval=30)
+        pushed = PyOTP.objects.create(secret='JBSWY3DPEHPK3PXP', interval=30, user=user, refer_code='ABCD')
+        # Pending for OTP_CHALLENGE_TTL, push-status reads it without waiting
+        get_challenge_store().register(pushed.uuid, 'WXYZ')
+        # The export is admin only: a session cookie, basic auth would hash a password per request
+        admin = User.objects.create_user('bench-endpoints-admin', is_staff=True)
+        client = Client()
+        client.force_login(admin)
+        admin_cookie = '{}={}'.format(settings.SESSION_COOKIE_NAME, client.cookies[settings.SESSION_COOKIE_NAME].value)
+        return {'user': user, 'mobile_user': mobile_user, 'totp': totp, 'pushed': pushed, 'admin_cookie': admin_cookie}
+
+    def _scenarios(self, fixtures):
+        """
+        Route name -> Scenario, JSON body of a POST or query string of a GET
+        """
+        totp_uuid = fixtures['totp'].uuid
+        pushed_uuid = fixtures['pushed'].uuid
+        username = fixtures['user'].username
+        provision = {'name': 'bench@otter', 'issuer_name': 'Otter'}
+        return {
+            'generate-hotp': post(reverse('generate-hotp'), {'count': 1}, (201,)),
+            'generate-totp': post(reverse('generate-totp'), {'timeout': 30}, (201,)),
+            'generate-hotp-provision-uri': post(reverse('generate-hotp-provision-uri'), dict(provision, count=1), (201,)),
+            'generate-totp-provision-uri': post(reverse('generate-totp-provision-uri'), dict(provision, timeout=30), (201,)),
+            'generate-hotp-bulk': post(reverse('generate-hotp-bulk'), {'items': [{'count': 1}] * 10}, (201,)),
+            'generate-totp-bulk': post(reverse('generate-totp-bulk'), {'items': [{'timeout': 30}] * 10}, (201,)),
+            'verify-otp': post(
+                reverse('verify-otp', kwargs={'otp_type': 'totp', 'uuid': totp_uuid}), {'otp': '000000'}, (200, 400),
+            ),
+            'verify-otp-bulk': post(
+                reverse('verify-otp-bulk'),
+                {'items': [{'uuid': str(totp_uuid), 'otp_type': 'totp', 'otp': '000000'}] * 10},
+                (200,),
+            ),
+            'register-push': post(reverse('register-push', kwargs={'uuid': pushed_uuid}), {'username': username}, (200,)),
+            'send-push': post(reverse('send-push', kwargs={'uuid': pushed_uuid}), {}, (200,)),
+            'verify-push': post(reverse('verify-push'), {'username': username, 'refer_code': 'ABCD', 'accept': False}, (400,)),
+            'mobile-push': post(
+                reverse('mobile-push'),
+                {'username': fixtures['mobile_user'].username, 'registration_id': 'bench-endpoints-mobile-device'},
+                (200,),
+            ),
+            'push-status': get(reverse('push-status', kwargs={'uuid': pushed_uuid, 'refer': 'WXYZ'}), {'timeout': 0}, (200,)),
+            # Every generate scenario above adds rows, the export walks all of them
+            'export-otps': get(reverse('export-otps'), {'output': 'ndjson'}, (200,), {'Cookie': fixtures['admin_cookie']}),
+            'metrics': get(reverse('metrics'), {}, (200,), {'Authorization': 'Bearer {}'.format(METRICS_TOKEN)}),
+        }
+
+    def _run(self, scenarios, requests_per_route, concurrency, warmup):
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+        # Accepted sockets inherit TCP_NODELAY, small responses are not held back by Nagle
+        server.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        server.set_app(get_internal_wsgi_application())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:{}'.format(server.server_port)
+
+        try:
+            return {
+                name: self._run_scenario(url, scenario, requests_per_route, concurrency, warmup)
+                for name, scenario in scenarios.items()
+            }
+        finally:
+            server.shutdown()
+            server.server_close()
+            close_old_connections()
+
+    def _run_scenario(self, url, scenario, total, concurrency, warmup):
+        import requests
+
+        url += scenario.path
+        headers = dict(scenario.headers, Accept='application/json')
+        if scenario.method == 'GET':
+            kwargs = {'params': scenario.data, 'headers': headers}
+        else:
+            kwargs = {'json': scenario.data, 'headers': headers}
+        with requests.Session() as session:
+            for _ in range(warmup):
+                session.request(scenario.method, url, **kwargs)
+
+        latencies, errors = [], []
+        lock = threading.Lock()
+        counter = iter(range(total))
+
+        def worker():
+            session = requests.Session()
+            local_latencies, local_errors = [], []
+            while True:
+                with lock:
+                    if next(counter, None) is None:
+                        break
+                start = time.perf_counter()
+                try:
+                    response = session.request(scenario.method, url, **kwargs)
+                    status = response.status_code
+                except requests.RequestException:
+                    status = None
+                local_latencies.append(time.perf_counter() - start)
+                if status not in scenario.expected:
+                    local_errors.append(status)
+            with lock:
+                latencies.extend(local_latencies)
+                errors.extend(local_errors)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = summarize(latencies, time.perf_counter() - start)
+        stats['errors'] = len(errors)
+        return stats
+
+    def _meta(self, options):
+        try:
+            commit = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL,
+            ).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+        }
+
+    def _compare(self, report, path, threshold):
+        with open(path) as f:
+            baseline = json.load(f)
+        if baseline.get('version') != BASELINE_VERSION:
+            raise CommandError('Unsupported baseline version: {}'.format(baseline.get('version')))
+
+        regressions = []
+        self.stdout.write('\nCompared with {} ({})'.format(path, baseline['meta'].get('commit')))
+        for name, stats in report['results'].items():
+            old = baseline['results'].get(name)
+            if old is None:
+                continue
+            changes = {}
+            for metric, higher_is_better in (('throughput', True), ('p50_us', False), ('p99_us', False)):
+                if not old[metric]:
+                    continue
+                change = (stats[metric] - old[metric]) / old[metric] * 100
+                changes[metric] = change
+                if (-change if higher_is_better else change) > threshold:
+                    regressions.append('{} {}'.format(name, metric))
+            self.stdout.write('{:<30} '.format(name) + '  '.join(
+                '{} {:+.1f}%'.format(metric, change) for metric, change in changes.items()
+            ))
+
+        if regressions:
+            raise CommandError('Regressions over {}%: {}'.format(threshold, ', '.join(regressions)))
@@ -0,0 +1,45 @@
+import pyotp
+from django.core.management.base import BaseCommand
+from api.benchmarks import format_stats, measure
+from api.engine import OTPEngine
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark of OTP verification: pyotp vs the precomputed HMAC engine.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+        parser.add_argument('--secrets', type=int, default=100, help='Distinct secrets verified in rotation.')
+        parser.add_argument('--window', type=int, default=1, help='TOTP valid window.')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        window = options['window']
+        secrets = [pyotp.random_base32() for _ in range(options['secrets'])]
+        engine = OTPEngine()
+        state = {'i': 0}
+
+        def next_secret():
+            state['i'] += 1
+            return secrets[state['i'] % len(secrets)]
+
+        def pyotp_hotp():
+            pyotp.HOTP(next_secret()).verify('123456', 42)
+
+        def engine_hotp():
+            engine.hotp_verify('123456', next_secret(), 42)
+
+        def pyotp_totp():
+            pyotp.TOTP(next_secret(), interval=30).verify('123456', valid_window=window)
+
+        def engine_totp():
+            engine.totp_verify('123456', next_secret(), 30, valid_window=window)
+
+        for name, func in (
+            ('pyotp hotp', pyotp_hotp),
+            ('engine hotp', engine_hotp),
+            ('pyotp totp (window={})'.format(window), pyotp_totp),
+            ('engine totp (window={})'.format(window), engine_totp),
+        ):
+            stats = measure(func, iterations, warmup=len(secrets))
+            self.stdout.write(format_stats(name, stats))
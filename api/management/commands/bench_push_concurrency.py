@@ -0,0 +1,86 @@
+import asyncio
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from fcm_django.models import FCMDevice
+from api.benchmarks import summarize
+from api.models import PyOTP
+
+
+class Command(BaseCommand):
+    help = (
+        'Fire thousands of concurrent push approval requests at a running server. '
+        'Run it against the WSGI (e.g. gunicorn Otter.wsgi) and ASGI (e.g. uvicorn Otter.asgi:application) '
+        'deployments and compare. The refer code is single use, so every verify-push after the first '
+        'answers 400 after the same lookup. The fixture rows are deleted afterwards. Needs httpx.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Base URL of the running server.')
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--concurrency', type=int, default=1000, help='Requests in flight at once.')
+        parser.add_argument('--route', choices=('verify-push', 'send-push'), default='verify-push')
+        parser.add_argument('--timeout', type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        try:
+            import httpx  # noqa: F401
+        except ImportError:
+            raise CommandError('bench_push_concurrency needs httpx.')
+
+        # The server under test reads these rows from the configured database, so they cannot live
+        # in a throwaway test database: everything created here is deleted afterwards
+        user, user_created = User.objects.get_or_create(username='bench-push')
+        device = None
+        if not FCMDevice.objects.filter(user=user).exists():
+            device = FCMDevice.objects.create(user=user, registration_id='bench-push-device')
+        obj = PyOTP.objects.create(secret='JBSWY3DPEHPK3PXP', interval=30, user=user, refer_code='ABCD')
+        try:
+            self._bench(user, obj, options)
+        finally:
+            obj.delete()
+            if device is not None:
+                device.delete()
+            if user_created:
+                user.delete()
+
+    def _bench(self, user, obj, options):
+        if options['route'] == 'verify-push':
+            path, payload = reverse('verify-push'), {'username': user.username, 'refer_code': 'ABCD', 'accept': True}
+        else:
+            path, payload = reverse('send-push', kwargs={'uuid': obj.uuid}), {}
+
+        latencies, statuses, elapsed = asyncio.run(self._run(
+            options['url'].rstrip('/') + path, payload, options['requests'], options['concurrency'], options['timeout'],
+        ))
+        stats = summarize(latencies, elapsed)
+        self.stdout.write('{} {} requests, {} in flight: {:.1f} req/s  p50 {:.2f}ms  p99 {:.2f}ms  max {:.2f}ms'.format(
+            options['route'], stats['count'], options['concurrency'], stats['throughput'],
+            stats['p50_us'] / 1000, stats['p99_us'] / 1000, stats['max_us'] / 1000,
+        ))
+        self.stdout.write('status codes: {}'.format(', '.join(
+            '{}={}'.format(code, statuses.count(code)) for code in sorted(set(statuses), key=str)
+        )))
+
+    async def _run(self, url, payload, total, concurrency, timeout):
+        import httpx
+
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, statuses = [], []
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+        async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+            async def request():
+                async with semaphore:
+                    start = time.perf_counter()
+                    try:
+                        response = await client.post(url, json=payload)
+                        statuses.append(response.status_code)
+                    except httpx.HTTPError as e:
+                        statuses.append(type(e).__name__)
+                    latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(request() for _ in range(total)))
+            return latencies, statuses, time.perf_counter() - start
@@ -0,0 +1,68 @@
+import random
+import string
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from api.benchmarks import format_stats, measure, test_database
+from api.mixins import FCMMixin
+from api.models import PyOTP
+from api.utils import chunked
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed PyOTP rows and measure the push approval (username, refer code) lookup of verify_push '
+        'with and without the composite index. Runs on a throwaway test database, '
+        'the configured database and its schema are never touched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000000, help='PyOTP rows to seed.')
+        parser.add_argument('--users', type=int, default=100000, help='Users to spread the rows over.')
+        parser.add_argument('--lookups', type=int, default=2000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        with test_database():
+            self._seed(options['rows'], options['users'], options['batch_size'])
+            samples = list(
+                PyOTP.objects.filter(user__isnull=False, refer_code__isnull=False)
+                .values_list('user__username', 'refer_code')[:options['lookups']]
+            )
+            if not samples:
+                self.stderr.write('No seeded rows to look up.')
+                return
+
+            mixin = FCMMixin()
+
+            def lookup():
+                # The query verify_push runs: join on User, newest matching PyOTP
+                mixin._verify_message(*random.choice(samples))
+
+            index = next(index for index in PyOTP._meta.indexes if index.name == 'api_pyotp_user_refer_idx')
+            self.stdout.write(format_stats('with composite index', measure(lookup, options['lookups'], warmup=100)))
+            with connection.schema_editor() as schema_editor:
+                schema_editor.remove_index(PyOTP, index)
+            self.stdout.write(format_stats('without composite index', measure(lookup, options['lookups'], warmup=100)))
+
+    def _seed(self, rows, users, batch_size):
+        self.stdout.write('Seeding {} users and {} PyOTP rows...'.format(users, rows))
+        with transaction.atomic():
+            User.objects.bulk_create(
+                (User(username='bench-{}'.format(i)) for i in range(users)), batch_size=batch_size,
+            )
+        user_ids = list(User.objects.values_list('id', flat=True))
+        letters = string.ascii_uppercase + '234567'
+
+        def rows_iter():
+            for _ in range(rows):
+                yield PyOTP(
+                    user_id=random.choice(user_ids),
+                    secret='A' * 16,
+                    interval=30,
+                    refer_code=''.join(random.choice(letters) for _ in range(4)),
+                )
+
+        for chunk in chunked(rows_iter(), batch_size):
+            with transaction.atomic():
+                PyOTP.objects.bulk_create(chunk, batch_size=batch_size)
@@ -0,0 +1,20 @@
+import pyotp
+from django.core.management.base import BaseCommand
+from api.benchmarks import format_stats, measure
+from api.entropy import SecretPool
+
+
+class Command(BaseCommand):
+    help = 'Benchmark secret generation, pyotp.random_base32 against the pre-generated secret pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        for length in (16, 4):
+            pool = SecretPool(length=length)
+            self.stdout.write(format_stats(
+                'pyotp.random_base32({})'.format(length), measure(lambda: pyotp.random_base32(length=length), iterations)
+            ))
+            self.stdout.write(format_stats('SecretPool({}).get'.format(length), measure(pool.get, iterations)))
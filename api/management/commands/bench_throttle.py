@@ -0,0 +1,46 @@
+import uuid
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework.request import Request
+from api.benchmarks import format_stats, measure
+from api.throttling import TokenBucketStore, VerifyIPThrottle, VerifyUUIDThrottle, _stores
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the throttle rejection path of the verify endpoints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100000)
+        parser.add_argument('--keys', type=int, default=10000, help='Distinct attacker keys.')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        keys = [str(uuid.uuid4()) for _ in range(options['keys'])]
+        state = {'i': 0}
+
+        def next_key():
+            state['i'] += 1
+            return keys[state['i'] % len(keys)]
+
+        # Empty buckets: every call below is a rejection
+        store = TokenBucketStore(burst=1, refill_rate=1e-9)
+        for key in keys:
+            store.consume(key)
+        self.stdout.write(format_stats('store.consume (reject)', measure(lambda: store.consume(next_key()), iterations)))
+
+        _stores['ip'] = _stores['uuid'] = store
+        factory = RequestFactory()
+        throttles = [VerifyIPThrottle(), VerifyUUIDThrottle()]
+        view = type('View', (), {'kwargs': {}})()
+        request = Request(factory.post('/verify-otp/totp/', REMOTE_ADDR='10.0.0.1'))
+        store.consume('10.0.0.1')
+
+        def check():
+            view.kwargs = {'uuid': next_key()}
+            for throttle in throttles:
+                throttle.allow_request(request, view)
+
+        try:
+            self.stdout.write(format_stats('DRF throttles (reject)', measure(check, iterations)))
+        finally:
+            _stores.clear()
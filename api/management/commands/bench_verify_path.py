@@ -0,0 +1,65 @@
+import pyotp
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from api.benchmarks import format_stats, measure
+from api.models import PyOTP
+from api.serializers import VerifyOTPSerializer
+from api.views import PyOTPViewset
+
+
+class LegacyPyOTPViewset(PyOTPViewset):
+    """
+    Verification as it was before the lean path: full serializer validation,
+    `serializer.data` re-serialization and generic `get_object()`
+    """
+    def get_object(self):
+        return super(PyOTPViewset, self).get_object()
+
+    def verify_otp(self, request, otp_type, uuid):
+        obj = self.get_object()
+        serializer = self.get_serializer_class()
+        serializer = serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        valid_otp = serializer.verify_otp(serializer.data.get('otp'), obj, otp_type)
+        if not valid_otp:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_200_OK)
+
+
+class Command(BaseCommand):
+    help = 'Per-request overhead of the verify-otp pipeline: legacy serializer path vs the lean path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        obj = PyOTP.objects.create(secret=pyotp.random_base32(), count=1)
+        payload = {'otp': 'wrong'}
+        kwargs = {'otp_type': 'hotp', 'uuid': str(obj.uuid)}
+        factory = APIRequestFactory()
+        path = '/verify-otp/hotp/{}/'.format(obj.uuid)
+
+        def parse_legacy():
+            serializer = VerifyOTPSerializer(data=payload)
+            serializer.is_valid(raise_exception=True)
+            return serializer.data.get('otp')
+
+        def parse_lean():
+            return VerifyOTPSerializer.parse_otp(payload)
+
+        self.stdout.write(format_stats('payload: serializer', measure(parse_legacy, iterations, warmup=100)))
+        self.stdout.write(format_stats('payload: lean', measure(parse_lean, iterations, warmup=100)))
+
+        with override_settings(OTP_THROTTLE_RATES={}):
+            for name, viewset in (('view: legacy', LegacyPyOTPViewset), ('view: lean', PyOTPViewset)):
+                view = viewset.as_view({'post': 'verify_otp'})
+
+                def call():
+                    view(factory.post(path, payload, format='json'), **kwargs)
+
+                self.stdout.write(format_stats(name, measure(call, iterations, warmup=100)))
+        obj.delete()
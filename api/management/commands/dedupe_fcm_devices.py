@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+from fcm_django.models import FCMDevice
+from api.devices import dedupe_devices
+
+
+class Command(BaseCommand):
+    help = 'Delete duplicated FCM devices, keeping the newest row of every (user, registration_id) pair.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Duplicated pairs handled per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count duplicated rows.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+        deleted = dedupe_devices(FCMDevice, chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        self.stdout.write('{} {} duplicated devices'.format('found' if options['dry_run'] else 'deleted', deleted))
@@ -0,0 +1,49 @@
+import datetime
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from api.export import EXPORT_FORMATS, export_queryset, iter_records, render
+
+
+class Command(BaseCommand):
+    help = 'Stream PyOTP metadata (uuid, user, type, created_at, issuer) as NDJSON or CSV in constant memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--since', help='Only rows created at or after this ISO date/datetime.')
+        parser.add_argument('--until', help='Only rows created before this ISO date/datetime.')
+        parser.add_argument('--issuer', help='Only rows of this issuer name.')
+        parser.add_argument('--chunk-size', type=int, help='Rows per query.')
+        parser.add_argument('--output', default='-', help="Output file, '-' writes stdout.")
+
+    def _parse_datetime(self, value, name):
+        if value is None:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None and parse_date(value) is not None:
+            parsed = datetime.datetime.combine(parse_date(value), datetime.time())
+        if parsed is None:
+            raise CommandError('--{} is not an ISO date/datetime: {}'.format(name, value))
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] is not None and options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+        queryset = export_queryset(
+            since=self._parse_datetime(options['since'], 'since'),
+            until=self._parse_datetime(options['until'], 'until'),
+            issuer=options['issuer'],
+        )
+        chunks = render(iter_records(queryset, chunk_size=options['chunk_size']), options['format'])
+
+        output = options['output']
+        file = sys.stdout if output == '-' else open(output, 'w', newline='', encoding='utf-8')
+        try:
+            for chunk in chunks:
+                file.write(chunk)
+        finally:
+            if file is not sys.stdout:
+                file.close()
@@ -0,0 +1,45 @@
+import csv
+import json
+import sys
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from fcm_django.models import FCMDevice
+from api.devices import DeviceRow, import_devices
+
+
+class Command(BaseCommand):
+    help = (
+        'Register FCM devices in batches from a CSV (username,registration_id[,type,name] with a header) '
+        'or NDJSON file, devices already registered are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, '-' reads stdin.")
+        parser.add_argument('--format', choices=('csv', 'ndjson'), help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per transaction.')
+
+    def _rows(self, file, fmt):
+        if fmt == 'csv':
+            records = csv.DictReader(file)
+        else:
+            records = (json.loads(line) for line in file if line.strip())
+        for line, record in enumerate(records, 1):
+            try:
+                username, registration_id = record['username'], record['registration_id']
+            except (KeyError, TypeError):
+                raise CommandError('Record {} needs username and registration_id.'.format(line))
+            yield DeviceRow(username, registration_id, record.get('type'), record.get('name'))
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            read, unknown = import_devices(FCMDevice, User, self._rows(file, fmt), batch_size=options['batch_size'])
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        self.stdout.write('read {} devices, skipped {} with an unknown username'.format(read, unknown))
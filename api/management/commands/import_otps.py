@@ -0,0 +1,75 @@
+import json
+import os
+from django.core.management.base import BaseCommand, CommandError
+from api.importer import IMPORT_FORMATS, READERS, Checkpoint, OTPImporter
+
+
+class Command(BaseCommand):
+    help = (
+        'Import existing HOTP/TOTP secrets from CSV (with a header), NDJSON or otpauth:// URIs, '
+        'one chunked bulk INSERT per transaction. Re-run with --resume after an interruption.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Input file.')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, help='Records per transaction.')
+        parser.add_argument('--checkpoint', help='Checkpoint file, defaults to <path>.checkpoint.')
+        parser.add_argument('--resume', action='store_true', help='Continue from the checkpoint.')
+        parser.add_argument('--rejects', help='Write rejected records to this NDJSON file.')
+
+    def _format(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension in ('.ndjson', '.jsonl'):
+            return 'ndjson'
+        if extension in ('.txt', '.uri', '.uris'):
+            return 'otpauth'
+        return 'csv'
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or self._format(path)
+        if options['chunk_size'] is not None and options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+
+        checkpoint_path = options['checkpoint'] or '{}.checkpoint'.format(path)
+        if options['resume']:
+            if not os.path.exists(checkpoint_path):
+                raise CommandError('No checkpoint at {}.'.format(checkpoint_path))
+            checkpoint = Checkpoint.load(checkpoint_path)
+            self.stderr.write('resuming at record {}'.format(checkpoint.position))
+        elif os.path.exists(checkpoint_path):
+            raise CommandError('{} exists, pass --resume to continue that import.'.format(checkpoint_path))
+        else:
+            checkpoint = Checkpoint(checkpoint_path)
+
+        rejects = open(options['rejects'], 'a', encoding='utf-8') if options['rejects'] else None
+
+        def on_reject(rejected):
+            if rejects is not None:
+                rejects.write(json.dumps({
+                    'index': rejected.index,
+                    'error': rejected.error,
+                    'record': {key: value for key, value in rejected.record.items() if key != 'secret'},
+                }) + '\n')
+
+        def on_chunk(report):
+            self.stderr.write('{} records, {} written, {} already imported, {} rejected, {:.0f} records/s'.format(
+                report.read, report.written, report.skipped, report.rejected,
+                report.read / report.seconds if report.seconds else 0,
+            ))
+
+        importer = OTPImporter(checkpoint, chunk_size=options['chunk_size'], on_chunk=on_chunk, on_reject=on_reject)
+        try:
+            with open(path, newline='', encoding='utf-8') as file:
+                report = importer.run(READERS[fmt](file))
+        except KeyboardInterrupt:
+            raise CommandError('Interrupted at record {}, re-run with --resume.'.format(checkpoint.position))
+        finally:
+            if rejects is not None:
+                rejects.close()
+
+        self.stdout.write('imported {} records ({} in total), {} already imported, rejected {} ({} in total), {:.2f}s'.format(
+            report.written, checkpoint.written, report.skipped, report.rejected, checkpoint.rejected, report.seconds,
+        ))
+        os.remove(checkpoint_path)
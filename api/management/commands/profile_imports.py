@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.importtime import profile_startup
+
+
+class Command(BaseCommand):
+    help = 'Profile the cold start of a worker, the slowest imports by cumulative time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=25, help='Number of modules to show.')
+        parser.add_argument('--prefix', action='append', default=[], help='Only show modules starting with this prefix.')
+        parser.add_argument('--self', action='store_true', dest='sort_self', help='Sort by self time instead.')
+        parser.add_argument(
+            '--budget', type=float, default=None,
+            help='Fail when startup exceeds this many seconds, defaults to WORKER_STARTUP_BUDGET.',
+        )
+
+    def handle(self, *args, **options):
+        elapsed, timings, _ = profile_startup()
+
+        if options['prefix']:
+            timings = [timing for timing in timings if timing.module.startswith(tuple(options['prefix']))]
+        key = (lambda timing: timing.self_us) if options['sort_self'] else (lambda timing: timing.cumulative_us)
+        self.stdout.write('{:<60} {:>12} {:>12}'.format('module', 'self ms', 'cumul. ms'))
+        for timing in sorted(timings, key=key, reverse=True)[:options['top']]:
+            self.stdout.write('{:<60} {:>12.1f} {:>12.1f}'.format(
+                '  ' * timing.depth + timing.module, timing.self_us / 1000, timing.cumulative_us / 1000,
+            ))
+
+        budget = options['budget']
+        if budget is None:
+            budget = getattr(settings, 'WORKER_STARTUP_BUDGET', None)
+        self.stdout.write('worker startup: {:.1f}ms{}'.format(
+            elapsed * 1000, '' if budget is None else ' (budget {:.1f}ms)'.format(budget * 1000),
+        ))
+        if budget is not None and elapsed > budget:
+            raise CommandError('Worker startup took {:.1f}ms, over the {:.1f}ms budget.'.format(elapsed * 1000, budget * 1000))
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.retention import OTP_TYPE_FILTERS, expired_queryset, purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired PyOTP rows in bounded chunks, following the OTP_RETENTION policy.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', choices=sorted(OTP_TYPE_FILTERS), help='Only purge this OTP type.')
+        parser.add_argument('--max-age', type=int, help='Override the retention period (in seconds).')
+        parser.add_argument('--chunk-size', type=int, help='Rows deleted per transaction.')
+        parser.add_argument('--pause', type=float, default=0, help='Sleep between chunks (in seconds).')
+        parser.add_argument('--dry-run', action='store_true', help='Only count expired rows.')
+
+    def handle(self, *args, **options):
+        policy = dict(getattr(settings, 'OTP_RETENTION', {}))
+        if options['type']:
+            policy = {options['type']: policy.get(options['type'])}
+        if options['max_age'] is not None:
+            policy = {otp_type: options['max_age'] for otp_type in policy}
+        if options['chunk_size'] is not None and options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+
+        if options['dry_run']:
+            for otp_type, max_age in policy.items():
+                if max_age is None:
+                    continue
+                count = expired_queryset(otp_type, max_age).count()
+                self.stdout.write('{}: {} expired rows'.format(otp_type, count))
+            return
+
+        reports = purge_expired(policy, chunk_size=options['chunk_size'], pause=options['pause'])
+        for report in reports:
+            self.stdout.write('{}: purged {} rows in {} chunks, {:.2f}s'.format(
+                report.otp_type, report.purged, report.chunks, report.seconds,
+            ))
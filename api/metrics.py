@@ -0,0 +1,167 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    'otter_request_duration_seconds': ('histogram', 'Request latency per route.'),
+    'otter_section_duration_seconds': ('histogram', 'Time spent in HMAC, QR rendering, FCM and callback calls.'),
+    'otter_db_queries_total': ('counter', 'DB queries per route.'),
+    'otter_db_query_seconds_total': ('counter', 'DB query time per route.'),
+}
+
+
+class _Store(object):
+    """
+    Metrics of one thread, only ever written by that thread
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def merge(self, other):
+        for key, (buckets, total, count) in other.histograms.copy().items():
+            merged = self.histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+            merged[1] += total
+            merged[2] += count
+        for key, value in other.counters.copy().items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+_local = threading.local()
+# Store of every live thread, the metrics of finished threads are folded into `_retired`
+_stores = {}
+_retired = _Store()
+_stores_lock = threading.Lock()
+
+
+def _prune():
+    """
+    Fold the stores of finished threads into `_retired`, must hold `_stores_lock`
+    """
+    for thread in [thread for thread in _stores if not thread.is_alive()]:
+        _retired.merge(_stores.pop(thread))
+
+
+def _store():
+    store = getattr(_local, 'store', None)
+    if store is None:
+        store = _local.store = _Store()
+        with _stores_lock:
+            _prune()
+            _stores[threading.current_thread()] = store
+    return store
+
+
+def current_route():
+    """
+    Route name of the request handled by this thread
+    :return: Route name or 'background'
+    """
+    return getattr(_local, 'route', None) or 'background'
+
+
+def set_route(route):
+    _local.route = route
+
+
+def observe(name, labels, value):
+    """
+    Add a value to a histogram of this thread
+    :param name: Metric name
+    :param labels: Tuple of (label, value) pairs
+    :param value: Observed value (in seconds)
+    """
+    histograms = _store().histograms
+    key = (name, labels)
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+    histogram[0][bisect_left(BUCKETS, value)] += 1
+    histogram[1] += value
+    histogram[2] += 1
+
+
+def inc(name, labels, value=1):
+    """
+    Increment a counter of this thread
+    :param name: Metric name
+    :param labels: Tuple of (label, value) pairs
+    :param value: Increment
+    """
+    counters = _store().counters
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+@contextmanager
+def timer(section):
+    """
+    Time a section (hmac, qr, fcm, callback) of the current route
+    :param section: Section name
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(
+            'otter_section_duration_seconds',
+            (('route', current_route()), ('section', section)),
+            time.perf_counter() - start,
+        )
+
+
+def _merge():
+    """
+    Merge the metrics of every thread, `dict.copy()` is atomic so writers never block
+    """
+    merged = _Store()
+    with _stores_lock:
+        _prune()
+        merged.merge(_retired)
+        stores = list(_stores.values())
+    for store in stores:
+        merged.merge(store)
+    return merged.histograms, merged.counters
+
+
+def _labels(labels, extra=()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('"', '\\"')) for name, value in pairs) + '}'
+
+
+def render(gauges=()):
+    """
+    Prometheus text exposition of all metrics
+    :param gauges: Extra (name, labels, value) gauges
+    :return: Text
+    """
+    histograms, counters = _merge()
+    lines = []
+    for name, (metric_type, help_text) in sorted(HELP.items()):
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        if metric_type == 'histogram':
+            for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(BUCKETS + ('+Inf',), buckets):
+                    cumulative += bucket
+                    lines.append('{}_bucket{} {}'.format(name, _labels(labels, (('le', bound),)), cumulative))
+                lines.append('{}_sum{} {}'.format(name, _labels(labels), total))
+                lines.append('{}_count{} {}'.format(name, _labels(labels), count))
+        else:
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append('{}{} {}'.format(name, _labels(labels), value))
+
+    for name, labels, value in gauges:
+        lines.append('# TYPE {} gauge'.format(name))
+        lines.append('{}{} {}'.format(name, _labels(labels), value))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,58 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection
+from . import metrics
+
+
+class MetricsMiddleware(object):
+    """
+    Record latency, DB query count and DB time per route name.
+    Under ASGI only latency is recorded, DB queries run on other threads.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        start = time.perf_counter()
+        stats = [0, 0.0]
+
+        def db_wrapper(execute, sql, params, many, context):
+            query_start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats[0] += 1
+                stats[1] += time.perf_counter() - query_start
+
+        metrics.set_route(None)
+        try:
+            with connection.execute_wrapper(db_wrapper):
+                response = self.get_response(request)
+        finally:
+            match = getattr(request, 'resolver_match', None)
+            labels = (('route', match.url_name if match and match.url_name else 'unmatched'),)
+            metrics.observe('otter_request_duration_seconds', labels, time.perf_counter() - start)
+            metrics.inc('otter_db_queries_total', labels, stats[0])
+            metrics.inc('otter_db_query_seconds_total', labels, stats[1])
+            metrics.set_route(None)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics.set_route(request.resolver_match.url_name)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        try:
+            return await self.get_response(request)
+        finally:
+            match = getattr(request, 'resolver_match', None)
+            labels = (('route', match.url_name if match and match.url_name else 'unmatched'),)
+            metrics.observe('otter_request_duration_seconds', labels, time.perf_counter() - start)
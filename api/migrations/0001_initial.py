@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-17 19:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PyOTP',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, help_text='Non-editable, to be generated by system itself.', unique=True, verbose_name='OTP Unique uuid')),
+                ('secret', models.CharField(help_text='Secret used to generate OTP.', max_length=50, verbose_name='Secret')),
+                ('count', models.IntegerField(blank=True, help_text='OTP Count, to be used in case of HOTP.', null=True, verbose_name='Count')),
+                ('interval', models.IntegerField(blank=True, help_text='OTP Interval, to be used in case of TOTP.', null=True, verbose_name='Interval (in seconds)')),
+                ('name', models.CharField(blank=True, help_text='Account Name for Provisioning URI.', max_length=255, null=True, verbose_name='Account Name')),
+                ('initial_count', models.IntegerField(blank=True, help_text='Initial Count for Provisioning URI.', null=True, verbose_name='Initial Count')),
+                ('issuer_name', models.CharField(blank=True, help_text='Issuer Name for Provisioning URI.', max_length=255, null=True, verbose_name='Issuer Name')),
+                ('refer_code', models.CharField(blank=True, help_text='Refer Code for each request of FCM.', max_length=4, null=True, verbose_name='Refer Code')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Created at')),
+                ('user', models.ForeignKey(blank=True, help_text='User that use this secret.', null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'PyOTP',
+                'verbose_name_plural': 'PyOTP',
+            },
+        ),
+    ]
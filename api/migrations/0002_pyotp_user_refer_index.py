@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-17 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pyotp',
+            index=models.Index(fields=['user', 'refer_code', '-created_at'], name='api_pyotp_user_refer_idx'),
+        ),
+    ]
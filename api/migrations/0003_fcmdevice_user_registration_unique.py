@@ -0,0 +1,63 @@
+from django.db import migrations
+from django.db.models import Count, Max
+
+# Same name as `api.devices.DEVICE_UNIQUE_INDEX`, migrations never import runtime code
+INDEX_NAME = 'fcm_device_user_registration_uniq'
+COLUMNS = ('user_id', 'registration_id')
+
+
+def dedupe(apps, schema_editor):
+    """
+    Keep the newest FCMDevice of every (user, registration_id) pair, the unique index needs it
+    """
+    FCMDevice = apps.get_model('fcm_django', 'FCMDevice')
+    db_alias = schema_editor.connection.alias
+    duplicates = (
+        FCMDevice.objects.using(db_alias).filter(user__isnull=False)
+        .values('user_id', 'registration_id')
+        .annotate(keep=Max('id'), total=Count('id'))
+        .filter(total__gt=1)
+        .order_by()
+    )
+    for pair in list(duplicates):
+        FCMDevice.objects.using(db_alias).filter(
+            user_id=pair['user_id'], registration_id=pair['registration_id'],
+        ).exclude(id=pair['keep']).delete()
+
+
+def create_index(apps, schema_editor):
+    """
+    The index belongs to fcm_django's table, so it is created with the backend's own SQL
+    instead of an AddIndex/AddConstraint of another app's model state
+    """
+    FCMDevice = apps.get_model('fcm_django', 'FCMDevice')
+    quote_name = schema_editor.quote_name
+    schema_editor.execute(schema_editor.sql_create_unique_index % {
+        'name': quote_name(INDEX_NAME),
+        'table': quote_name(FCMDevice._meta.db_table),
+        'columns': ', '.join(quote_name(column) for column in COLUMNS),
+        'include': '',
+        'condition': '',
+    })
+
+
+def drop_index(apps, schema_editor):
+    FCMDevice = apps.get_model('fcm_django', 'FCMDevice')
+    quote_name = schema_editor.quote_name
+    schema_editor.execute(schema_editor.sql_delete_index % {
+        'name': quote_name(INDEX_NAME),
+        'table': quote_name(FCMDevice._meta.db_table),
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_pyotp_user_refer_index'),
+        ('fcm_django', '0005_auto_20170808_1145'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe, migrations.RunPython.noop),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-17 19:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_fcmdevice_user_registration_unique'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pyotp',
+            index=models.Index(fields=['issuer_name', 'id'], name='api_pyotp_issuer_id_idx'),
+        ),
+    ]
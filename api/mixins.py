@@ -1,9 +1,41 @@
+import time
 import pyotp
-import qrcode
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import F
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from fcm_django.models import FCMDevice
+from .cache import get_cache
+from .engine import get_engine
+from .entropy import random_base32
 from .models import PyOTP
+from .replay import get_replay_guard, step_ttl
+from .utils import chunked
+
+
+class _Locked(Exception):
+    pass
+
+
+def _retry_locked(query):
+    """
+    Run a query, retrying with exponential backoff while SQLite reports a locked table
+    :param query: Callable running the query
+    :return: Result of `query`
+    :raise _Locked: Still locked after OTP_HOTP_LOCK_RETRIES retries
+    """
+    retries = getattr(settings, 'OTP_HOTP_LOCK_RETRIES', 5)
+    backoff = getattr(settings, 'OTP_HOTP_LOCK_BACKOFF', 0.005)
+    for retry in range(retries + 1):
+        try:
+            return query()
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+        if retry < retries:
+            time.sleep(backoff * 2 ** retry)
+    raise _Locked()
 
 
 class OTPMixin(object):
@@ -17,16 +49,16 @@ class OTPMixin(object):
         Generate Random Base32 String
         :return: Random Base32 String
         """
-        return pyotp.random_base32()
+        return random_base32()
 
-    def _insert_into_db(self, user=None, secret=None, count=None, interval=None, data={}):
+    def _get_fields(self, user=None, secret=None, count=None, interval=None, data={}):
         """
-        Insert new PyOTP object into DB
+        Build PyOTP model fields
         :param secret: OTP secret
         :param count: HOTP count
         :param interval: TOTP interval
         :param data: Provisioning URI data
-        :return: PyOTP model object
+        :return: PyOTP fields dict
         """
         fields = {
             'secret': secret,
@@ -39,8 +71,30 @@ class OTPMixin(object):
         if self.provision_uri is True:
             fields.update(**data)
 
+        return fields
+
+    def _insert_into_db(self, user=None, secret=None, count=None, interval=None, data={}):
+        """
+        Insert new PyOTP object into DB
+        :param secret: OTP secret
+        :param count: HOTP count
+        :param interval: TOTP interval
+        :param data: Provisioning URI data
+        :return: PyOTP model object
+        """
+        fields = self._get_fields(user=user, secret=secret, count=count, interval=interval, data=data)
         return PyOTP.objects.create(**fields)
 
+    def _bulk_insert_into_db(self, instances):
+        """
+        Insert many unsaved PyOTP objects into DB in one transaction
+        :param instances: Unsaved PyOTP model objects
+        :return: Saved PyOTP model objects
+        """
+        batch_size = getattr(settings, 'OTP_BULK_BATCH_SIZE', 500)
+        with transaction.atomic():
+            return PyOTP.objects.bulk_create(instances, batch_size=batch_size)
+
     def _create_response(self, otp, instance, otp_type_obj, data):
         """
         Create Response
@@ -55,14 +109,12 @@ class OTPMixin(object):
             'otp': otp,
         }
 
-        # Generate provision URI if setting is True
+        # Generate provision URI if setting is True, the view renders it as QR code
         if self.provision_uri is True:
-            provisioning_uri = otp_type_obj.provisioning_uri(**data)
             response = {
                 'otp_uuid': str(instance.uuid),
-                # 'provisioning_uri': provisioning_uri,
+                'provisioning_uri': otp_type_obj.provisioning_uri(**data),
             }
-            return qrcode.make(provisioning_uri)
 
         return response
 
@@ -100,6 +152,134 @@ class OTPMixin(object):
         obj = self._insert_into_db(secret=base32string, interval=interval, data=data)
         return self._create_response(otp, obj, totp, data)
 
+    def _generate_hotp_bulk(self, counts):
+        """
+        Generates many counter-based OTPs with a single bulk insert
+        :param counts: HOTP counts
+        :return: List of HOTP JSON Responses
+        """
+        self.provision_uri = False
+        instances, otps = [], []
+        for count in counts:
+            base32string = self._get_random_base32_string()
+            otps.append(pyotp.HOTP(base32string).at(count))
+            instances.append(PyOTP(**self._get_fields(secret=base32string, count=count)))
+
+        # Save data into DB
+        self._bulk_insert_into_db(instances)
+        return [self._create_response(otp, obj, None, {}) for otp, obj in zip(otps, instances)]
+
+    def _generate_totp_bulk(self, intervals):
+        """
+        Generates many time-based OTPs with a single bulk insert
+        :param intervals: TOTP intervals
+        :return: List of TOTP JSON Responses
+        """
+        self.provision_uri = False
+        instances, otps = [], []
+        for interval in intervals:
+            base32string = self._get_random_base32_string()
+            otps.append(pyotp.TOTP(base32string, interval=interval).now())
+            instances.append(PyOTP(**self._get_fields(secret=base32string, interval=interval)))
+
+        # Save data into DB
+        self._bulk_insert_into_db(instances)
+        return [self._create_response(otp, obj, None, {}) for otp, obj in zip(otps, instances)]
+
+    def _verify_otp(self, otp, obj, otp_type):
+        """
+        Verify OTP with provided corresponding type (HOTP/TOTP).
+        :param otp: OTP to verify against
+        :param obj: PyOTP model object
+        :param otp_type: HOTP/TOTP
+        :return: Verification result boolean (Accept/Reject)
+        """
+        engine = get_engine()
+        if otp_type == 'hotp' and obj.count is not None:
+            return self._advance_hotp(otp, obj)
+        elif otp_type == 'totp' and obj.interval:
+            valid_window = getattr(settings, 'OTP_TOTP_VALID_WINDOW', 0)
+            step = engine.totp_match(otp, obj.secret, obj.interval, valid_window=valid_window)
+            if step is None:
+                return False
+            # Every time step is accepted only once
+            ttl = step_ttl(step, obj.interval, valid_window)
+            return get_replay_guard().check_and_record(obj.uuid, step, ttl)
+        return False
+
+    def _advance_hotp(self, otp, obj, attempts=3):
+        """
+        Verify a HOTP within the look-ahead window and move the counter past the matching value.
+        The counter only moves with a conditional `UPDATE ... WHERE count = old`, so concurrent
+        verifiers never lock each other out and an OTP is never accepted twice.
+        :param otp: OTP to verify
+        :param obj: PyOTP model object
+        :param attempts: Retries when another verifier moved the counter first
+        :return: Verification result boolean (Accept/Reject), False when SQLite kept the table locked
+        """
+        engine = get_engine()
+        look_ahead = getattr(settings, 'OTP_HOTP_LOOK_AHEAD', 10)
+        count = obj.count
+        try:
+            for _ in range(attempts):
+                matched = engine.hotp_match(otp, obj.secret, count, look_ahead)
+                if matched is None:
+                    return False
+
+                updated = _retry_locked(lambda: PyOTP.objects.filter(pk=obj.pk, count=count).update(
+                    count=F('count') + (matched - count + 1),
+                ))
+                get_cache().invalidate(obj.uuid)
+                if updated:
+                    obj.count = matched + 1
+                    return True
+
+                # Another verifier moved the counter first, retry from the stored value
+                count = _retry_locked(lambda: PyOTP.objects.filter(pk=obj.pk).values_list('count', flat=True).first())
+                if count is None:
+                    return False
+        except _Locked:
+            # SQLite kept the table locked, the counter did not move: a failed verification, not a 500
+            return False
+        return False
+
+    def _find_pyotp_bulk(self, uuids):
+        """
+        Load many PyOTP objects, with one cache lookup and `uuid__in` queries for the misses
+        :param uuids: PyOTP UUIDs
+        :return: Dict of UUID string to PyOTP model object
+        """
+        batch_size = getattr(settings, 'OTP_BULK_BATCH_SIZE', 500)
+        cache = get_cache()
+        uuids = {str(uuid) for uuid in uuids}
+        objs = cache.get_many(uuids)
+        missing = [uuid for uuid in uuids if uuid not in objs]
+
+        for chunk in chunked(missing, batch_size):
+            loaded = {str(obj.uuid): obj for obj in PyOTP.objects.filter(uuid__in=chunk)}
+            objs.update(loaded)
+            cache.set_many(loaded)
+        return objs
+
+    def _verify_otp_bulk(self, items):
+        """
+        Verify many (uuid, type, otp) items against their PyOTP objects
+        :param items: List of dicts with `uuid`, `otp_type` and `otp`
+        :return: List of verification results
+        """
+        objs = self._find_pyotp_bulk(str(item['uuid']) for item in items)
+        results = []
+        for item in items:
+            uuid = str(item['uuid'])
+            obj = objs.get(uuid)
+            result = {'uuid': uuid, 'valid': False}
+            if obj is None:
+                result['error'] = 'Not found.'
+            else:
+                result['valid'] = self._verify_otp(item['otp'], obj, item['otp_type'])
+            results.append(result)
+        return results
+
 
 class FCMMixin(object):
     """
@@ -107,53 +287,80 @@ class FCMMixin(object):
     """
     def _update_user_pyotp(self, username, uuid):
         """
-
-        :param user:
-        :param uuid:
-        :return:
+        Bind the PyOTP object to a User with a single UPDATE
+        :param username: Username
+        :param uuid: PyOTP UUID
+        :return: Number of updated rows
         """
-        user = PyOTP.objects.get(uuid=uuid)
-        user.user = get_object_or_404(User, username=username)
-        return user.save()
+        user = get_object_or_404(User, username=username)
+        updated = PyOTP.objects.filter(uuid=uuid).update(user=user)
+        if not updated:
+            raise Http404
+        get_cache().invalidate(uuid)
+        return updated
 
     def _update_user_fcm(self, username, registration_id):
         """
-
-        :param username:
-        :return:
+        Upsert the User's FCM device on the unique (user, registration_id) index,
+        a known device is reactivated instead of inserted again
+        :param username: Username
+        :param registration_id: FCM registration token
+        :return: True if this call inserted the device
         """
+        from fcm_django.models import FCMDevice
+
         user = get_object_or_404(User, username=username)
-        device = FCMDevice(registration_id=registration_id, user=user)
-        return device.save()
+        devices = FCMDevice.objects.filter(user=user, registration_id=registration_id)
+        if devices.update(active=True):
+            return False
+        try:
+            with transaction.atomic():
+                FCMDevice.objects.create(registration_id=registration_id, user=user)
+        except IntegrityError:
+            # Registered by a concurrent request between the UPDATE and the INSERT
+            devices.update(active=True)
+            return False
+        return True
 
     def _find_user_device(self, uuid):
         """
-        Find the User's FCM device
+        Find the User's latest active FCM device, joined through the PyOTP object
         :param uuid: UUID
-        :return: FCMDevice of that User
+        :return: FCMDevice of that User, None if there is none
         """
-        user = PyOTP.objects.get(uuid=uuid)
-        device = FCMDevice.objects.get(user=user.user)
-        return device
+        from fcm_django.models import FCMDevice
+
+        return FCMDevice.objects.filter(user__pyotp__uuid=uuid, active=True).order_by('-id').first()
 
     def _update_code(self, refer, uuid):
         """
+        Store the refer code with a single UPDATE
+        :param refer: Refer code
+        :param uuid: PyOTP UUID
+        :return: Number of updated rows
+        """
+        updated = PyOTP.objects.filter(uuid=uuid).update(refer_code=refer)
+        get_cache().invalidate(uuid)
+        return updated
 
-        :param refer:
-        :param uuid:
-        :return:
+    def _consume_code(self, refer, uuid):
         """
-        user = PyOTP.objects.get(uuid=uuid)
-        user.refer_code = refer
-        user.save()
+        Clear the refer code with a single conditional UPDATE, so it answers one challenge only
+        :param refer: Refer code
+        :param uuid: PyOTP UUID
+        :return: True, False when the refer code was already used
+        """
+        updated = PyOTP.objects.filter(uuid=uuid, refer_code=refer).update(refer_code=None)
+        get_cache().invalidate(uuid)
+        return updated > 0
 
     def _verify_message(self, username, refer):
         """
-
-        :param username:
-        :param refer:
-        :return:
+        Check the refer code of a User with a single indexed query
+        :param username: Username
+        :param refer: Refer code
+        :return: UUID of the PyOTP the refer code was sent for, None if it does not match
         """
-        user = get_object_or_404(User, username=username)
-        user = PyOTP.objects.get(user=user)
-        return refer == user.refer_code
+        return PyOTP.objects.filter(
+            user__username=username, refer_code=refer,
+        ).order_by('-created_at').values_list('uuid', flat=True).first()
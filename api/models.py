@@ -74,6 +74,12 @@ class PyOTP(models.Model):
     class Meta:
         verbose_name = _("PyOTP")
         verbose_name_plural = _("PyOTP")
+        indexes = [
+            # Push approval lookup: user + refer code, newest first
+            models.Index(fields=['user', 'refer_code', '-created_at'], name='api_pyotp_user_refer_idx'),
+            # Audit export by issuer, walked in id order
+            models.Index(fields=['issuer_name', 'id'], name='api_pyotp_issuer_id_idx'),
+        ]
 
     def __str__(self):
         return str(self.uuid)
@@ -0,0 +1,119 @@
+import logging
+import threading
+from collections import deque, namedtuple
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .dispatch import BackgroundDispatcher
+from .metrics import timer
+
+logger = logging.getLogger(__name__)
+
+PushMessage = namedtuple('PushMessage', ('registration_ids', 'title', 'body', 'click_action', 'data'))
+PushResult = namedtuple('PushResult', ('registration_id', 'success', 'error'))
+
+
+class FCMTransport(object):
+    """
+    Send pushes through Firebase with fcm_django, many devices in one multicast request
+    """
+    max_multicast = 1000
+    inactive_errors = ('NotRegistered', 'InvalidRegistration')
+
+    def send(self, registration_ids, title, body, click_action, data):
+        """
+        Send one message to many devices
+        :return: List of PushResult
+        """
+        from fcm_django.fcm import fcm_send_bulk_message
+        from fcm_django.models import FCMDevice
+
+        results = []
+        for start in range(0, len(registration_ids), self.max_multicast):
+            chunk = registration_ids[start:start + self.max_multicast]
+            response = fcm_send_bulk_message(
+                registration_ids=chunk, title=title, body=body, click_action=click_action, data=data,
+            )
+            for registration_id, result in zip(chunk, response.get('results', [])):
+                error = result.get('error')
+                results.append(PushResult(registration_id, error is None, error))
+
+        inactive = [result.registration_id for result in results if result.error in self.inactive_errors]
+        if inactive:
+            FCMDevice.objects.filter(registration_id__in=inactive).update(active=False)
+        return results
+
+
+class LocalTransport(object):
+    """
+    Fake transport for tests and benchmarks, keeps every sent message in memory
+    """
+    def __init__(self):
+        self.sent = []
+
+    def send(self, registration_ids, title, body, click_action, data):
+        self.sent.append(PushMessage(tuple(registration_ids), title, body, click_action, data))
+        return [PushResult(registration_id, True, None) for registration_id in registration_ids]
+
+
+class PushDispatcher(BackgroundDispatcher):
+    """
+    Queue of push messages, drained in batches by background workers.
+    Every message is one transport call: multicast only covers the devices of a message,
+    since each push carries its own refer code and FCM cannot vary the payload per device.
+    """
+    name = 'push'
+
+    def __init__(self, transport, results_size=1000, **kwargs):
+        """
+        :param transport: Object with `send(registration_ids, title, body, click_action, data)`
+        :param results_size: Number of delivery results kept
+        """
+        super().__init__(**kwargs)
+        self.transport = transport
+        self.results = deque(maxlen=results_size)
+        self.sent = 0
+        self.failed = 0
+        self._results_lock = threading.Lock()
+
+    def handle(self, batch):
+        for message in batch:
+            try:
+                with timer('fcm'):
+                    results = self.transport.send(
+                        list(message.registration_ids), message.title, message.body, message.click_action, message.data,
+                    )
+            except Exception as e:
+                logger.exception('Push delivery failed')
+                results = [PushResult(registration_id, False, str(e)) for registration_id in message.registration_ids]
+            self._record(results)
+
+    def _record(self, results):
+        failed = sum(1 for result in results if not result.success)
+        with self._results_lock:
+            self.results.extend(results)
+            self.sent += len(results) - failed
+            self.failed += failed
+        for result in results:
+            if not result.success:
+                logger.warning('Push to %s failed: %s', result.registration_id, result.error)
+
+
+_dispatcher = None
+
+
+def get_push_dispatcher():
+    """
+    Per-process push dispatcher
+    :return: PushDispatcher
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        transport = import_string(getattr(settings, 'FCM_PUSH_TRANSPORT', 'api.push.FCMTransport'))
+        _dispatcher = PushDispatcher(
+            transport(),
+            results_size=getattr(settings, 'FCM_PUSH_RESULTS_SIZE', 1000),
+            workers=getattr(settings, 'FCM_PUSH_WORKERS', 2),
+            queue_size=getattr(settings, 'FCM_PUSH_QUEUE_SIZE', 10000),
+            batch_size=getattr(settings, 'FCM_PUSH_BATCH_SIZE', 500),
+        )
+    return _dispatcher
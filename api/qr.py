@@ -0,0 +1,111 @@
+import io
+import threading
+from concurrent.futures import TimeoutError
+from django.conf import settings
+from rest_framework import exceptions, status
+from .metrics import timer
+
+QR_FORMATS = ('png', 'svg')
+
+
+class QRRenderUnavailable(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'QR code rendering is busy, try again later.'
+    default_code = 'qr_render_unavailable'
+
+
+def render(provisioning_uri, fmt):
+    """
+    Encode a provisioning URI into QR image bytes, runs inside the render pool
+    :param provisioning_uri: Provisioning URI
+    :param fmt: png/svg
+    :return: Image bytes
+    """
+    import qrcode
+
+    if fmt == 'svg':
+        import qrcode.image.svg
+        image = qrcode.make(provisioning_uri, image_factory=qrcode.image.svg.SvgPathImage)
+    else:
+        image = qrcode.make(provisioning_uri)
+    buffer = io.BytesIO()
+    image.save(buffer)
+    return buffer.getvalue()
+
+
+class QRRenderer(object):
+    """
+    Render QR codes off the request thread, in a bounded process pool.
+    Images carry the OTP secret and every provisioning URI is new, so nothing is cached.
+    """
+    def __init__(self, workers=2, max_pending=16, timeout=10):
+        """
+        :param workers: Number of render processes, 0 renders inline
+        :param max_pending: Maximum renders submitted to the pool at once
+        :param timeout: Maximum time to wait for a pool slot, then for the render (in seconds)
+        """
+        self.workers = workers
+        self.timeout = timeout
+        self._pool = None
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def _render(self, provisioning_uri, fmt):
+        if not self.workers:
+            return render(provisioning_uri, fmt)
+        if not self._pending.acquire(timeout=self.timeout):
+            raise QRRenderUnavailable()
+        try:
+            future = self._get_pool().submit(render, provisioning_uri, fmt)
+            try:
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                future.cancel()
+                raise QRRenderUnavailable()
+        finally:
+            self._pending.release()
+
+    def render(self, provisioning_uri, fmt='png'):
+        """
+        Get QR image bytes of a provisioning URI
+        :param provisioning_uri: Provisioning URI
+        :param fmt: png/svg
+        :return: Image bytes
+        :raise QRRenderUnavailable: The pool did not render in time
+        """
+        if fmt not in QR_FORMATS:
+            raise ValueError('Unsupported QR format: {}'.format(fmt))
+
+        with timer('qr'):
+            return self._render(provisioning_uri, fmt)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+
+_renderer = None
+
+
+def get_renderer():
+    """
+    Per-process QR renderer
+    :return: QRRenderer
+    """
+    global _renderer
+    if _renderer is None:
+        _renderer = QRRenderer(
+            workers=getattr(settings, 'QR_RENDER_WORKERS', 2),
+            max_pending=getattr(settings, 'QR_RENDER_MAX_PENDING', 16),
+            timeout=getattr(settings, 'QR_RENDER_TIMEOUT', 10),
+        )
+    return _renderer
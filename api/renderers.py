@@ -0,0 +1,22 @@
+from rest_framework import renderers
+
+
+class QRCodeRenderer(renderers.BaseRenderer):
+    """
+    Pass-through renderer of already encoded QR image bytes
+    """
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+
+class PNGRenderer(QRCodeRenderer):
+    media_type = 'image/png'
+    format = 'png'
+
+
+class SVGRenderer(QRCodeRenderer):
+    media_type = 'image/svg+xml'
+    format = 'svg'
@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class LocalReplayGuard(object):
+    """
+    Per-process store of used (uuid, time step) pairs.
+    Checks are O(1), entries expire once their time step leaves the drift window,
+    and the oldest entries are dropped past `max_size`.
+    """
+    def __init__(self, max_size=100000):
+        """
+        :param max_size: Maximum number of remembered pairs
+        """
+        self.max_size = max_size
+        self._expiries = {}
+        self._order = deque()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(max_size=getattr(settings, 'OTP_REPLAY_GUARD_MAX_SIZE', 100000))
+
+    def _evict(self, now):
+        while self._order:
+            expiry, key = self._order[0]
+            if expiry > now and len(self._expiries) <= self.max_size:
+                break
+            self._order.popleft()
+            if self._expiries.get(key) == expiry:
+                del self._expiries[key]
+
+    def check_and_record(self, uuid, step, ttl):
+        """
+        Record a used time step
+        :param uuid: PyOTP UUID
+        :param step: TOTP time step
+        :param ttl: Time to remember the pair (in seconds)
+        :return: True on first use, False on replay
+        """
+        key = (str(uuid), step)
+        now = time.time()
+        with self._lock:
+            expiry = self._expiries.get(key)
+            if expiry is not None and expiry > now:
+                return False
+            expiry = now + ttl
+            self._expiries[key] = expiry
+            self._order.append((expiry, key))
+            self._evict(now)
+        return True
+
+    def __len__(self):
+        return len(self._expiries)
+
+
+class CacheReplayGuard(object):
+    """
+    Replay store shared by every worker through Django's cache framework.
+    Relies on the atomic `cache.add`.
+    """
+    key_prefix = 'otp-replay'
+
+    def __init__(self, cache_alias='default'):
+        """
+        :param cache_alias: Django cache alias
+        """
+        self.cache_alias = cache_alias
+
+    @classmethod
+    def from_settings(cls):
+        return cls(cache_alias=getattr(settings, 'OTP_REPLAY_CACHE', 'default'))
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+        return caches[self.cache_alias]
+
+    def check_and_record(self, uuid, step, ttl):
+        key = '{}:{}:{}'.format(self.key_prefix, uuid, step)
+        return self.cache.add(key, 1, timeout=max(1, int(ttl) + 1))
+
+
+def step_ttl(step, interval, valid_window=0):
+    """
+    Time left until a TOTP time step can no longer be accepted
+    :param step: TOTP time step
+    :param interval: TOTP interval
+    :param valid_window: Accepted time steps before and after the current one
+    :return: Seconds
+    """
+    return max(1, (step + valid_window + 1) * interval - time.time())
+
+
+_guard = None
+
+
+def get_replay_guard():
+    """
+    Per-process replay guard
+    :return: LocalReplayGuard/CacheReplayGuard
+    """
+    global _guard
+    if _guard is None:
+        _guard = import_string(getattr(settings, 'OTP_REPLAY_GUARD', 'api.replay.LocalReplayGuard')).from_settings()
+    return _guard
@@ -0,0 +1,95 @@
+import time
+from collections import namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import PyOTP
+
+PurgeReport = namedtuple('PurgeReport', ('otp_type', 'purged', 'chunks', 'seconds'))
+
+OTP_TYPE_FILTERS = {
+    'totp': Q(interval__isnull=False),
+    'hotp': Q(interval__isnull=True, count__isnull=False),
+}
+
+
+def expired_queryset(otp_type, max_age, now=None, keep_enrolled=True):
+    """
+    PyOTP objects of one type older than the retention period
+    :param otp_type: HOTP/TOTP
+    :param max_age: Retention period (in seconds)
+    :param now: Reference time (defaults to now)
+    :param keep_enrolled: Keep objects bound to a User or provisioned to an authenticator
+    :return: QuerySet ordered by (created_at, id)
+    """
+    now = now or timezone.now()
+    queryset = PyOTP.objects.filter(OTP_TYPE_FILTERS[otp_type], created_at__lt=now - timedelta(seconds=max_age))
+    if keep_enrolled:
+        queryset = queryset.filter(user__isnull=True, name__isnull=True)
+    return queryset.order_by('created_at', 'id')
+
+
+def purge_type(otp_type, max_age, chunk_size=1000, now=None, keep_enrolled=True, pause=0):
+    """
+    Delete expired PyOTP objects of one type in bounded chunks.
+    Every chunk is its own short transaction, the scan continues from the last (created_at, id) seen.
+    :param otp_type: HOTP/TOTP
+    :param max_age: Retention period (in seconds)
+    :param chunk_size: Maximum rows deleted per transaction
+    :param now: Reference time (defaults to now)
+    :param keep_enrolled: Keep objects bound to a User or provisioned to an authenticator
+    :param pause: Sleep between chunks to let other writers in (in seconds)
+    :return: PurgeReport
+    """
+    start = time.monotonic()
+    queryset = expired_queryset(otp_type, max_age, now, keep_enrolled)
+    purged = chunks = 0
+    last = None
+    while True:
+        chunk_queryset = queryset
+        if last is not None:
+            chunk_queryset = queryset.filter(
+                Q(created_at__gt=last[0]) | Q(created_at=last[0], id__gt=last[1])
+            )
+        rows = list(chunk_queryset.values_list('created_at', 'id')[:chunk_size])
+        if not rows:
+            break
+
+        # A regular delete, so post_delete invalidates the PyOTP cache in every worker.
+        # The filters are checked again: a row enrolled since the scan is kept
+        with transaction.atomic():
+            deleted, _ = queryset.filter(id__in=[row[1] for row in rows]).delete()
+        purged += deleted
+        chunks += 1
+        last = rows[-1]
+        if len(rows) < chunk_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    return PurgeReport(otp_type, purged, chunks, time.monotonic() - start)
+
+
+def purge_expired(policy=None, chunk_size=None, now=None, pause=0):
+    """
+    Retention job, purge every OTP type of the policy. Safe to schedule from cron or any task runner.
+    :param policy: Dict of OTP type to retention period in seconds, None keeps that type forever
+    :param chunk_size: Maximum rows deleted per transaction
+    :param now: Reference time (defaults to now)
+    :param pause: Sleep between chunks (in seconds)
+    :return: List of PurgeReport
+    """
+    if policy is None:
+        policy = getattr(settings, 'OTP_RETENTION', {})
+    if chunk_size is None:
+        chunk_size = getattr(settings, 'OTP_RETENTION_CHUNK_SIZE', 1000)
+    keep_enrolled = getattr(settings, 'OTP_RETENTION_KEEP_ENROLLED', True)
+    now = now or timezone.now()
+
+    return [
+        purge_type(otp_type, max_age, chunk_size, now, keep_enrolled, pause)
+        for otp_type, max_age in policy.items()
+        if max_age is not None
+    ]
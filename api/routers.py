@@ -3,26 +3,39 @@ from . import views
 
 UUID_REGEX = '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
 OTP_TYPE_REGEX = '(hotp|totp)'
+REFER_REGEX = '[A-Z2-7]+'
 
 verify_otp = views.PyOTPViewset.as_view({'post': 'verify_otp', })
+verify_otp_bulk = views.PyOTPViewset.as_view({'post': 'verify_otp_bulk', })
 generate_hotp = views.PyOTPViewset.as_view({'post': 'generate_hotp', })
 generate_totp = views.PyOTPViewset.as_view({'post': 'generate_totp', })
 generate_hotp_provision_uri = views.PyOTPViewset.as_view({'post': 'generate_hotp_provision_uri', })
 generate_totp_provision_uri = views.PyOTPViewset.as_view({'post': 'generate_totp_provision_uri', })
+generate_hotp_bulk = views.PyOTPViewset.as_view({'post': 'generate_hotp_bulk', })
+generate_totp_bulk = views.PyOTPViewset.as_view({'post': 'generate_totp_bulk', })
 register_push = views.FCMViewset.as_view({'post': 'register_push', })
 send_push = views.FCMViewset.as_view({'post': 'send_push', })
 verify_push = views.FCMViewset.as_view({'post': 'verify_push', })
 mobile_push = views.FCMViewset.as_view({'post': 'mobile_push', })
+push_status = views.FCMViewset.as_view({'get': 'push_status', })
+export_otps = views.ExportViewset.as_view({'get': 'export_otps', })
 
 urlpatterns = [
     path('generate-otp/hotp/', generate_hotp, name='generate-hotp'),
     path('generate-otp/totp/', generate_totp, name='generate-totp'),
     path('generate-otp/hotp/provision-uri/', generate_hotp_provision_uri, name='generate-hotp-provision-uri'),
     path('generate-otp/totp/provision-uri/', generate_totp_provision_uri, name='generate-totp-provision-uri'),
+    path('generate-otp/hotp/bulk/', generate_hotp_bulk, name='generate-hotp-bulk'),
+    path('generate-otp/totp/bulk/', generate_totp_bulk, name='generate-totp-bulk'),
+    path('verify-otp/bulk/', verify_otp_bulk, name='verify-otp-bulk'),
     re_path(r'^verify-otp/(?P<otp_type>(hotp|totp))/(?P<uuid>{uuid})/$'
             .format(otp_type=OTP_TYPE_REGEX, uuid=UUID_REGEX), verify_otp, name='verify-otp'),
     re_path(r'^register-push/(?P<uuid>{uuid})/$'.format(uuid=UUID_REGEX), register_push, name='register-push'),
     re_path(r'^send-push/(?P<uuid>{uuid})/$'.format(uuid=UUID_REGEX), send_push, name='send-push'),
     path('verify-push/', verify_push, name='verify-push'),
     path('mobile-push/', mobile_push, name='mobile-push'),
+    re_path(r'^push-status/(?P<uuid>{uuid})/(?P<refer>{refer})/$'.format(uuid=UUID_REGEX, refer=REFER_REGEX),
+            push_status, name='push-status'),
+    path('export/pyotp/', export_otps, name='export-otps'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
@@ -1,6 +1,13 @@
-import pyotp
+from collections.abc import Mapping
+from django.conf import settings
 from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.settings import api_settings
 from . import mixins
+from .challenges import get_challenge_store
+from .entropy import random_base32
+from .export import EXPORT_FORMATS, export_queryset, iter_records, render
+from .push import PushMessage, get_push_dispatcher
 
 
 class NoneSerializer(serializers.Serializer):
@@ -11,7 +18,7 @@ class HOTPSerializer(mixins.OTPMixin, serializers.Serializer):
     """
     HOTP Serializer
     """
-    count = serializers.IntegerField(required=True, help_text="OTP Counter.")
+    count = serializers.IntegerField(required=True, min_value=0, help_text="OTP Counter.")
 
     def create(self, validated_data):
         """
@@ -27,7 +34,7 @@ class TOTPSerializer(mixins.OTPMixin, serializers.Serializer):
     """
     TOTP Serializer
     """
-    timeout = serializers.IntegerField(required=True, help_text="OTP Validity-Time (in seconds).")
+    timeout = serializers.IntegerField(required=True, min_value=1, help_text="OTP Validity-Time (in seconds).")
 
     def create(self, validated_data):
         """
@@ -77,12 +84,103 @@ class TOTPProvisionURISerializer(TOTPSerializer, ProvisionURISerializer):
         return self._generate_totp(interval, provision_uri=True, data=validated_data)
 
 
-class VerifyOTPSerializer(serializers.Serializer):
+class BulkOTPSerializer(serializers.Serializer):
+    """
+    Base Serializer for batch OTP generation.
+    Every item is validated by `child_serializer`, invalid items are reported without failing the batch.
+    Subclasses set `child_serializer` and implement `_generate_items(specs)`, returning one OTP Response per spec.
+    """
+    child_serializer = None
+    items = serializers.ListField(child=serializers.DictField(), help_text="List of OTP specs.")
+
+    def validate_items(self, value):
+        """
+        Validate batch size
+        :param value: List of OTP specs
+        :return: List of OTP specs
+        """
+        max_items = getattr(settings, 'OTP_BULK_MAX_ITEMS', 10000)
+        if not value:
+            raise serializers.ValidationError("This list may not be empty.")
+        if len(value) > max_items:
+            raise serializers.ValidationError("Ensure this list has no more than {} items.".format(max_items))
+        return value
+
+    def create(self, validated_data):
+        """
+        Create batch PyOTP JSON Response
+        :param validated_data: Valid data
+        :return: Generated OTPs and per-item errors
+        """
+        indexes, specs, errors = [], [], []
+        for index, item in enumerate(validated_data['items']):
+            child = self.child_serializer(data=item)
+            if child.is_valid():
+                indexes.append(index)
+                specs.append(child.validated_data)
+            else:
+                errors.append({'index': index, 'errors': child.errors})
+
+        results = self._generate_items(specs) if specs else []
+        for index, result in zip(indexes, results):
+            result['index'] = index
+
+        return {
+            'results': results,
+            'errors': errors,
+        }
+
+
+class BulkHOTPSerializer(mixins.OTPMixin, BulkOTPSerializer):
+    """
+    Batch HOTP Serializer
+    """
+    child_serializer = HOTPSerializer
+
+    def _generate_items(self, specs):
+        return self._generate_hotp_bulk([spec['count'] for spec in specs])
+
+
+class BulkTOTPSerializer(mixins.OTPMixin, BulkOTPSerializer):
+    """
+    Batch TOTP Serializer
+    """
+    child_serializer = TOTPSerializer
+
+    def _generate_items(self, specs):
+        return self._generate_totp_bulk([spec['timeout'] for spec in specs])
+
+
+class VerifyOTPSerializer(mixins.OTPMixin, serializers.Serializer):
     """
     OTP Verification Serializer
     """
     otp = serializers.CharField(required=True)
 
+    _otp_field = None
+
+    @classmethod
+    def parse_otp(cls, data):
+        """
+        Validate the payload with the bound `otp` field only, skipping full serializer validation and
+        re-serialization. Errors are identical to `is_valid(raise_exception=True)`.
+        :param data: Request data
+        :return: OTP string
+        """
+        if not isinstance(data, Mapping):
+            message = cls.default_error_messages['invalid'].format(datatype=type(data).__name__)
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [ErrorDetail(message, code='invalid')],
+            })
+
+        field = cls._otp_field
+        if field is None:
+            field = cls._otp_field = cls().fields['otp']
+        try:
+            return field.run_validation(field.get_value(data))
+        except serializers.ValidationError as exc:
+            raise serializers.ValidationError({'otp': exc.detail})
+
     def verify_otp(self, otp, obj, otp_type):
         """
         Verify OTP with provided corresponding type (HOTP/TOTP).
@@ -91,13 +189,88 @@ class VerifyOTPSerializer(serializers.Serializer):
         :param otp_type: HOTP/TOTP
         :return: Verification result boolean (Accept/Reject)
         """
-        if otp_type == 'hotp' and obj.count:
-            hotp = pyotp.HOTP(obj.secret)
-            return hotp.verify(otp, obj.count)
-        elif otp_type == 'totp' and obj.interval:
-            totp = pyotp.TOTP(obj.secret, interval=obj.interval)
-            return totp.verify(otp)
-        return False
+        return self._verify_otp(otp, obj, otp_type)
+
+
+class VerifyOTPItemSerializer(serializers.Serializer):
+    """
+    Single item of batch OTP Verification
+    """
+    uuid = serializers.UUIDField(required=True, help_text="PyOTP instance UUID.")
+    otp_type = serializers.ChoiceField(choices=('hotp', 'totp'), required=True, help_text="HOTP/TOTP")
+    otp = serializers.CharField(required=True)
+
+    _item_fields = None
+
+    @classmethod
+    def parse_item(cls, data):
+        """
+        Validate an item with the bound fields only, like `VerifyOTPSerializer.parse_otp`, instead of
+        building a serializer per item. Errors are identical to `is_valid()`.
+        :param data: Item dict
+        :return: (validated data, errors), one of them None
+        """
+        fields = cls._item_fields
+        if fields is None:
+            fields = cls._item_fields = tuple(cls().fields.values())
+        validated, errors = {}, {}
+        for field in fields:
+            try:
+                validated[field.field_name] = field.run_validation(field.get_value(data))
+            except serializers.ValidationError as exc:
+                errors[field.field_name] = exc.detail
+        if errors:
+            return None, errors
+        return validated, None
+
+
+class BulkVerifyOTPSerializer(mixins.OTPMixin, serializers.Serializer):
+    """
+    Batch OTP Verification Serializer
+    """
+    items = serializers.ListField(child=serializers.DictField(), help_text="List of (uuid, otp_type, otp).")
+
+    def validate_items(self, value):
+        """
+        Validate batch size
+        :param value: List of items
+        :return: List of items
+        """
+        max_items = getattr(settings, 'OTP_BULK_MAX_ITEMS', 10000)
+        if not value:
+            raise serializers.ValidationError("This list may not be empty.")
+        if len(value) > max_items:
+            raise serializers.ValidationError("Ensure this list has no more than {} items.".format(max_items))
+        return value
+
+    def verify_bulk(self, items):
+        """
+        Verify every item, invalid items are reported without failing the batch.
+        Every uuid gets a single guess per batch, repeated uuids are rejected
+        (and still cost a token of the uuid throttle).
+        :param items: List of items
+        :return: Per-item verification results
+        """
+        indexes, valid_items, results = [], [], []
+        seen = set()
+        for index, item in enumerate(items):
+            validated, errors = VerifyOTPItemSerializer.parse_item(item)
+            if errors is not None:
+                results.append({'index': index, 'valid': False, 'errors': errors})
+            elif validated['uuid'] in seen:
+                results.append({'index': index, 'valid': False, 'errors': {
+                    'uuid': [ErrorDetail("Duplicate uuid in this batch.", code='unique')],
+                }})
+            else:
+                seen.add(validated['uuid'])
+                indexes.append(index)
+                valid_items.append(validated)
+
+        for index, result in zip(indexes, self._verify_otp_bulk(valid_items)):
+            result['index'] = index
+            results.append(result)
+
+        return sorted(results, key=lambda result: result['index'])
 
 
 class FCMSendSerializer(mixins.FCMMixin, serializers.Serializer):
@@ -106,14 +279,21 @@ class FCMSendSerializer(mixins.FCMMixin, serializers.Serializer):
     """
     def send_push(self, uuid):
         """
-        Send the push notification
+        Queue the push notification, delivery happens in the background
         :param uuid: UUID
-        :return: Refer code
+        :return: Refer code, None if the user has no active device
         """
-        refer = pyotp.random_base32(length=4)
-        self._update_code(refer, uuid)
         device = self._find_user_device(uuid)
-        device.send_message(title="Otter", body="Your refer code is: " + refer, click_action="OPEN_MAINPAGE2", data={"refer_code": refer})
+        if device is None:
+            return None
+        store = get_challenge_store()
+        refer = random_base32(length=4)
+        # Refer codes key the pending challenges, draw again on a collision
+        while not store.register(uuid, refer):
+            refer = random_base32(length=4)
+        self._update_code(refer, uuid)
+        message = PushMessage((device.registration_id,), "Otter", "Your refer code is: " + refer, "OPEN_MAINPAGE2", {"refer_code": refer})
+        get_push_dispatcher().submit(message)
         return refer
 
 
@@ -144,14 +324,20 @@ class FCMVerifySerializer(mixins.FCMMixin, serializers.Serializer):
 
     def verify_push(self, username, refer, accept):
         """
-
-        :param username:
-        :param refer_code:
-        :return:
+        Check the refer code and answer its pending challenge, which wakes the status waiters.
+        The refer code is cleared on first use, a replayed or late answer is refused.
+        :param username: Otter username
+        :param refer: Refer code
+        :param accept: Accept/Deny
+        :return: True if accepted, False if denied, the refer code does not match
+                 or its challenge is no longer pending
         """
-        if accept is False:
+        uuid = self._verify_message(username, refer)
+        if uuid is None or not self._consume_code(refer, uuid):
             return False
-        return True
+        if not get_challenge_store().resolve(uuid, refer, accept):
+            return False
+        return accept is True
 
 
 class FCMMobileSerializer(mixins.FCMMixin, serializers.Serializer):
@@ -164,3 +350,48 @@ class FCMMobileSerializer(mixins.FCMMixin, serializers.Serializer):
     def mobilelink(self, username, registration_id):
         self._update_user_fcm(username, registration_id)
         return True
+
+
+class FCMStatusSerializer(serializers.Serializer):
+    """
+    Push approval status, long-polled by the relying party
+    """
+    timeout = serializers.FloatField(required=False, default=0, min_value=0, help_text='Long-poll wait (in seconds)')
+
+    def _get_timeout(self):
+        return min(self.validated_data['timeout'], getattr(settings, 'OTP_CHALLENGE_MAX_WAIT', 25))
+
+    def push_status(self, uuid, refer):
+        """
+        Wait for the answer of a push challenge
+        :param uuid: PyOTP UUID
+        :param refer: Refer code
+        :return: pending/approved/denied/expired, None for an unknown challenge
+        """
+        return get_challenge_store().wait(uuid, refer, self._get_timeout())
+
+    async def push_status_async(self, uuid, refer):
+        """
+        Coroutine version of `push_status`
+        """
+        return await get_challenge_store().wait_async(uuid, refer, self._get_timeout())
+
+
+class ExportSerializer(serializers.Serializer):
+    """
+    Filters and format of the PyOTP audit export
+    """
+    # Not `format`, DRF reserves it for renderer negotiation
+    output = serializers.ChoiceField(choices=sorted(EXPORT_FORMATS), default='ndjson', help_text='ndjson/csv')
+    since = serializers.DateTimeField(required=False, help_text='Created at or after')
+    until = serializers.DateTimeField(required=False, help_text='Created before')
+    issuer = serializers.CharField(required=False, help_text='Issuer Name')
+
+    def export(self):
+        """
+        Stream the matching rows
+        :return: Generator of text chunks
+        """
+        data = self.validated_data
+        queryset = export_queryset(since=data.get('since'), until=data.get('until'), issuer=data.get('issuer'))
+        return render(iter_records(queryset), data['output'])
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .cache import get_cache
+from .models import PyOTP
+
+
+@receiver(post_save, sender=PyOTP)
+@receiver(post_delete, sender=PyOTP)
+def invalidate_pyotp_cache(sender, instance, **kwargs):
+    """
+    Drop the cached copy of a saved/deleted PyOTP object
+    """
+    get_cache().invalidate(instance.uuid)
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """
+    Tune every new SQLite connection with SQLITE_PRAGMAS
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
@@ -0,0 +1,107 @@
+"""
+Server-sent events stream of a push approval, mounted in front of Django by `Otter.asgi`.
+Django 3.2 cannot stream from a coroutine, so this is a plain ASGI application:
+every open stream is one coroutine parked on the challenge store.
+"""
+import asyncio
+import json
+import re
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http.request import split_domain_port, validate_host
+from .challenges import PENDING, get_challenge_store
+from .routers import REFER_REGEX, UUID_REGEX
+
+EVENTS_PATH = re.compile(r'^/push-status/(?P<uuid>{uuid})/(?P<refer>{refer})/events/$'.format(
+    uuid=UUID_REGEX, refer=REFER_REGEX,
+))
+
+
+def _event(status):
+    return 'event: status\ndata: {}\n\n'.format(json.dumps({'status': status})).encode()
+
+
+async def _send_json(send, status_code, data):
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps(data).encode()})
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def _allowed_host(scope):
+    host = dict(scope.get('headers') or ()).get(b'host', b'').decode('latin-1')
+    domain, _ = split_domain_port(host)
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+    return bool(domain) and validate_host(domain, allowed_hosts)
+
+
+async def push_status_events(scope, receive, send, uuid, refer):
+    """
+    Stream the status of a push challenge, the last event carries the answer
+    :param scope: ASGI scope
+    :param receive: ASGI receive
+    :param send: ASGI send
+    :param uuid: PyOTP UUID
+    :param refer: Refer code
+    """
+    if scope['method'] != 'GET':
+        return await _send_json(send, 405, {'detail': 'Method "{}" not allowed.'.format(scope['method'])})
+    if not _allowed_host(scope):
+        return await _send_json(send, 400, {'detail': 'Invalid host.'})
+
+    store = get_challenge_store()
+    # A shared store reads the cache, keep it off the event loop
+    status = await sync_to_async(store.status, thread_sensitive=False)(uuid, refer)
+    if status is None:
+        return await _send_json(send, 404, {'detail': 'Not found.'})
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': _event(status), 'more_body': True})
+
+    keepalive = getattr(settings, 'OTP_CHALLENGE_KEEPALIVE', 15)
+    disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        while status == PENDING:
+            waiter = asyncio.ensure_future(store.wait_async(uuid, refer, keepalive))
+            await asyncio.wait((waiter, disconnect), return_when=asyncio.FIRST_COMPLETED)
+            if disconnect.done():
+                waiter.cancel()
+                return
+            status = waiter.result()
+            body = b': keepalive\n\n' if status == PENDING else _event(status)
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnect.cancel()
+
+
+class PushStatusEventsMiddleware(object):
+    """
+    ASGI middleware serving the push status streams, everything else goes to `app`
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            match = EVENTS_PATH.match(scope['path'])
+            if match:
+                return await push_status_events(scope, receive, send, **match.groupdict())
+        return await self.app(scope, receive, send)
@@ -1,3 +1,1380 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+import pyotp
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, connection
+from django.db.models import QuerySet
+from django.http import QueryDict
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from fcm_django.models import FCMDevice
+from Otter.databases import get_databases
+from rest_framework.exceptions import ValidationError
+from . import metrics as otter_metrics
+from .cache import PyOTPCache, SharedPyOTPCache, get_cache
+from .callbacks import CallbackDispatcher
+from .challenges import CacheChallengeStore, LocalChallengeStore
+from .devices import DeviceRow, dedupe_devices, import_devices
+from .engine import OTPEngine
+from .entropy import SecretPool
+from .export import export_queryset, iter_records
+from .importer import Checkpoint, OTPImporter, parse_otpauth, validate
+from .importtime import parse_importtime, profile_startup
+from .mixins import FCMMixin, OTPMixin
+from .models import PyOTP
+from .push import LocalTransport, PushDispatcher, PushMessage, PushResult
+from .qr import QRRenderer
+from .replay import CacheReplayGuard, LocalReplayGuard
+from .retention import purge_expired
+from .serializers import FCMVerifySerializer, VerifyOTPItemSerializer, VerifyOTPSerializer
+from .sse import PushStatusEventsMiddleware
+from .throttling import TokenBucketStore
 
-# Create your tests here.
+
+class BulkGenerateOTPTestCase(TestCase):
+    """
+    Batch generation reports invalid items without failing the batch
+    """
+    def test_partial_failure(self):
+        response = self.client.post(reverse('generate-totp-bulk'), {'items': [
+            {'timeout': 30}, {'timeout': 0}, {'timeout': -5}, {'timeout': 'x'}, {}, {'timeout': 60},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual([result['index'] for result in data['results']], [0, 5])
+        self.assertEqual([error['index'] for error in data['errors']], [1, 2, 3, 4])
+        self.assertEqual(PyOTP.objects.filter(interval__isnull=False).count(), 2)
+
+    def test_hotp_count(self):
+        response = self.client.post(reverse('generate-hotp-bulk'), {'items': [
+            {'count': 0}, {'count': -1},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual([result['index'] for result in data['results']], [0])
+        self.assertIn('count', data['errors'][0]['errors'])
+
+    def test_all_invalid(self):
+        response = self.client.post(
+            reverse('generate-hotp-bulk'), {'items': [{'count': -1}]}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PyOTP.objects.exists())
+
+    def test_item_cap(self):
+        url = reverse('generate-totp-bulk')
+        with self.settings(OTP_BULK_MAX_ITEMS=3):
+            response = self.client.post(url, {'items': [{'timeout': 30}] * 4}, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('items', response.json())
+            response = self.client.post(url, {'items': [{'timeout': 30}] * 3}, content_type='application/json')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.post(url, {'items': []}, content_type='application/json').status_code, 400)
+
+
+class BulkVerifyOTPTestCase(TestCase):
+    """
+    Batch verification reports every item on its own, one guess per uuid
+    """
+    def setUp(self):
+        get_cache().clear()
+        patcher = mock.patch('api.throttling._stores', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.secret = pyotp.random_base32()
+        self.obj = PyOTP.objects.create(secret=self.secret, interval=30)
+        self.url = reverse('verify-otp-bulk')
+
+    def verify(self, items):
+        return self.client.post(self.url, {'items': items}, content_type='application/json')
+
+    def test_mixed_items(self):
+        missing = '00000000-0000-4000-8000-000000000000'
+        response = self.verify([
+            {'uuid': str(self.obj.uuid), 'otp_type': 'totp', 'otp': pyotp.TOTP(self.secret).now()},
+            {'uuid': missing, 'otp_type': 'totp', 'otp': '123456'},
+            {'uuid': 'not-a-uuid', 'otp_type': 'totp', 'otp': '123456'},
+            {'otp_type': 'totp', 'otp': '123456'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3])
+        self.assertEqual([result['valid'] for result in results], [True, False, False, False])
+        self.assertEqual(results[1]['error'], 'Not found.')
+        self.assertIn('uuid', results[2]['errors'])
+        self.assertIn('uuid', results[3]['errors'])
+
+    def test_duplicate_uuid(self):
+        totp = pyotp.TOTP(self.secret)
+        response = self.verify([
+            {'uuid': str(self.obj.uuid), 'otp_type': 'totp', 'otp': '000000'},
+            {'uuid': str(self.obj.uuid).upper(), 'otp_type': 'totp', 'otp': totp.now()},
+        ])
+        results = response.json()['results']
+        self.assertFalse(results[0]['valid'])
+        self.assertFalse(results[1]['valid'])
+        self.assertEqual(results[1]['errors']['uuid'], ['Duplicate uuid in this batch.'])
+
+    def test_item_errors_match_serializer(self):
+        for item in (
+            {'uuid': 'not-a-uuid', 'otp_type': 'totp', 'otp': '123456'},
+            {'uuid': str(self.obj.uuid), 'otp_type': 'sms'},
+            {},
+        ):
+            serializer = VerifyOTPItemSerializer(data=item)
+            self.assertFalse(serializer.is_valid())
+            self.assertEqual(VerifyOTPItemSerializer.parse_item(item), (None, serializer.errors))
+        item = {'uuid': str(self.obj.uuid), 'otp_type': 'totp', 'otp': '123456'}
+        serializer = VerifyOTPItemSerializer(data=item)
+        serializer.is_valid()
+        self.assertEqual(VerifyOTPItemSerializer.parse_item(item), (serializer.validated_data, None))
+
+    def test_duplicates_cost_throttle_tokens(self):
+        items = [{'uuid': str(self.obj.uuid), 'otp_type': 'totp', 'otp': '000000'}] * 3
+        with self.settings(OTP_THROTTLE_RATES={'uuid': '3/min'}):
+            self.assertEqual(self.verify(items).status_code, 200)
+            self.assertEqual(self.verify(items[:1]).status_code, 429)
+
+
+class OTPEngineTestCase(SimpleTestCase):
+    """
+    The precomputed HMAC engine must match pyotp bit for bit
+    """
+    def setUp(self):
+        self.engine = OTPEngine(max_size=8)
+        self.secrets = [pyotp.random_base32() for _ in range(16)]
+
+    def test_hotp_matches_pyotp(self):
+        for secret in self.secrets:
+            hotp = pyotp.HOTP(secret)
+            for counter in (0, 1, 7, 1000, 2 ** 40):
+                self.assertEqual(self.engine.generate(secret, counter), hotp.at(counter))
+                self.assertTrue(self.engine.hotp_verify(hotp.at(counter), secret, counter))
+                self.assertFalse(self.engine.hotp_verify(hotp.at(counter + 1), secret, counter))
+
+    def test_totp_matches_pyotp(self):
+        for secret in self.secrets:
+            for interval in (30, 60, 300):
+                totp = pyotp.TOTP(secret, interval=interval)
+                for for_time in (1000000, 1111111109, 1234567890, 2000000000):
+                    for window in (0, 1, 2):
+                        for offset in (-3, -1, 0, 1, 3):
+                            otp = totp.at(for_time, offset)
+                            self.assertEqual(
+                                self.engine.totp_verify(otp, secret, interval, for_time, window),
+                                totp.verify(otp, for_time, window),
+                            )
+
+    def test_totp_accepts_datetime(self):
+        secret = self.secrets[0]
+        totp = pyotp.TOTP(secret)
+        now = datetime.datetime.now()
+        self.assertTrue(self.engine.totp_verify(totp.at(now), secret, 30, now))
+
+    def test_rfc4226_vectors(self):
+        secret = 'GEZDGNBVGY3TQOJQGEZDGNBVGY3TQOJQ'
+        expected = ['755224', '287082', '359152', '969429', '338314', '254676', '287922', '162583', '399871', '520489']
+        self.assertEqual(self.engine.generate_many(secret, range(10)), expected)
+
+
+class PyOTPCacheTestCase(SimpleTestCase):
+    """
+    LRU/TTL behaviour of the PyOTP cache
+    """
+    def test_lru_eviction(self):
+        cache = PyOTPCache(max_size=2, ttl=60)
+        cache.set('a', PyOTP(secret='A'))
+        cache.set('b', PyOTP(secret='B'))
+        cache.get('a')
+        cache.set('c', PyOTP(secret='C'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a').secret, 'A')
+        self.assertEqual(cache.stats(), {'size': 2, 'hits': 2, 'misses': 1})
+
+    def test_get_many(self):
+        cache = PyOTPCache(max_size=2, ttl=60)
+        cache.set_many({'a': PyOTP(secret='A'), 'b': PyOTP(secret='B')})
+        objs = cache.get_many(['a', 'b', 'c'])
+        self.assertEqual({uuid: obj.secret for uuid, obj in objs.items()}, {'a': 'A', 'b': 'B'})
+        self.assertEqual(cache.stats(), {'size': 2, 'hits': 2, 'misses': 1})
+
+    def test_ttl_eviction(self):
+        cache = PyOTPCache(max_size=2, ttl=60)
+        with mock.patch('api.cache.time.monotonic', return_value=0):
+            cache.set('a', PyOTP(secret='A'))
+        with mock.patch('api.cache.time.monotonic', return_value=61):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_default_is_per_process(self):
+        with mock.patch('api.cache._cache', None):
+            self.assertIsInstance(get_cache(), PyOTPCache)
+
+
+class SharedPyOTPCacheTestCase(SimpleTestCase):
+    """
+    Invalidations of the shared PyOTP cache reach every worker
+    """
+    def setUp(self):
+        self.workers = [SharedPyOTPCache(ttl=60), SharedPyOTPCache(ttl=60)]
+        self.workers[0].clear()
+
+    def test_invalidate_reaches_other_workers(self):
+        first, second = self.workers
+        self.assertIsNone(first.get('a'))
+        first.set('a', PyOTP(secret='A'))
+        self.assertEqual(second.get('a').secret, 'A')
+        second.invalidate('a')
+        self.assertIsNone(first.get('a'))
+
+    def test_load_racing_invalidation(self):
+        first, second = self.workers
+        self.assertIsNone(first.get('a'))
+        # Saved and invalidated by another worker while this one was loading
+        second.invalidate('a')
+        first.set('a', PyOTP(secret='A'))
+        self.assertIsNone(first.get('a'))
+        first.set('a', PyOTP(secret='B'))
+        self.assertEqual(second.get('a').secret, 'B')
+
+    def test_set_without_miss_is_ignored(self):
+        self.workers[0].set('a', PyOTP(secret='A'))
+        self.assertIsNone(self.workers[1].get('a'))
+
+    def test_get_many_is_one_round_trip(self):
+        from django.core.cache.backends.locmem import LocMemCache
+
+        first, second = self.workers
+        uuids = [str(index) for index in range(100)]
+        with mock.patch.object(LocMemCache, 'get_many', autospec=True, side_effect=LocMemCache.get_many) as get_many:
+            self.assertEqual(first.get_many(uuids), {})
+        self.assertEqual(get_many.call_count, 1)
+        first.set_many({uuid: PyOTP(secret=uuid) for uuid in uuids[:50]})
+        second.invalidate('0')
+        objs = second.get_many(uuids)
+        self.assertEqual(sorted(objs), sorted(uuids[1:50]))
+        self.assertEqual(second.stats(), {'size': None, 'hits': 49, 'misses': 51})
+
+
+class VerifyOTPCacheTestCase(TestCase):
+    """
+    Repeat verifications are served from the cache, saves invalidate it
+    """
+    def setUp(self):
+        get_cache().clear()
+        self.secret = pyotp.random_base32()
+        self.obj = PyOTP.objects.create(secret=self.secret, count=5)
+        self.url = reverse('verify-otp', kwargs={'otp_type': 'hotp', 'uuid': self.obj.uuid})
+
+    def test_repeat_verification_skips_db(self):
+        self.client.post(self.url, {'otp': 'wrong'})
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, {'otp': 'wrong'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_save_invalidates(self):
+        self.client.post(self.url, {'otp': 'wrong'})
+        self.obj.count = 6
+        self.obj.save()
+        response = self.client.post(self.url, {'otp': pyotp.HOTP(self.secret).at(6)})
+        self.assertEqual(response.status_code, 200)
+
+
+class ProvisionQRTestCase(TestCase):
+    """
+    Provisioning URI views negotiate between PNG/SVG QR codes and JSON
+    """
+    def setUp(self):
+        self.url = reverse('generate-totp-provision-uri')
+        self.data = {'timeout': 30, 'name': 'otter@example.com', 'issuer_name': 'Otter'}
+        patcher = mock.patch('api.qr._renderer', QRRenderer(workers=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_json(self):
+        response = self.client.post(self.url, self.data, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertTrue(PyOTP.objects.filter(uuid=response.json()['otp_uuid']).exists())
+
+    def test_png(self):
+        response = self.client.post(self.url, self.data, HTTP_ACCEPT='image/png')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        self.assertTrue(PyOTP.objects.filter(uuid=response['X-OTP-UUID']).exists())
+
+    def test_svg(self):
+        response = self.client.post(self.url + '?format=svg', self.data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', response.content)
+        self.assertTrue(PyOTP.objects.filter(uuid=response['X-OTP-UUID']).exists())
+
+    def test_errors_are_json(self):
+        response = self.client.post(self.url, {'timeout': 0}, HTTP_ACCEPT='image/png')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('timeout', response.json())
+
+    def test_render_timeout(self):
+        renderer = QRRenderer(workers=1, timeout=0.01)
+        pool = mock.Mock()
+        pool.submit.return_value = Future()
+        with mock.patch.object(renderer, '_get_pool', return_value=pool), mock.patch('api.qr._renderer', renderer):
+            response = self.client.post(self.url, self.data, HTTP_ACCEPT='image/png')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertTrue(pool.submit.return_value.cancelled())
+
+
+class PushDispatcherTestCase(SimpleTestCase):
+    """
+    Queued pushes are delivered through the transport, one multicast per message
+    """
+    def test_batch_delivery(self):
+        transport = LocalTransport()
+        dispatcher = PushDispatcher(transport, workers=0)
+        dispatcher.handle([
+            PushMessage(('a', 'b'), 'Otter', 'Your refer code is: AAAA', None, {'refer_code': 'AAAA'}),
+            PushMessage(('c',), 'Otter', 'Your refer code is: BBBB', None, {'refer_code': 'BBBB'}),
+        ])
+        self.assertEqual([message.registration_ids for message in transport.sent], [('a', 'b'), ('c',)])
+        self.assertEqual([message.data for message in transport.sent], [{'refer_code': 'AAAA'}, {'refer_code': 'BBBB'}])
+        self.assertEqual(dispatcher.sent, 3)
+
+    def test_transport_failure(self):
+        transport = mock.Mock()
+        transport.send.side_effect = [ConnectionError('down'), [PushResult('b', True, None)]]
+        dispatcher = PushDispatcher(transport, workers=0)
+        with self.assertLogs('api.push', 'ERROR'):
+            dispatcher.handle([
+                PushMessage(('a',), 'Otter', 'first', None, None),
+                PushMessage(('b',), 'Otter', 'second', None, None),
+            ])
+        self.assertEqual((dispatcher.sent, dispatcher.failed), (1, 1))
+
+    def test_background_delivery(self):
+        transport = LocalTransport()
+        dispatcher = PushDispatcher(transport, workers=2)
+        for registration_id in range(50):
+            dispatcher.submit(PushMessage((registration_id,), 'Otter', 'hello', None, None))
+        dispatcher.join()
+        self.assertEqual(dispatcher.sent, 50)
+        self.assertEqual(len(dispatcher.results), 50)
+
+
+class CallbackStubHandler(BaseHTTPRequestHandler):
+    """
+    Local callback endpoint, fails the first `failures` requests
+    """
+    def do_POST(self):
+        server = self.server
+        server.bodies.append(self.rfile.read(int(self.headers['Content-Length'])))
+        status = 503 if len(server.bodies) <= server.failures else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class CallbackDispatcherTestCase(SimpleTestCase):
+    """
+    Callbacks are delivered in the background against a local HTTP stub
+    """
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), CallbackStubHandler)
+        self.server.bodies = []
+        self.server.failures = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_delivery(self):
+        dispatcher = CallbackDispatcher(self.url, workers=1)
+        dispatcher.submit({'http_code': 200})
+        dispatcher.submit({'http_code': 400})
+        dispatcher.join()
+        self.assertEqual(self.server.bodies, [b'http_code=200', b'http_code=400'])
+        metrics = dispatcher.metrics()
+        self.assertEqual(metrics['delivered'], 2)
+        self.assertEqual(metrics['queue_depth'], 0)
+
+    def test_retry_with_backoff(self):
+        self.server.failures = 2
+        dispatcher = CallbackDispatcher(self.url, retries=2, backoff=0.01, workers=0)
+        self.assertTrue(dispatcher.deliver({'http_code': 200}))
+        self.assertEqual(dispatcher.metrics()['retried'], 2)
+
+    def test_gives_up(self):
+        self.server.failures = 10
+        dispatcher = CallbackDispatcher(self.url, retries=1, backoff=0.01, workers=0)
+        self.assertFalse(dispatcher.deliver({'http_code': 200}))
+        self.assertEqual(dispatcher.metrics()['failed'], 1)
+
+    def test_full_queue_drops(self):
+        dispatcher = CallbackDispatcher(self.url, workers=1, queue_size=1)
+        with mock.patch.object(dispatcher, '_start'), mock.patch.object(dispatcher, 'deliver') as deliver:
+            self.assertTrue(dispatcher.submit({'http_code': 200}))
+            with self.assertLogs('api.dispatch', 'ERROR'):
+                self.assertFalse(dispatcher.submit({'http_code': 400}))
+        deliver.assert_not_called()
+        self.assertEqual(dispatcher.metrics()['dropped'], 1)
+        self.assertEqual(dispatcher.queue_depth, 1)
+
+
+class FCMQueryBudgetTestCase(TestCase):
+    """
+    Query budget of the FCM register/send/mobile flows
+    """
+    def setUp(self):
+        self.user = User.objects.create_user('otter')
+        self.obj = PyOTP.objects.create(secret=pyotp.random_base32(), interval=30)
+        self.transport = LocalTransport()
+        patcher = mock.patch('api.push._dispatcher', PushDispatcher(self.transport, workers=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_register_push(self):
+        url = reverse('register-push', kwargs={'uuid': self.obj.uuid})
+        with self.assertNumQueries(2):
+            response = self.client.post(url, {'username': 'otter'})
+        self.assertEqual(response.status_code, 200)
+        self.obj.refresh_from_db()
+        self.assertEqual(self.obj.user, self.user)
+
+    def test_send_push(self):
+        self.obj.user = self.user
+        self.obj.save()
+        FCMDevice.objects.create(user=self.user, registration_id='token')
+        url = reverse('send-push', kwargs={'uuid': self.obj.uuid})
+        with self.assertNumQueries(2):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.obj.refresh_from_db()
+        self.assertEqual(self.obj.refer_code, response.data)
+        self.assertEqual(self.transport.sent[0].registration_ids, ('token',))
+
+    def test_mobile_push(self):
+        # User, UPDATE, INSERT, plus the SAVEPOINT/RELEASE of the insert inside the test transaction
+        with self.assertNumQueries(5):
+            response = self.client.post(reverse('mobile-push'), {'username': 'otter', 'registration_id': 'token'})
+        self.assertEqual(response.status_code, 200)
+        FCMDevice.objects.update(active=False)
+        with self.assertNumQueries(2):
+            response = self.client.post(reverse('mobile-push'), {'username': 'otter', 'registration_id': 'token'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(FCMDevice.objects.values_list('registration_id', 'active')), [('token', True)])
+
+    def test_send_push_without_device(self):
+        url = reverse('send-push', kwargs={'uuid': self.obj.uuid})
+        with self.assertNumQueries(1):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+
+    def test_verify_message(self):
+        PyOTP.objects.filter(pk=self.obj.pk).update(user=self.user, refer_code='ABCD')
+        serializer = FCMVerifySerializer()
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer._verify_message('otter', 'ABCD'))
+        self.assertFalse(serializer._verify_message('otter', 'WXYZ'))
+        self.assertFalse(serializer._verify_message('nobody', 'ABCD'))
+
+
+class RetentionTestCase(TestCase):
+    """
+    Expired rows are purged in chunks, enrolled and recent rows are kept
+    """
+    def test_purge_expired(self):
+        now = timezone.now()
+        PyOTP.objects.bulk_create([PyOTP(secret='A', interval=30) for _ in range(5)])
+        PyOTP.objects.bulk_create([PyOTP(secret='A', count=1) for _ in range(3)])
+        PyOTP.objects.create(secret='A', interval=30, name='enrolled')
+        PyOTP.objects.update(created_at=now - datetime.timedelta(days=2))
+        recent = PyOTP.objects.create(secret='A', interval=30)
+
+        reports = purge_expired({'totp': 60 * 60, 'hotp': None}, chunk_size=2, now=now)
+
+        self.assertEqual([(report.otp_type, report.purged, report.chunks) for report in reports], [('totp', 5, 3)])
+        self.assertEqual(PyOTP.objects.filter(interval__isnull=True).count(), 3)
+        self.assertTrue(PyOTP.objects.filter(name='enrolled').exists())
+        self.assertTrue(PyOTP.objects.filter(pk=recent.pk).exists())
+
+    def test_purge_invalidates_cache(self):
+        obj = PyOTP.objects.create(secret=pyotp.random_base32(), interval=30)
+        PyOTP.objects.filter(pk=obj.pk).update(created_at=timezone.now() - datetime.timedelta(days=2))
+        url = reverse('verify-otp', kwargs={'otp_type': 'totp', 'uuid': obj.uuid})
+        self.assertEqual(self.client.post(url, {'otp': 'wrong'}).status_code, 400)
+
+        purge_expired({'totp': 60 * 60})
+        self.assertEqual(self.client.post(url, {'otp': 'wrong'}).status_code, 404)
+
+
+class ReplayGuardTestCase(SimpleTestCase):
+    """
+    A (uuid, time step) pair is accepted once until it expires
+    """
+    def test_local_guard(self):
+        guard = LocalReplayGuard(max_size=2)
+        self.assertTrue(guard.check_and_record('a', 1, 30))
+        self.assertFalse(guard.check_and_record('a', 1, 30))
+        self.assertTrue(guard.check_and_record('a', 2, 30))
+        self.assertTrue(guard.check_and_record('b', 1, 30))
+        self.assertEqual(len(guard), 2)
+
+    def test_local_guard_expiry(self):
+        guard = LocalReplayGuard()
+        with mock.patch('api.replay.time.time', return_value=1000):
+            guard.check_and_record('a', 1, 30)
+        with mock.patch('api.replay.time.time', return_value=1031):
+            self.assertTrue(guard.check_and_record('a', 1, 30))
+            self.assertEqual(len(guard), 1)
+
+    def test_cache_guard(self):
+        guard = CacheReplayGuard()
+        guard.cache.clear()
+        self.assertTrue(guard.check_and_record('a', 1, 30))
+        self.assertFalse(guard.check_and_record('a', 1, 30))
+        self.assertFalse(CacheReplayGuard().check_and_record('a', 1, 30))
+
+
+class TOTPReplayTestCase(TestCase):
+    """
+    The same TOTP is rejected the second time
+    """
+    def test_replay_rejected(self):
+        obj = PyOTP.objects.create(secret=pyotp.random_base32(), interval=30)
+        url = reverse('verify-otp', kwargs={'otp_type': 'totp', 'uuid': obj.uuid})
+        otp = pyotp.TOTP(obj.secret).now()
+        with mock.patch('api.replay._guard', LocalReplayGuard()):
+            self.assertEqual(self.client.post(url, {'otp': otp}).status_code, 200)
+            self.assertEqual(self.client.post(url, {'otp': otp}).status_code, 400)
+
+
+class HOTPCounterTestCase(TestCase):
+    """
+    HOTP look-ahead resync and conditional counter advance
+    """
+    def setUp(self):
+        self.obj = PyOTP.objects.create(secret=pyotp.random_base32(), count=0)
+        self.hotp = pyotp.HOTP(self.obj.secret)
+        self.url = reverse('verify-otp', kwargs={'otp_type': 'hotp', 'uuid': self.obj.uuid})
+
+    def test_advance_and_reject_reuse(self):
+        self.assertEqual(self.client.post(self.url, {'otp': self.hotp.at(0)}).status_code, 200)
+        self.assertEqual(self.client.post(self.url, {'otp': self.hotp.at(0)}).status_code, 400)
+        self.obj.refresh_from_db()
+        self.assertEqual(self.obj.count, 1)
+
+    def test_look_ahead_resync(self):
+        with self.settings(OTP_HOTP_LOOK_AHEAD=5):
+            self.assertEqual(self.client.post(self.url, {'otp': self.hotp.at(6)}).status_code, 400)
+            self.assertEqual(self.client.post(self.url, {'otp': self.hotp.at(4)}).status_code, 200)
+        self.obj.refresh_from_db()
+        self.assertEqual(self.obj.count, 5)
+
+    def test_stale_verifiers(self):
+        # Both verifiers loaded the row before either advanced the counter
+        first, second = PyOTP.objects.get(pk=self.obj.pk), PyOTP.objects.get(pk=self.obj.pk)
+        mixin = OTPMixin()
+        self.assertTrue(mixin._verify_otp(self.hotp.at(0), first, 'hotp'))
+        self.assertFalse(mixin._verify_otp(self.hotp.at(0), second, 'hotp'))
+        self.assertTrue(mixin._verify_otp(self.hotp.at(1), second, 'hotp'))
+        self.obj.refresh_from_db()
+        self.assertEqual(self.obj.count, 2)
+
+
+class HOTPConcurrencyTestCase(TransactionTestCase):
+    """
+    Stress test: many threads race to verify the same HOTP codes
+    """
+    threads = 8
+    codes = 20
+
+    def test_no_code_accepted_twice(self):
+        obj = PyOTP.objects.create(secret=pyotp.random_base32(), count=0)
+        otps = [pyotp.HOTP(obj.secret).at(count) for count in range(self.codes)]
+        accepted = []
+        errors = {}
+        barrier = threading.Barrier(self.threads)
+
+        def verify(worker):
+            mixin = OTPMixin()
+            stale = PyOTP(pk=obj.pk, uuid=obj.uuid, secret=obj.secret, count=0)
+            barrier.wait()
+            try:
+                for otp in otps:
+                    if mixin._verify_otp(otp, stale, 'hotp'):
+                        accepted.append(otp)
+            except Exception as e:
+                errors[worker] = e
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=verify, args=(worker,)) for worker in range(self.threads)]
+        with self.settings(OTP_HOTP_LOOK_AHEAD=self.codes, OTP_HOTP_LOCK_RETRIES=20):
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+        self.assertEqual(errors, {})
+        obj.refresh_from_db()
+        self.assertEqual(obj.count, self.codes)
+        self.assertEqual(sorted(accepted), sorted(otps))
+
+    def test_locked_table_fails_verification(self):
+        obj = PyOTP.objects.create(secret=pyotp.random_base32(), count=0)
+        locked = OperationalError('database table is locked: api_pyotp')
+        with mock.patch('api.mixins.time.sleep') as sleep, \
+                mock.patch('django.db.models.query.QuerySet.update', side_effect=locked):
+            self.assertFalse(OTPMixin()._verify_otp(pyotp.HOTP(obj.secret).at(0), obj, 'hotp'))
+        self.assertEqual(sleep.call_count, settings.OTP_HOTP_LOCK_RETRIES)
+        obj.refresh_from_db()
+        self.assertEqual(obj.count, 0)
+
+
+class TokenBucketStoreTestCase(SimpleTestCase):
+    """
+    Token buckets refill lazily and stay bounded
+    """
+    def test_refill(self):
+        store = TokenBucketStore(burst=2, refill_rate=1)
+        self.assertTrue(store.consume('a', now=0)[0])
+        self.assertTrue(store.consume('a', now=0)[0])
+        self.assertEqual(store.consume('a', now=0), (False, 1.0))
+        self.assertTrue(store.consume('a', now=1)[0])
+
+    def test_bounded_keys(self):
+        store = TokenBucketStore(burst=1, refill_rate=1, shards=1, max_keys=10)
+        for key in range(100):
+            store.consume(key, now=0)
+        self.assertLessEqual(len(store), 10)
+
+    def test_throttled_buckets_are_kept(self):
+        store = TokenBucketStore(burst=1, refill_rate=1, shards=1, max_keys=2)
+        self.assertTrue(store.consume('a', now=0)[0])
+        self.assertTrue(store.consume('b', now=0)[0])
+        self.assertEqual(store.consume('c', now=0.5), (False, 0.5))
+        self.assertFalse(store.consume('a', now=0.5)[0])
+        self.assertTrue(store.consume('c', now=2)[0])
+        self.assertLessEqual(len(store), 2)
+
+    def test_consume_tokens(self):
+        store = TokenBucketStore(burst=3, refill_rate=1)
+        self.assertTrue(store.consume('a', now=0, tokens=2)[0])
+        self.assertEqual(store.consume('a', now=0, tokens=2), (False, 1.0))
+        self.assertTrue(store.consume('a', now=0, tokens=1)[0])
+
+
+class VerifyThrottleTestCase(TestCase):
+    """
+    Throttled verifications are rejected before any DB access
+    """
+    def setUp(self):
+        patcher = mock.patch('api.throttling._stores', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_uuid_throttle(self):
+        obj = PyOTP.objects.create(secret=pyotp.random_base32(), interval=30)
+        url = reverse('verify-otp', kwargs={'otp_type': 'totp', 'uuid': obj.uuid})
+        with self.settings(OTP_THROTTLE_RATES={'uuid': '2/min'}):
+            for _ in range(2):
+                self.assertEqual(self.client.post(url, {'otp': 'wrong'}).status_code, 400)
+            with self.assertNumQueries(0):
+                response = self.client.post(url, {'otp': 'wrong'})
+        self.assertEqual(response.status_code, 429)
+
+    def test_bulk_uuid_throttle(self):
+        first = PyOTP.objects.create(secret=pyotp.random_base32(), interval=30)
+        second = PyOTP.objects.create(secret=pyotp.random_base32(), interval=30)
+        url = reverse('verify-otp-bulk')
+
+        def verify(*objs):
+            items = [{'uuid': str(obj.uuid), 'otp_type': 'totp', 'otp': '000000'} for obj in objs]
+            return self.client.post(url, {'items': items}, content_type='application/json')
+
+        with self.settings(OTP_THROTTLE_RATES={'uuid': '2/min'}):
+            self.assertEqual(verify(first, second).status_code, 200)
+            self.assertEqual(verify(first).status_code, 200)
+            with self.assertNumQueries(0):
+                response = verify(first, second)
+            self.assertEqual(response.status_code, 429)
+            single = reverse('verify-otp', kwargs={'otp_type': 'totp', 'uuid': first.uuid})
+            self.assertEqual(self.client.post(single, {'otp': 'wrong'}).status_code, 429)
+
+    def test_bulk_ip_throttle(self):
+        obj = PyOTP.objects.create(secret=pyotp.random_base32(), interval=30)
+        url = reverse('verify-otp-bulk')
+
+        def verify(count):
+            items = [{'uuid': str(obj.uuid), 'otp_type': 'totp', 'otp': '000000'}] * count
+            return self.client.post(url, {'items': items}, content_type='application/json')
+
+        with self.settings(OTP_THROTTLE_RATES={'ip': '5/min'}):
+            with self.assertNumQueries(0):
+                response = verify(6)
+            self.assertEqual(response.status_code, 429)
+            self.assertNotIn('Retry-After', response)
+            self.assertEqual(verify(3).status_code, 200)
+            response = verify(3)
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+
+    def test_forwarded_for_is_ignored(self):
+        obj = PyOTP.objects.create(secret=pyotp.random_base32(), interval=30)
+        url = reverse('verify-otp', kwargs={'otp_type': 'totp', 'uuid': obj.uuid})
+        with self.settings(OTP_THROTTLE_RATES={'ip': '1/min'}):
+            self.assertEqual(self.client.post(url, {'otp': 'wrong'}, HTTP_X_FORWARDED_FOR='10.0.0.1').status_code, 400)
+            response = self.client.post(url, {'otp': 'wrong'}, HTTP_X_FORWARDED_FOR='10.0.0.2')
+        self.assertEqual(response.status_code, 429)
+
+
+class DBProfileTestCase(SimpleTestCase):
+    """
+    OTTER_DB_PROFILE maps to DATABASES, new SQLite connections get SQLITE_PRAGMAS
+    """
+    def test_profiles(self):
+        sqlite = get_databases('sqlite', {}, '/srv/otter')['default']
+        self.assertEqual(sqlite['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(sqlite['NAME'], os.path.join('/srv/otter', 'db.sqlite3'))
+        postgres = get_databases('postgres', {
+            'OTTER_DB_HOST': 'db', 'OTTER_DB_PORT': '5432', 'OTTER_DB_TRANSACTION_POOLING': '0',
+        }, '/srv/otter')['default']
+        self.assertEqual(postgres['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((postgres['HOST'], postgres['PORT']), ('db', '5432'))
+        self.assertFalse(postgres['DISABLE_SERVER_SIDE_CURSORS'])
+        self.assertTrue(get_databases('postgres', {}, '/srv/otter')['default']['DISABLE_SERVER_SIDE_CURSORS'])
+
+    def test_unknown_profile(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, "Unknown OTTER_DB_PROFILE 'postgresql'"):
+            get_databases('postgresql', {}, '/srv/otter')
+
+    def test_sqlite_pragmas(self):
+        from django.db.backends.sqlite3.base import DatabaseWrapper
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_dict = get_databases('sqlite', {'OTTER_DB_TIMEOUT': '2.5'}, directory)['default']
+        wrapper = DatabaseWrapper(dict(connection.settings_dict, **settings_dict), 'pragmas')
+        try:
+            with wrapper.cursor() as cursor:
+                values = {}
+                for name in ('journal_mode', 'synchronous', 'busy_timeout'):
+                    cursor.execute('PRAGMA {}'.format(name))
+                    values[name] = cursor.fetchone()[0]
+        finally:
+            wrapper.close()
+        # synchronous reads back as a number, 1 is NORMAL
+        self.assertEqual(values, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 2500})
+
+
+class MetricsTestCase(TestCase):
+    """
+    Per-route latency, DB and HMAC metrics on the Prometheus endpoint
+    """
+    def test_metrics_endpoint(self):
+        obj = PyOTP.objects.create(secret=pyotp.random_base32(), interval=30)
+        self.client.post(reverse('verify-otp', kwargs={'otp_type': 'totp', 'uuid': obj.uuid}), {'otp': 'wrong'})
+        with self.settings(METRICS_TOKEN='scrape'):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('otter_request_duration_seconds_count{route="verify-otp"}', body)
+        self.assertIn('otter_db_queries_total{route="verify-otp"}', body)
+        self.assertIn('otter_section_duration_seconds_count{route="verify-otp",section="hmac"}', body)
+
+    def test_access(self):
+        url = reverse('metrics')
+        with self.settings(METRICS_TOKEN='scrape'):
+            self.assertEqual(self.client.get(url).status_code, 403)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        with self.settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+            self.client.force_login(User.objects.create_user('otter'))
+            self.assertEqual(self.client.get(url).status_code, 403)
+            self.client.force_login(User.objects.create_user('admin', is_staff=True))
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_finished_threads_are_folded(self):
+        def work():
+            otter_metrics.inc('otter_db_queries_total', (('route', 'folded'),), 2)
+
+        threads = [threading.Thread(target=work) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        _, counters = otter_metrics._merge()
+        self.assertFalse(any(thread in otter_metrics._stores for thread in threads))
+        self.assertEqual(counters[('otter_db_queries_total', (('route', 'folded'),))], 6)
+
+
+class VerifyOTPFastPathTestCase(SimpleTestCase):
+    """
+    The lean OTP parser behaves exactly like the serializer
+    """
+    payloads = [
+        {'otp': '123456'},
+        {'otp': ' 123456 '},
+        {'otp': 123456},
+        {'otp': ''},
+        {'otp': '   '},
+        {'otp': None},
+        {'otp': True},
+        {'otp': ['1']},
+        {'otp': '12\x0034'},
+        {},
+        [],
+        'otp',
+        QueryDict('otp=123456'),
+        QueryDict('otp=1&otp=2'),
+        QueryDict(''),
+    ]
+
+    def test_same_as_serializer(self):
+        for payload in self.payloads:
+            serializer = VerifyOTPSerializer(data=payload)
+            if serializer.is_valid():
+                self.assertEqual(VerifyOTPSerializer.parse_otp(payload), serializer.data.get('otp'))
+                continue
+            with self.assertRaises(ValidationError) as context:
+                VerifyOTPSerializer.parse_otp(payload)
+            self.assertEqual(context.exception.detail, serializer.errors)
+            self.assertEqual(context.exception.get_codes(), ValidationError(serializer.errors).get_codes())
+
+
+@override_settings(ROOT_URLCONF='Otter.asgi_urls')
+class AsyncViewsTestCase(TestCase):
+    """
+    The async views answer like the DRF views
+    """
+
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user('otter')
+        self.obj = PyOTP.objects.create(secret=pyotp.random_base32(), count=0, user=self.user)
+        FCMDevice.objects.create(user=self.user, registration_id='token')
+        patcher = mock.patch('api.push._dispatcher', PushDispatcher(LocalTransport(), workers=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('api.throttling._stores', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_verify_otp(self):
+        client = AsyncClient()
+        url = reverse('verify-otp', kwargs={'otp_type': 'hotp', 'uuid': self.obj.uuid})
+        otp = pyotp.HOTP(self.obj.secret).at(0)
+        response = await client.post(url, {'otp': otp}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response = await client.post(url, {'otp': otp}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = await client.post(url, {}, content_type='application/json')
+        self.assertEqual(response.json(), {'otp': ['This field is required.']})
+        missing = reverse('verify-otp', kwargs={'otp_type': 'hotp', 'uuid': '00000000-0000-0000-0000-000000000000'})
+        response = await client.post(missing, {'otp': otp}, content_type='application/json')
+        self.assertEqual((response.status_code, response.json()), (404, {'detail': 'Not found.'}))
+
+    async def test_verify_totp_off_the_event_loop(self):
+        obj = await sync_to_async(PyOTP.objects.create)(secret=pyotp.random_base32(), interval=30)
+        loop_thread = threading.current_thread()
+        threads = []
+
+        class Guard(LocalReplayGuard):
+            def check_and_record(self, uuid, step, ttl):
+                threads.append(threading.current_thread())
+                return super().check_and_record(uuid, step, ttl)
+
+        url = reverse('verify-otp', kwargs={'otp_type': 'totp', 'uuid': obj.uuid})
+        with mock.patch('api.replay._guard', Guard()):
+            response = await AsyncClient().post(url, {'otp': pyotp.TOTP(obj.secret).now()}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], loop_thread)
+
+    async def test_send_push(self):
+        url = reverse('send-push', kwargs={'uuid': self.obj.uuid})
+        response = await AsyncClient().post(url, {}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 4)
+
+    async def test_verify_push(self):
+        with self.settings(PUSH_CALLBACK_URL=None):
+            with mock.patch('api.callbacks._dispatcher', None):
+                response = await AsyncClient().post(
+                    reverse('verify-push'), {'username': 'otter', 'refer_code': 'ABCD', 'accept': False},
+                    content_type='application/json',
+                )
+        self.assertEqual(response.status_code, 400)
+
+
+class SecretPoolTestCase(SimpleTestCase):
+    """
+    Pooled secrets are valid base32 strings of the requested length and never repeat
+    """
+    def test_get(self):
+        pool = SecretPool(length=16, size=64, low_water=0)
+        secrets = [pool.get() for _ in range(1000)]
+        self.assertEqual(len(set(secrets)), 1000)
+        for secret in secrets:
+            self.assertEqual(len(secret), 16)
+            self.assertEqual(len(pyotp.TOTP(secret).byte_secret()), 10)
+
+    def test_refill(self):
+        pool = SecretPool(length=4, size=10, low_water=5)
+        pool.get()
+        self.assertEqual(len(pool), 9)
+        with mock.patch('api.entropy.threading.Thread') as thread:
+            for _ in range(5):
+                pool.get()
+        thread.assert_called_once()
+        pool.refill()
+        self.assertEqual(len(pool), 14)
+
+
+class WorkerStartupTestCase(SimpleTestCase):
+    """
+    A fresh worker starts within WORKER_STARTUP_BUDGET without loading the deferred modules
+    """
+    lazy_modules = ('qrcode', 'PIL', 'httpx', 'concurrent.futures.process')
+
+    def test_parse_importtime(self):
+        timings = parse_importtime(
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        300 |   api.engine\n'
+            'import time:        80 |        380 | api.mixins\n'
+        )
+        self.assertEqual([(t.module, t.self_us, t.cumulative_us, t.depth) for t in timings], [
+            ('api.engine', 120, 300, 1),
+            ('api.mixins', 80, 380, 0),
+        ])
+
+    def test_startup_budget(self):
+        elapsed, _, modules = profile_startup()
+        self.assertLess(elapsed, settings.WORKER_STARTUP_BUDGET)
+        for module in self.lazy_modules:
+            self.assertNotIn(module, modules)
+
+
+class ChallengeStoreTestCase(SimpleTestCase):
+    """
+    Waiters wake up as soon as the challenge is answered
+    """
+    uuid = '00000000-0000-0000-0000-000000000001'
+
+    def test_register_resolve(self):
+        store = LocalChallengeStore(ttl=60)
+        self.assertTrue(store.register(self.uuid, 'ABCD'))
+        self.assertFalse(store.register(self.uuid, 'ABCD'))
+        self.assertIsNone(store.status('00000000-0000-0000-0000-000000000002', 'ABCD'))
+        self.assertEqual(store.wait(self.uuid, 'ABCD', 0), 'pending')
+        self.assertTrue(store.resolve(self.uuid, 'ABCD', False))
+        self.assertFalse(store.resolve(self.uuid, 'ABCD', True))
+        self.assertEqual(store.status(self.uuid, 'ABCD'), 'denied')
+
+    def test_expiry(self):
+        store = LocalChallengeStore(ttl=0.05)
+        store.register(self.uuid, 'ABCD')
+        self.assertEqual(store.wait(self.uuid, 'ABCD', 10), 'expired')
+        self.assertFalse(store.resolve(self.uuid, 'ABCD', True))
+        self.assertTrue(store.register(self.uuid, 'ABCD'))
+
+    def test_wait(self):
+        store = LocalChallengeStore(ttl=60)
+        store.register(self.uuid, 'ABCD')
+        threading.Timer(0.05, store.resolve, (self.uuid, 'ABCD', True)).start()
+        self.assertEqual(store.wait(self.uuid, 'ABCD', 10), 'approved')
+
+    def test_wait_async(self):
+        store = LocalChallengeStore(ttl=60)
+        store.register(self.uuid, 'ABCD')
+
+        async def wait():
+            waiters = [asyncio.ensure_future(store.wait_async(self.uuid, 'ABCD', 10)) for _ in range(100)]
+            await asyncio.sleep(0.01)
+            threading.Thread(target=store.resolve, args=(self.uuid, 'ABCD', True)).start()
+            return await asyncio.gather(*waiters)
+
+        self.assertEqual(asyncio.run(wait()), ['approved'] * 100)
+
+    def test_cache_wait_async(self):
+        store = CacheChallengeStore(ttl=60, poll_interval=0.01)
+        store.register(self.uuid, 'WXYZ')
+        loop_thread = threading.current_thread()
+        threads = set()
+        status = store.status
+
+        def record(uuid, refer):
+            threads.add(threading.current_thread())
+            return status(uuid, refer)
+
+        async def wait():
+            threading.Timer(0.05, store.resolve, (self.uuid, 'WXYZ', True)).start()
+            return await store.wait_async(self.uuid, 'WXYZ', 10)
+
+        with mock.patch.object(store, 'status', record):
+            self.assertEqual(asyncio.run(wait()), 'approved')
+        self.assertTrue(threads)
+        self.assertNotIn(loop_thread, threads)
+
+
+class PushChallengeTestCase(TestCase):
+    """
+    send_push opens a challenge and verify_push answers it
+    """
+    def setUp(self):
+        self.user = User.objects.create_user('otter')
+        self.obj = PyOTP.objects.create(secret=pyotp.random_base32(), interval=30, user=self.user)
+        FCMDevice.objects.create(user=self.user, registration_id='token')
+        for name, value in (
+            ('api.push._dispatcher', PushDispatcher(LocalTransport(), workers=0)),
+            ('api.challenges._store', LocalChallengeStore(ttl=60)),
+            ('api.callbacks._dispatcher', CallbackDispatcher(url=None)),
+            ('api.throttling._stores', {}),
+        ):
+            patcher = mock.patch(name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _status(self, refer, **params):
+        return self.client.get(reverse('push-status', kwargs={'uuid': self.obj.uuid, 'refer': refer}), params)
+
+    def test_push_status(self):
+        refer = self.client.post(reverse('send-push', kwargs={'uuid': self.obj.uuid})).data
+        self.assertEqual(self._status(refer).data, {'status': 'pending'})
+        self.assertEqual(self._status('ZZZZ').status_code, 404)
+
+        response = self.client.post(reverse('verify-push'), {'username': 'nobody', 'refer_code': refer, 'accept': True})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._status(refer, timeout=0.01).data, {'status': 'pending'})
+
+        response = self.client.post(reverse('verify-push'), {'username': 'otter', 'refer_code': refer, 'accept': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._status(refer, timeout=10).data, {'status': 'approved'})
+
+    def test_answer_once(self):
+        callbacks = CallbackDispatcher(url='http://relying.party/callback')
+        refer = self.client.post(reverse('send-push', kwargs={'uuid': self.obj.uuid})).data
+        with mock.patch('api.callbacks._dispatcher', callbacks), mock.patch.object(callbacks, 'submit') as submit:
+            for accept in (False, True, False):
+                response = self.client.post(
+                    reverse('verify-push'), {'username': 'otter', 'refer_code': refer, 'accept': accept},
+                )
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._status(refer).data, {'status': 'denied'})
+        self.assertEqual([call.args[0]['http_code'] for call in submit.call_args_list], [400, 400, 400])
+        self.assertIsNone(PyOTP.objects.get(pk=self.obj.pk).refer_code)
+
+    def test_expired_challenge(self):
+        refer = self.client.post(reverse('send-push', kwargs={'uuid': self.obj.uuid})).data
+        with mock.patch('api.challenges.time.time', return_value=time.time() + 3600):
+            response = self.client.post(reverse('verify-push'), {'username': 'otter', 'refer_code': refer, 'accept': True})
+        self.assertEqual(response.status_code, 400)
+
+    def test_events(self):
+        refer = self.client.post(reverse('send-push', kwargs={'uuid': self.obj.uuid})).data
+        app = PushStatusEventsMiddleware(None)
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/push-status/{}/{}/events/'.format(self.obj.uuid, refer),
+            'headers': [(b'host', b'161.246.5.8')],
+        }
+        messages = []
+
+        async def receive():
+            await asyncio.sleep(10)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+
+        async def stream():
+            task = asyncio.ensure_future(app(scope, receive, send))
+            await asyncio.sleep(0.01)
+            FCMVerifySerializer().verify_push('otter', refer, False)
+            await task
+
+        with mock.patch.object(FCMVerifySerializer, '_verify_message', return_value=str(self.obj.uuid)), \
+                mock.patch.object(FCMVerifySerializer, '_consume_code', return_value=True):
+            asyncio.run(stream())
+        self.assertEqual(messages[0]['status'], 200)
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        self.assertEqual(body, b'event: status\ndata: {"status": "pending"}\n\n'
+                               b'event: status\ndata: {"status": "denied"}\n\n')
+        self.assertFalse(messages[-1].get('more_body', False))
+
+
+class FCMDeviceUpsertTestCase(TestCase):
+    """
+    One FCMDevice row per (user, registration_id)
+    """
+    def setUp(self):
+        self.user = User.objects.create_user('otter')
+
+    def test_unique_index(self):
+        from django.db import IntegrityError, transaction
+
+        FCMDevice.objects.create(user=self.user, registration_id='token')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            FCMDevice.objects.create(user=self.user, registration_id='token')
+
+    def test_update_user_fcm(self):
+        mixin = FCMMixin()
+        self.assertTrue(mixin._update_user_fcm('otter', 'token'))
+        FCMDevice.objects.update(active=False)
+        self.assertFalse(mixin._update_user_fcm('otter', 'token'))
+        self.assertEqual(list(FCMDevice.objects.values_list('registration_id', 'active')), [('token', True)])
+
+    def test_update_user_fcm_race(self):
+        mixin = FCMMixin()
+        update = QuerySet.update
+
+        def register_concurrently(queryset, **kwargs):
+            # Another request inserts the device right after this UPDATE found nothing
+            updated = update(queryset, **kwargs)
+            if not updated and not FCMDevice.objects.exists():
+                FCMDevice.objects.create(user=self.user, registration_id='token', active=False)
+            return updated
+
+        with mock.patch.object(QuerySet, 'update', register_concurrently):
+            self.assertFalse(mixin._update_user_fcm('otter', 'token'))
+        self.assertEqual(list(FCMDevice.objects.values_list('registration_id', 'active')), [('token', True)])
+
+    def test_import_devices(self):
+        rows = [
+            DeviceRow('otter', 'token-1', 'android', None),
+            DeviceRow('otter', 'token-2', None, 'phone'),
+            DeviceRow('otter', 'token-1', 'android', None),
+            DeviceRow('nobody', 'token-3', None, None),
+        ]
+        with self.assertNumQueries(2 * 2 + 2 * 2):
+            self.assertEqual(import_devices(FCMDevice, User, rows, batch_size=2), (4, 1))
+        self.assertEqual(
+            sorted(FCMDevice.objects.values_list('registration_id', 'type', 'name')),
+            [('token-1', 'android', None), ('token-2', '', 'phone')],
+        )
+
+    def test_dedupe_devices(self):
+        from .devices import DEVICE_UNIQUE_INDEX
+
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX {}'.format(DEVICE_UNIQUE_INDEX))
+        other = User.objects.create_user('other')
+        FCMDevice.objects.bulk_create(
+            [FCMDevice(user=self.user, registration_id='token') for _ in range(3)]
+            + [FCMDevice(user=other, registration_id='token'), FCMDevice(user=self.user, registration_id='other')]
+        )
+        newest = FCMDevice.objects.filter(user=self.user, registration_id='token').latest('id')
+        self.assertEqual(dedupe_devices(FCMDevice, dry_run=True), 2)
+        self.assertEqual(dedupe_devices(FCMDevice, chunk_size=1), 2)
+        self.assertEqual(FCMDevice.objects.count(), 3)
+        self.assertTrue(FCMDevice.objects.filter(pk=newest.pk).exists())
+
+
+class PyOTPAdminTestCase(TestCase):
+    """
+    The admin list pages on the primary key and never counts the table
+    """
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.user = User.objects.create_user('otter')
+        PyOTP.objects.bulk_create([PyOTP(secret='A', interval=30, user=self.user) for _ in range(45)])
+        self.url = reverse('admin:api_pyotp_changelist')
+
+    def _ids(self, response):
+        return [obj.pk for obj in response.context['cl'].result_list]
+
+    def test_keyset_pagination(self):
+        ids = list(PyOTP.objects.order_by('-pk').values_list('pk', flat=True))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+        self.assertEqual(self._ids(response), ids[:20])
+        self.assertContains(response, '?before={}'.format(ids[19]))
+
+        response = self.client.get(self.url, {'before': ids[39]})
+        self.assertEqual(self._ids(response), ids[40:])
+        self.assertFalse(response.context['cl'].has_next)
+        response = self.client.get(self.url, {'after': ids[40]})
+        self.assertEqual(self._ids(response), ids[20:40])
+        self.assertTrue(response.context['cl'].has_previous)
+        response = self.client.get(self.url, {'before': 'x'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_search_and_filter(self):
+        obj = PyOTP.objects.create(secret='A', interval=30)
+        response = self.client.get(self.url, {'q': str(obj.uuid)})
+        self.assertEqual(self._ids(response), [obj.pk])
+        response = self.client.get(self.url, {'q': 'ott'})
+        self.assertEqual(len(self._ids(response)), 20)
+        response = self.client.get(self.url, {'q': 'tter'})
+        self.assertEqual(self._ids(response), [])
+
+        PyOTP.objects.filter(pk=obj.pk).update(created_at=timezone.now() - datetime.timedelta(days=10))
+        now = timezone.now()
+        response = self.client.get(self.url, {
+            'created_at__gte': (now - datetime.timedelta(days=11)).isoformat(),
+            'created_at__lt': (now - datetime.timedelta(days=8)).isoformat(),
+        })
+        self.assertEqual(self._ids(response), [obj.pk])
+
+
+class ExportTestCase(TestCase):
+    """
+    The export walks the table in id chunks and streams NDJSON/CSV to admins only
+    """
+    def setUp(self):
+        self.user = User.objects.create_user('otter')
+        PyOTP.objects.bulk_create(
+            [PyOTP(secret='A', interval=30, user=self.user, issuer_name='Otter') for _ in range(5)]
+            + [PyOTP(secret='A', count=0, issuer_name='Other') for _ in range(2)]
+        )
+        self.url = reverse('export-otps')
+
+    def test_iter_records(self):
+        with self.assertNumQueries(4):
+            records = list(iter_records(export_queryset(), chunk_size=2))
+        self.assertEqual([record['uuid'] for record in records],
+                         [str(uuid) for uuid in PyOTP.objects.order_by('id').values_list('uuid', flat=True)])
+        self.assertEqual(records[0]['user'], 'otter')
+        self.assertEqual([record['type'] for record in records], ['totp'] * 5 + ['hotp'] * 2)
+        self.assertEqual(len(list(iter_records(export_queryset(issuer='Other')))), 2)
+        since = timezone.now() + datetime.timedelta(minutes=1)
+        self.assertEqual(list(iter_records(export_queryset(since=since))), [])
+
+    def test_endpoint(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+        response = self.client.get(self.url, {'issuer': 'Otter'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0])['issuer_name'], 'Otter')
+
+        response = self.client.get(self.url, {'output': 'csv', 'issuer': 'Other'})
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(rows[0], 'uuid,user,type,created_at,issuer_name')
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(self.client.get(self.url, {'output': 'xml'}).status_code, 400)
+
+    def test_date_range_walks_created_at(self):
+        now = timezone.now()
+        objs = list(PyOTP.objects.order_by('id'))
+        # Insertion order and creation order disagree, as with imported rows
+        for offset, obj in zip((5, 1, 3, 3, 0, 2, 4), objs):
+            PyOTP.objects.filter(pk=obj.pk).update(created_at=now - datetime.timedelta(days=offset))
+        since = now - datetime.timedelta(days=3, hours=1)
+        queryset = export_queryset(since=since)
+        self.assertEqual(queryset.query.order_by, ('created_at', 'id'))
+        with CaptureQueriesContext(connection) as queries:
+            records = list(iter_records(queryset, chunk_size=2))
+        self.assertEqual(len(queries), 3)
+        expected = sorted(
+            (obj for obj in PyOTP.objects.filter(created_at__gte=since)), key=lambda obj: (obj.created_at, obj.id),
+        )
+        self.assertEqual([record['uuid'] for record in records], [str(obj.uuid) for obj in expected])
+        self.assertEqual(len(records), 5)
+
+    @override_settings(ROOT_URLCONF='Otter.asgi_urls')
+    async def test_not_served_by_asgi(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(
+            await sync_to_async(User.objects.create_superuser)('admin', 'admin@example.com', 'password'),
+        )
+        response = await client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('manage.py export_otps', response.json()['detail'])
+
+
+class ImportTestCase(TestCase):
+    """
+    Imported secrets are validated, written in chunks and resumable
+    """
+    secret = 'JBSWY3DPEHPK3PXP'
+
+    def setUp(self):
+        User.objects.create_user('otter')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.checkpoint_path = os.path.join(directory, 'import.checkpoint')
+
+    def test_validate(self):
+        record = parse_otpauth('otpauth://hotp/Otter:alice%40example.com?secret=jbsw y3dp ehpk3pxp&counter=5')
+        self.assertEqual(validate(record), {
+            'secret': self.secret, 'count': 5, 'interval': None, 'initial_count': 5,
+            'name': 'alice@example.com', 'issuer_name': 'Otter', 'username': None,
+        })
+        self.assertEqual(validate({'secret': self.secret, 'period': '60'})['interval'], 60)
+        for record in (
+            {},
+            {'secret': 'not-base32!'},
+            {'secret': self.secret, 'type': 'hotp'},
+            {'secret': self.secret, 'digits': '8'},
+            {'secret': self.secret, 'algorithm': 'SHA256'},
+            {'secret': self.secret, 'period': 'x'},
+            parse_otpauth('https://example.com'),
+        ):
+            with self.assertRaises(ValueError):
+                validate(record)
+
+    def test_import_resume(self):
+        records = [{'secret': self.secret, 'username': 'otter', 'issuer': 'Otter'} for _ in range(5)]
+        records[1] = {'secret': self.secret, 'username': 'nobody'}
+        records[3] = {'secret': '1'}
+        rejected = []
+
+        class Interrupted(Exception):
+            pass
+
+        def interrupt(report):
+            if report.read == 2:
+                raise Interrupted
+
+        checkpoint = Checkpoint(self.checkpoint_path)
+        with self.assertRaises(Interrupted):
+            OTPImporter(checkpoint, chunk_size=2, on_chunk=interrupt).run(records)
+        self.assertEqual(PyOTP.objects.count(), 1)
+
+        checkpoint = Checkpoint.load(self.checkpoint_path)
+        self.assertEqual((checkpoint.position, checkpoint.written, checkpoint.rejected), (2, 1, 1))
+        # Replaying the committed chunk does not duplicate it
+        checkpoint.position = 0
+        report = OTPImporter(checkpoint, chunk_size=2, on_reject=rejected.append).run(records)
+        self.assertEqual((report.read, report.written, report.skipped, report.rejected), (5, 2, 1, 2))
+        self.assertEqual((checkpoint.written, checkpoint.skipped), (PyOTP.objects.count(), 1))
+        self.assertEqual([r.index for r in rejected], [1, 3])
+        self.assertEqual(PyOTP.objects.count(), 3)
+        self.assertEqual(PyOTP.objects.filter(user__username='otter', issuer_name='Otter', interval=30).count(), 3)
+
+    def test_command(self):
+        from django.core.management import call_command
+
+        path = os.path.join(os.path.dirname(self.checkpoint_path), 'secrets.csv')
+        with open(path, 'w') as file:
+            file.write('secret,type,counter,name\n{0},hotp,3,a\n{0},totp,,b\nbad,totp,,c\n'.format(self.secret))
+        call_command('import_otps', path, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(sorted(PyOTP.objects.values_list('name', 'count', 'interval')), [('a', 3, None), ('b', None, 30)])
+        self.assertFalse(os.path.exists('{}.checkpoint'.format(path)))
@@ -0,0 +1,197 @@
+import abc
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from collections.abc import Mapping
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+RATE_DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    Parse a DRF style rate
+    :param rate: '<requests>/<period>', e.g. '10/min'
+    :return: (burst, tokens per second)
+    """
+    num, period = rate.split('/')
+    num = int(num)
+    return num, num / RATE_DURATIONS[period[0]]
+
+
+class TokenBucketStore(object):
+    """
+    Sharded in-memory token buckets.
+    Every key costs one small list, each shard has its own lock so concurrent requests rarely contend.
+    Shards keep their buckets in last-use order, so only buckets that refilled completely
+    (and carry no state worth keeping) are evicted, in O(1) per eviction.
+    """
+    def __init__(self, burst, refill_rate, shards=64, max_keys=100000):
+        """
+        :param burst: Bucket capacity
+        :param refill_rate: Tokens added per second
+        :param shards: Number of independently locked shards
+        :param max_keys: Maximum number of tracked keys
+        """
+        self.burst = burst
+        self.refill_rate = refill_rate
+        self.max_keys_per_shard = max(1, max_keys // shards)
+        self._shards = [(OrderedDict(), threading.Lock()) for _ in range(shards)]
+
+    def consume(self, key, now=None, tokens=1):
+        """
+        Take tokens of a key, nothing is taken when there are not enough
+        :param key: Bucket key
+        :param now: Monotonic time (defaults to now)
+        :param tokens: Number of tokens to take
+        :return: (allowed, seconds to wait for the missing tokens)
+        """
+        if now is None:
+            now = time.monotonic()
+        buckets, lock = self._shards[hash(key) % len(self._shards)]
+        with lock:
+            bucket = buckets.get(key)
+            if bucket is None:
+                if len(buckets) >= self.max_keys_per_shard and not self._sweep(buckets, now):
+                    # Every tracked bucket is still refilling: fail closed rather than forget one
+                    oldest = next(iter(buckets.values()))
+                    return False, (self.burst - oldest[0]) / self.refill_rate - (now - oldest[1])
+                bucket = buckets[key] = [float(self.burst), now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.refill_rate)
+                bucket[1] = now
+                buckets.move_to_end(key)
+
+            if bucket[0] >= tokens:
+                bucket[0] -= tokens
+                return True, 0.0
+            return False, (tokens - bucket[0]) / self.refill_rate
+
+    def _sweep(self, buckets, now):
+        """
+        Drop the least recently used buckets that refilled completely
+        :return: True if room was made
+        """
+        full_after = self.burst / self.refill_rate
+        swept = False
+        while buckets:
+            key, bucket = next(iter(buckets.items()))
+            if now - bucket[1] < full_after - bucket[0] / self.refill_rate:
+                break
+            del buckets[key]
+            swept = True
+        return swept
+
+    def __len__(self):
+        return sum(len(buckets) for buckets, _ in self._shards)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(scope):
+    """
+    Per-process token bucket store of a throttle scope
+    :param scope: Key of OTP_THROTTLE_RATES
+    :return: TokenBucketStore or None if the scope has no rate
+    """
+    store = _stores.get(scope)
+    if store is None:
+        rate = getattr(settings, 'OTP_THROTTLE_RATES', {}).get(scope)
+        if rate is None:
+            return None
+        burst, refill_rate = parse_rate(rate)
+        with _stores_lock:
+            store = _stores.setdefault(scope, TokenBucketStore(
+                burst,
+                refill_rate,
+                shards=getattr(settings, 'OTP_THROTTLE_SHARDS', 64),
+                max_keys=getattr(settings, 'OTP_THROTTLE_MAX_KEYS', 100000),
+            ))
+    return store
+
+
+class TokenBucketThrottle(BaseThrottle, metaclass=abc.ABCMeta):
+    """
+    DRF throttle backed by a TokenBucketStore, runs before the view touches the DB
+    """
+    scope = None
+
+    @abc.abstractmethod
+    def get_keys(self, request, view):
+        """
+        :return: Dict of bucket key to number of tokens the request takes
+        """
+
+    def allow_request(self, request, view):
+        self._wait = None
+        store = get_store(self.scope)
+        if store is None:
+            return True
+        keys = self.get_keys(request, view)
+        if any(tokens > store.burst for tokens in keys.values()):
+            # Could never be allowed, waiting would not help
+            return False
+        waits = []
+        for key, tokens in keys.items():
+            allowed, wait = store.consume(key, tokens=tokens)
+            if not allowed:
+                waits.append(wait)
+        if waits:
+            self._wait = max(waits)
+            return False
+        return True
+
+    def wait(self):
+        return self._wait
+
+
+def _normalize_uuid(value):
+    try:
+        return str(uuid.UUID(str(value)))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def _bulk_items(request):
+    """
+    :return: `items` list of a bulk verify body, None for any other request
+    """
+    # The async and lean views pass a plain Django request, which has no parsed `data`
+    data = getattr(request, 'data', None)
+    items = data.get('items') if isinstance(data, Mapping) else None
+    return items if isinstance(items, list) else None
+
+
+class VerifyUUIDThrottle(TokenBucketThrottle):
+    """
+    Throttle verification attempts per PyOTP uuid.
+    A batch takes one token per item from that item's uuid, and is rejected as a whole
+    as soon as one of its uuids is out of tokens.
+    """
+    scope = 'uuid'
+
+    def get_keys(self, request, view):
+        if 'uuid' in view.kwargs:
+            return {_normalize_uuid(view.kwargs['uuid']): 1}
+        items = _bulk_items(request)
+        if items is None:
+            return {}
+        keys = Counter(_normalize_uuid(item.get('uuid')) for item in items if isinstance(item, Mapping))
+        keys.pop(None, None)
+        return keys
+
+
+class VerifyIPThrottle(TokenBucketThrottle):
+    """
+    Throttle verification attempts per client IP, a batch takes one token per item.
+    The IP comes from DRF's `get_ident`, trusting X-Forwarded-For only for NUM_PROXIES proxies.
+    """
+    scope = 'ip'
+
+    def get_keys(self, request, view):
+        items = _bulk_items(request)
+        return {self.get_ident(request): max(1, len(items)) if items is not None else 1}
@@ -0,0 +1,15 @@
+from itertools import islice
+
+
+def chunked(iterable, size):
+    """
+    Split an iterable into lists of at most `size` items
+    :param iterable: Any iterable
+    :param size: Chunk size
+    :return: Generator of lists
+    """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
@@ -1,7 +1,16 @@
-from rest_framework import viewsets, status
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework import permissions, viewsets, status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-import requests
-from . import models, serializers
+from . import metrics as otter_metrics
+from . import models, renderers, serializers, throttling
+from .cache import get_cache
+from .export import EXPORT_FORMATS
+from .callbacks import get_callback_dispatcher
+from .push import get_push_dispatcher
+from .qr import QR_FORMATS, get_renderer
 
 
 class PyOTPViewset(viewsets.GenericViewSet):
@@ -11,6 +20,8 @@ class PyOTPViewset(viewsets.GenericViewSet):
     queryset = models.PyOTP.objects.all()
     lookup_field = 'uuid'
     otp_type = None
+    provision_uri_actions = ('generate_hotp_provision_uri', 'generate_totp_provision_uri')
+    verify_actions = ('verify_otp', 'verify_otp_bulk')
 
     def get_serializer_class(self):
         if self.action == 'generate_hotp':
@@ -21,10 +32,54 @@ class PyOTPViewset(viewsets.GenericViewSet):
             return serializers.HOTPProvisionURISerializer
         elif self.action == 'generate_totp_provision_uri':
             return serializers.TOTPProvisionURISerializer
+        elif self.action == 'generate_hotp_bulk':
+            return serializers.BulkHOTPSerializer
+        elif self.action == 'generate_totp_bulk':
+            return serializers.BulkTOTPSerializer
         elif self.action == 'verify_otp':
             return serializers.VerifyOTPSerializer
+        elif self.action == 'verify_otp_bulk':
+            return serializers.BulkVerifyOTPSerializer
         return serializers.NoneSerializer
 
+    def get_throttles(self):
+        if self.action in self.verify_actions:
+            return [throttling.VerifyIPThrottle(), throttling.VerifyUUIDThrottle()]
+        return super().get_throttles()
+
+    def get_renderers(self):
+        """
+        Provisioning URI views negotiate between PNG/SVG QR code and JSON
+        """
+        if self.action in self.provision_uri_actions:
+            return [renderers.PNGRenderer(), renderers.SVGRenderer(), JSONRenderer()]
+        return super().get_renderers()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """
+        Errors of QR code views are always rendered as JSON
+        """
+        accepted_renderer = getattr(request, 'accepted_renderer', None)
+        if isinstance(accepted_renderer, renderers.QRCodeRenderer) and not isinstance(response.data, bytes):
+            request.accepted_renderer = JSONRenderer()
+            request.accepted_media_type = JSONRenderer.media_type
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def get_object(self):
+        """
+        Verification reads PyOTP objects through the per-process cache
+        :return: PyOTP model object
+        """
+        if self.action != 'verify_otp':
+            return super().get_object()
+
+        cache = get_cache()
+        obj = cache.get(self.kwargs[self.lookup_field])
+        if obj is None:
+            obj = super().get_object()
+            cache.set(obj.uuid, obj)
+        return obj
+
     def _validate(self, serializer, data):
         """
 
@@ -37,6 +92,20 @@ class PyOTPViewset(viewsets.GenericViewSet):
 
         return serializer_instance.save()
 
+    def _provision_uri_response(self, request, data):
+        """
+        Render the provisioning URI as QR code, or return it as JSON
+        :param request: Request
+        :param data: Serializer result with `otp_uuid` and `provisioning_uri`
+        :return: QR code (uuid in the X-OTP-UUID header)/JSON Response
+        """
+        fmt = request.accepted_renderer.format
+        if fmt in QR_FORMATS:
+            image = get_renderer().render(data['provisioning_uri'], fmt)
+            # The image has no room for the uuid the client verifies against later
+            return Response(image, status=status.HTTP_201_CREATED, headers={'X-OTP-UUID': str(data['otp_uuid'])})
+        return Response(data, status=status.HTTP_201_CREATED)
+
     def generate_hotp(self, request):
         """
         Generate HOTP view
@@ -68,7 +137,7 @@ class PyOTPViewset(viewsets.GenericViewSet):
         serializer = self.get_serializer_class()
         serializer = self._validate(serializer, request.data)
 
-        return Response(serializer, status=status.HTTP_201_CREATED)
+        return self._provision_uri_response(request, serializer)
 
     def generate_totp_provision_uri(self, request):
         """
@@ -79,6 +148,32 @@ class PyOTPViewset(viewsets.GenericViewSet):
         serializer = self.get_serializer_class()
         serializer = self._validate(serializer, request.data)
 
+        return self._provision_uri_response(request, serializer)
+
+    def generate_hotp_bulk(self, request):
+        """
+        Generate batch HOTP view
+        :param request: Request
+        :return: HOTP JSON Responses and per-item errors
+        """
+        serializer = self.get_serializer_class()
+        serializer = self._validate(serializer, request.data)
+
+        if not serializer['results']:
+            return Response(serializer, status=status.HTTP_400_BAD_REQUEST)
+        return Response(serializer, status=status.HTTP_201_CREATED)
+
+    def generate_totp_bulk(self, request):
+        """
+        Generate batch TOTP view
+        :param request: Request
+        :return: TOTP JSON Responses and per-item errors
+        """
+        serializer = self.get_serializer_class()
+        serializer = self._validate(serializer, request.data)
+
+        if not serializer['results']:
+            return Response(serializer, status=status.HTTP_400_BAD_REQUEST)
         return Response(serializer, status=status.HTTP_201_CREATED)
 
     def verify_otp(self, request, otp_type, uuid):
@@ -91,13 +186,24 @@ class PyOTPViewset(viewsets.GenericViewSet):
         """
         obj = self.get_object()
         serializer = self.get_serializer_class()
-        serializer = serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        valid_otp = serializer.verify_otp(serializer.data.get('otp'), obj, otp_type)
+        otp = serializer.parse_otp(request.data)
+        valid_otp = serializer().verify_otp(otp, obj, otp_type)
         if not valid_otp:
             return Response(status=status.HTTP_400_BAD_REQUEST)
         return Response(status=status.HTTP_200_OK)
 
+    def verify_otp_bulk(self, request):
+        """
+        Batch OTP Verification view
+        :param request: Request
+        :return: Per-item verification results
+        """
+        serializer = self.get_serializer_class()
+        serializer = serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.verify_bulk(serializer.validated_data['items'])
+        return Response(data={'results': results}, status=status.HTTP_200_OK)
+
 
 class FCMViewset(viewsets.GenericViewSet):
     """
@@ -112,8 +218,15 @@ class FCMViewset(viewsets.GenericViewSet):
             return serializers.FCMVerifySerializer
         elif self.action == 'mobile_push':
             return serializers.FCMMobileSerializer
+        elif self.action == 'push_status':
+            return serializers.FCMStatusSerializer
         return serializers.NoneSerializer
 
+    def get_throttles(self):
+        if self.action == 'verify_push':
+            return [throttling.VerifyIPThrottle()]
+        return super().get_throttles()
+
     def register_push(self, request, uuid):
         """
 
@@ -175,8 +288,94 @@ class FCMViewset(viewsets.GenericViewSet):
             return Response(status=status.HTTP_400_BAD_REQUEST)
         return Response(status=status.HTTP_200_OK)
 
+    def push_status(self, request, uuid, refer):
+        """
+        Long-poll the user's answer to a push, returns as soon as the phone answers
+        :param request: ?timeout= maximum wait (in seconds)
+        :param uuid: UUID
+        :param refer: Refer code
+        :return: pending/approved/denied/expired
+        """
+        serializer = self.get_serializer_class()
+        serializer = serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        result = serializer.push_status(uuid, refer)
+        if result is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(data={'status': result}, status=status.HTTP_200_OK)
+
     def callback(self, result):
+        """
+        Queue the verification result for the relying party callback
+        :param result: Verification result
+        """
+        dispatcher = get_callback_dispatcher()
+        if not dispatcher.url:
+            return
         if result is False:
-            requests.post('http://161.246.5.9', data={'http_code': 400})
+            dispatcher.submit({'http_code': 400})
         else:
-            requests.post('http://161.246.5.9', data={'http_code': 200})
+            dispatcher.submit({'http_code': 200})
+
+
+class ExportViewset(viewsets.GenericViewSet):
+    """
+    Audit export of PyOTP metadata, admin only
+    """
+    permission_classes = (permissions.IsAdminUser,)
+    serializer_class = serializers.ExportSerializer
+
+    def export_otps(self, request):
+        """
+        Stream PyOTP metadata as NDJSON/CSV, memory stays constant whatever the table size
+        :param request: ?output=ndjson|csv&since=&until=&issuer=
+        :return: Streaming response
+        """
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        fmt = serializer.validated_data['output']
+        response = StreamingHttpResponse(serializer.export(), content_type=EXPORT_FORMATS[fmt])
+        response['Content-Disposition'] = 'attachment; filename="pyotp.{}"'.format(fmt)
+        return response
+
+
+def _metrics_allowed(request):
+    """
+    Scrapers send `Authorization: Bearer <METRICS_TOKEN>`, staff users may use their session
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if token and scheme.lower() == 'bearer' and constant_time_compare(credentials.strip(), token):
+        return True
+    return request.user.is_staff
+
+
+def metrics(request):
+    """
+    Prometheus metrics view.
+    Under ASGI only request latency is recorded per route, DB and section metrics of the
+    `sync_to_async` threads are not attributed to a route.
+    :param request: Request
+    :return: Text exposition of request, DB, section and queue metrics, 403 without METRICS_TOKEN or staff session
+    """
+    if not _metrics_allowed(request):
+        return HttpResponseForbidden()
+    cache_stats = get_cache().stats()
+    push = get_push_dispatcher()
+    callback = get_callback_dispatcher().metrics()
+    gauges = [
+        ('otter_pyotp_cache_size', (), cache_stats['size']),
+        ('otter_pyotp_cache_hits', (), cache_stats['hits']),
+        ('otter_pyotp_cache_misses', (), cache_stats['misses']),
+        ('otter_push_queue_depth', (), push.queue_depth),
+        ('otter_push_sent', (), push.sent),
+        ('otter_push_failed', (), push.failed),
+        ('otter_push_dropped', (), push.dropped),
+        ('otter_callback_queue_depth', (), callback['queue_depth']),
+        ('otter_callback_delivered', (), callback['delivered']),
+        ('otter_callback_failed', (), callback['failed']),
+        ('otter_callback_dropped', (), callback['dropped']),
+        ('otter_callback_latency_avg_seconds', (), callback['latency_avg']),
+    ]
+    gauges = [gauge for gauge in gauges if gauge[2] is not None]
+    return HttpResponse(otter_metrics.render(gauges), content_type='text/plain; version=0.0.4')